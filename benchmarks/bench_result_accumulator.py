@@ -0,0 +1,78 @@
+"""Measures the per-test overhead of storing the results of the tests.
+
+Compares the former storage, appending a TSV line to a file for every test
+then parsing the file at the end of the session, with the in-memory
+accumulator. Usage: ``python benchmarks/bench_result_accumulator.py [TESTS]``
+"""
+
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+from pytest_django_queries.results import ResultAccumulator
+
+RESULTS = {
+    "query-count": 12,
+    "duplicates": 4,
+    "db-time": 1.234,
+    "db-time-max": 0.456,
+    "db-time-p50": 0.078,
+    "db-time-p95": 0.321,
+    "similar": 5,
+    "top-fingerprints": [["SELECT * FROM book WHERE id = ?", 3]],
+}
+
+
+def store_tsv(directory, count):
+    save_path = os.path.join(directory, "master")
+    for index in range(count):
+        result_line = "%s\t%s\t%s\n" % (
+            "test_module",
+            "test_foo[%d]" % index,
+            json.dumps(RESULTS),
+        )
+        mode = "a" if os.path.isfile(save_path) else "w"
+        with open(save_path, mode=mode) as fp:
+            fp.write(result_line)
+
+    test_results = {}
+    with open(save_path) as fp:
+        for result_line in fp.readlines():
+            module_name, test_name, results = result_line.strip().split("\t", 2)
+            test_results.setdefault(module_name, {})[test_name] = json.loads(results)
+    return test_results
+
+
+def store_accumulator(directory, count):
+    accumulator = ResultAccumulator()
+    for index in range(count):
+        accumulator.add("test_module", "test_foo[%d]" % index, RESULTS)
+    return accumulator.results
+
+
+def bench(func, count):
+    directory = tempfile.mkdtemp(prefix="pytest-django-queries-bench")
+    try:
+        start = perf_counter()
+        results = func(directory, count)
+        elapsed = perf_counter() - start
+    finally:
+        shutil.rmtree(directory)
+    assert len(results["test_module"]) == count
+    return elapsed
+
+
+def main(count):
+    for name, func in (("TSV file", store_tsv), ("accumulator", store_accumulator)):
+        elapsed = bench(func, count)
+        print(
+            "%-12s %d tests: %8.1f ms total, %6.2f us per test"
+            % (name, count, elapsed * 1000, elapsed * 1e6 / count)
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,100 @@
+"""Measures the peak memory and the time of diffing two large reports.
+
+Compares loading both reports then diffing them as a whole with reading them
+incrementally and diffing them a module at a time. Usage:
+``python benchmarks/bench_streaming_diff.py [MODULES] [TESTS PER MODULE]``
+"""
+
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from pytest_django_queries.cli import scan_report
+from pytest_django_queries.diff import DiffGenerator, DiffLayout, iter_module_diffs
+from pytest_django_queries.entry import flatten_entries
+
+RESULTS = {
+    "query-count": 12,
+    "data-query-count": 10,
+    "transaction-count": 2,
+    "duplicates": 4,
+    "db-time": 1.234,
+    "db-time-max": 0.456,
+    "db-time-p50": 0.078,
+    "db-time-p95": 0.321,
+    "similar": 5,
+    "top-fingerprints": [["SELECT * FROM book WHERE id = ?", 3]],
+}
+
+
+def write_report(path, module_count, test_count):
+    report = {
+        "tests.test_module_%05d" % module_index: {
+            "test_foo[%d]" % test_index: RESULTS for test_index in range(test_count)
+        }
+        for module_index in range(module_count)
+    }
+    with open(path, "w") as fp:
+        json.dump(report, fp, indent=2)
+
+
+def diff_loaded(left_path, right_path):
+    with open(left_path) as fp:
+        left = flatten_entries(json.load(fp))
+    with open(right_path) as fp:
+        right = flatten_entries(json.load(fp))
+    for _, lines in DiffGenerator(left, right):
+        for _ in lines:
+            pass
+
+
+def diff_streamed(left_path, right_path):
+    layout = DiffLayout()
+    left = scan_report(left_path, layout, False, "all")
+    right = scan_report(right_path, layout, False, "all")
+    for _, lines in iter_module_diffs(left, right, layout):
+        for _ in lines:
+            pass
+
+
+def bench(func, left_path, right_path):
+    start = perf_counter()
+    func(left_path, right_path)
+    elapsed = perf_counter() - start
+
+    # Traced separately as tracing slows down the allocations
+    tracemalloc.start()
+    try:
+        func(left_path, right_path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(module_count, test_count):
+    directory = tempfile.mkdtemp(prefix="pytest-django-queries-bench")
+    try:
+        left_path = os.path.join(directory, "left.json")
+        right_path = os.path.join(directory, "right.json")
+        write_report(left_path, module_count, test_count)
+        write_report(right_path, module_count, test_count)
+        for name, func in (("loaded", diff_loaded), ("streamed", diff_streamed)):
+            elapsed, peak = bench(func, left_path, right_path)
+            print(
+                "%-9s %d modules x %d tests: %8.1f ms, %8.1f MiB peak"
+                % (name, module_count, test_count, elapsed * 1000, peak / 2**20)
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50,
+    )
@@ -0,0 +1,115 @@
+import json
+import os.path
+
+from pytest_django_queries.diff import DiffGenerator
+from pytest_django_queries.entry import PHASE_ALL, flatten_entries, get_phase_results
+
+
+class BaselineError(ValueError):
+    pass
+
+
+def load_baseline(path, allow_missing=False):
+    """Loads the results of a baseline report.
+
+    :param allow_missing: Whether a missing baseline is considered as empty
+                          instead of being an error.
+    :type allow_missing: bool
+    """
+    if not os.path.isfile(path):
+        if allow_missing:
+            return {}
+        raise BaselineError("The baseline file does not exist: %s" % path)
+
+    with open(path) as fp:
+        try:
+            baseline = json.load(fp)
+        except ValueError as e:
+            raise BaselineError("The baseline file is not valid json: %s" % str(e))
+    if type(baseline) is not dict:
+        raise BaselineError("The baseline file is not a dictionary")
+    return baseline
+
+
+def is_regression(comparison, tolerance=0, tolerance_percent=0.0):
+    """Returns whether the query count of a test increased by more than
+    both the absolute and the percentage tolerances, and outside
+    of its known variance.
+
+    :type comparison: pytest_django_queries.diff.SingleEntryComparison
+    """
+    if comparison.left is None or comparison.right is None:
+        return False
+    if comparison.within_variance:
+        return False
+    left, right = comparison.left.data_query_count, comparison.right.data_query_count
+    increase = right - left
+    if increase <= tolerance:
+        return False
+    if left:
+        return increase * 100.0 / left > tolerance_percent
+    return True
+
+
+def find_regressions(
+    baseline, results, tolerance=0, tolerance_percent=0.0, phase=PHASE_ALL
+):
+    """Returns the comparisons of the tests that regressed from the baseline.
+
+    :param phase: The phase of the tests to compare (setup, call, teardown or all).
+    :type phase: str
+    :rtype: list[pytest_django_queries.diff.SingleEntryComparison]
+    """
+    diff = DiffGenerator(
+        flatten_entries(baseline, phase=phase), flatten_entries(results, phase=phase)
+    )
+    return [
+        comparison
+        for comparison in diff.iter_comparisons()
+        if is_regression(comparison, tolerance, tolerance_percent)
+    ]
+
+
+def format_regression(comparison):
+    """
+    :type comparison: pytest_django_queries.diff.SingleEntryComparison
+    """
+    left, right = comparison.left.data_query_count, comparison.right.data_query_count
+    increase = "+%d" % (right - left)
+    if left:
+        increase += ", +%.1f%%" % ((right - left) * 100.0 / left)
+    return "%s::%s: %d -> %d queries (%s)" % (
+        comparison.test.module_name,
+        comparison.test.test_name,
+        left,
+        right,
+        increase,
+    )
+
+
+def get_data_query_count(test_data, phase=PHASE_ALL):
+    test_data = get_phase_results(test_data, phase)
+    return test_data.get("data-query-count", test_data["query-count"])
+
+
+def ratchet_baseline(baseline, results, phase=PHASE_ALL):
+    """Returns the baseline updated with the results of the tests that
+    improved or are new. The regressions and the tests that did not run
+    are left unchanged.
+
+    :param phase: The phase of the tests to compare (setup, call, teardown or all).
+    :type phase: str
+    """
+    updated = {
+        module_name: dict(module_entries)
+        for module_name, module_entries in baseline.items()
+    }
+    for module_name, module_entries in results.items():
+        baseline_entries = updated.setdefault(module_name, {})
+        for test_name, test_data in module_entries.items():
+            previous = baseline_entries.get(test_name)
+            if previous is None or get_data_query_count(
+                test_data, phase
+            ) < get_data_query_count(previous, phase):
+                baseline_entries[test_name] = test_data
+    return updated
@@ -0,0 +1,133 @@
+from fnmatch import fnmatchcase
+
+from pytest_django_queries.entry import Entry
+
+# Format: (marker keyword-argument, report field, type, description)
+BUDGET_FIELDS = (
+    ("max_queries", "data-query-count", int, "queries were executed"),
+    ("max_duplicates", "duplicates", int, "duplicated queries were executed"),
+    ("max_db_time_ms", "db-time", float, "ms were spent in the database"),
+)
+BUDGET_NAMES = tuple(name for name, _, _, _ in BUDGET_FIELDS)
+_BUDGET_TYPES = {name: type_ for name, _, type_, _ in BUDGET_FIELDS}
+
+
+class BudgetError(ValueError):
+    pass
+
+
+def parse_budget_value(name, value):
+    """Converts a budget value from the configuration into its type,
+    an empty value disables the budget."""
+    if name not in _BUDGET_TYPES:
+        raise BudgetError(
+            "Unknown query budget: %r, expected one of: %s"
+            % (name, ", ".join(BUDGET_NAMES))
+        )
+    if value is None or value == "":
+        return None
+    try:
+        return _BUDGET_TYPES[name](value)
+    except ValueError:
+        raise BudgetError("Invalid value for the query budget %s: %r" % (name, value))
+
+
+def parse_module_budgets(lines):
+    """Parses the per-module budgets from the configuration.
+
+    Each line is made of a module name pattern and its budgets, e.g.
+    ``myapp.tests.test_orders: max_queries=20, max_duplicates=0``.
+
+    :returns: The (module pattern, budgets) pairs.
+    :rtype: list[(str, dict)]
+    """
+    module_budgets = []
+    for line in lines:
+        pattern, sep, budgets = line.partition(":")
+        if not sep or not pattern.strip():
+            raise BudgetError(
+                "Invalid module query budget: %r, expected "
+                "'<module pattern>: <budget>=<value>, ...'" % line
+            )
+
+        parsed = {}
+        for budget in budgets.replace(",", " ").split():
+            name, sep, value = budget.partition("=")
+            if not sep:
+                raise BudgetError(
+                    "Invalid module query budget: %r, expected "
+                    "'<budget>=<value>'" % budget
+                )
+            parsed[name] = parse_budget_value(name, value)
+        module_budgets.append((pattern.strip(), parsed))
+    return module_budgets
+
+
+class BudgetResolver(object):
+    """Resolves the budgets of the tests from the global and per-module
+    defaults. The budgets of each module are only resolved once."""
+
+    def __init__(self, global_budgets, module_budgets):
+        """
+        :param global_budgets: The budgets applying to every test.
+        :type global_budgets: dict
+        :param module_budgets: The (module pattern, budgets) pairs, the last
+                               matching patterns take precedence.
+        :type module_budgets: list[(str, dict)]
+        """
+        self.global_budgets = global_budgets
+        self.module_budgets = module_budgets
+        self._cache = {}
+
+    def get_module_budgets(self, module_name):
+        if module_name not in self._cache:
+            budgets = dict(self.global_budgets)
+            for pattern, pattern_budgets in self.module_budgets:
+                if fnmatchcase(module_name, pattern):
+                    budgets.update(pattern_budgets)
+            self._cache[module_name] = budgets
+        return self._cache[module_name]
+
+    def get_budgets(self, module_name, marker_kwargs):
+        """Returns the enabled budgets of a test, the budgets
+        of the marker take precedence over the defaults."""
+        budgets = self.get_module_budgets(module_name)
+        overrides = {
+            name: parse_budget_value(name, marker_kwargs[name])
+            for name in BUDGET_NAMES
+            if name in marker_kwargs
+        }
+        if overrides:
+            budgets = dict(budgets, **overrides)
+        return {name: value for name, value in budgets.items() if value is not None}
+
+
+def check_budgets(budgets, results):
+    """Returns the messages describing each exceeded budget.
+
+    :param budgets: The budgets of the test.
+    :type budgets: dict
+    :param results: The results of the test.
+    :type results: dict
+    """
+    errors = []
+    for name, field, _, description in BUDGET_FIELDS:
+        if name not in budgets or field not in results:
+            continue
+        if results[field] > budgets[name]:
+            errors.append(
+                "%s %s, the budget is %s (%s)"
+                % (results[field], description, budgets[name], name)
+            )
+    return errors
+
+
+def format_budget_failure(errors, results):
+    """Returns the failure report of a test exceeding its budgets."""
+    lines = ["Query budget exceeded:"]
+    lines += ["  - %s" % error for error in errors]
+    for field, name in Entry.DETAIL_FIELDS:
+        if results.get(field):
+            lines.append("%s:" % name)
+            lines += ["  %6d  %s" % (count, label) for label, count in results[field]]
+    return "\n".join(lines)
@@ -0,0 +1,146 @@
+from collections import Counter
+
+from django.core.cache import DEFAULT_CACHE_ALIAS
+
+# The cache backend methods that are counted
+CACHE_OPERATIONS = (
+    "get",
+    "get_many",
+    "set",
+    "set_many",
+    "add",
+    "delete",
+    "delete_many",
+)
+
+# The maximum number of repeatedly read keys to report per test
+TOP_CACHE_KEYS_COUNT = 5
+
+_MISSING = object()
+
+
+def get_key_label(alias, key):
+    if alias == DEFAULT_CACHE_ALIAS:
+        return str(key)
+    return "%s:%s" % (alias, key)
+
+
+class CacheCounter(object):
+    """Counts the operations on every given cache backend, their hits
+    and misses, and the keys read more than once.
+
+    The methods of the backends are patched while counting. The operations
+    implemented using other operations (e.g. ``get_many`` calling ``get``
+    on some backends) are only counted once.
+    """
+
+    def __init__(self, caches):
+        """
+        :param caches: The Django cache handler.
+        :type caches: django.core.cache.CacheHandler
+        """
+        self.caches = caches
+        self.operations = Counter()
+        self.hits = 0
+        self.misses = 0
+        # The number of reads of each key
+        self.reads = Counter()
+        self._depth = 0
+        self._patched_methods = []
+
+    def snapshot(self):
+        """Returns the running counters, to later get the operations
+        executed after the snapshot."""
+        return self.operations.copy(), self.hits, self.misses, self.reads.copy()
+
+    def reset(self):
+        self.operations.clear()
+        self.hits = 0
+        self.misses = 0
+        self.reads.clear()
+
+    def rewind(self, snapshot):
+        """Forgets the operations executed since the given snapshot,
+        and returns the snapshot to measure from."""
+        operations, self.hits, self.misses, reads = snapshot
+        self.operations = operations.copy()
+        self.reads = reads.copy()
+        return snapshot
+
+    def get_results(self, snapshot=None):
+        """Returns the results of the operations, since the given snapshot
+        if any."""
+        if snapshot is None:
+            snapshot = (Counter(), 0, 0, Counter())
+        operations = self.operations - snapshot[0]
+        reads = self.reads - snapshot[3]
+
+        results = {
+            "cache-calls": sum(operations.values()),
+            "cache-hits": self.hits - snapshot[1],
+            "cache-misses": self.misses - snapshot[2],
+            "cache-repeated-keys": sum(count - 1 for count in reads.values()),
+            "cache-operations": dict(sorted(operations.items())),
+        }
+        top_keys = [
+            [key, count]
+            for key, count in sorted(
+                reads.items(), key=lambda item: (-item[1], item[0])
+            )[:TOP_CACHE_KEYS_COUNT]
+            if count > 1
+        ]
+        if top_keys:
+            results["top-cache-keys"] = top_keys
+        return results
+
+    def _read(self, alias, keys, found_count):
+        for key in keys:
+            self.reads[get_key_label(alias, key)] += 1
+        self.hits += found_count
+        self.misses += len(keys) - found_count
+
+    def _wrap(self, alias, name, method):
+        def wrapper(*args, **kwargs):
+            if self._depth:
+                return method(*args, **kwargs)
+
+            self._depth += 1
+            try:
+                self.operations[name] += 1
+                if name == "get":
+                    return self._get(alias, method, *args, **kwargs)
+                if name == "get_many":
+                    return self._get_many(alias, method, *args, **kwargs)
+                return method(*args, **kwargs)
+            finally:
+                self._depth -= 1
+
+        return wrapper
+
+    def _get(self, alias, method, key, default=None, *args, **kwargs):
+        value = method(key, _MISSING, *args, **kwargs)
+        found = value is not _MISSING
+        self._read(alias, [key], int(found))
+        return value if found else default
+
+    def _get_many(self, alias, method, keys, *args, **kwargs):
+        keys = list(keys)
+        values = method(keys, *args, **kwargs)
+        self._read(alias, keys, len(values))
+        return values
+
+    def __enter__(self):
+        for alias in self.caches:
+            cache = self.caches[alias]
+            for name in CACHE_OPERATIONS:
+                self._patched_methods.append((cache, name, vars(cache).get(name)))
+                setattr(cache, name, self._wrap(alias, name, getattr(cache, name)))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for cache, name, original in reversed(self._patched_methods):
+            if original is None:
+                delattr(cache, name)
+            else:
+                setattr(cache, name, original)
+        del self._patched_methods[:]
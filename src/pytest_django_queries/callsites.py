@@ -0,0 +1,120 @@
+import os.path
+import sys
+import sysconfig
+from collections import Counter
+from functools import lru_cache
+
+import django
+
+# The maximum number of call sites to report per test
+TOP_CALL_SITES_COUNT = 10
+DEFAULT_SAMPLE_RATE = 1
+DEFAULT_MAX_DEPTH = 30
+UNKNOWN_CALL_SITE = "<unknown>"
+
+_PACKAGE_DIRECTORIES = tuple(
+    os.sep + name + os.sep for name in ("site-packages", "dist-packages")
+)
+
+# Frames from these directories are not considered as application code
+_LIBRARY_PATHS = tuple(
+    os.path.join(os.path.abspath(path), "")
+    for path in {
+        os.path.dirname(django.__file__),
+        os.path.dirname(__file__),
+        sysconfig.get_path("stdlib"),
+        sysconfig.get_path("platstdlib"),
+        sysconfig.get_path("purelib"),
+        sysconfig.get_path("platlib"),
+    }
+    if path
+)
+
+
+@lru_cache(maxsize=None)
+def is_library_file(filename):
+    """Returns whether the given file is part of Django, the plugin,
+    the standard library or an installed package."""
+    if filename.startswith("<"):
+        # Frozen modules and generated code, e.g. '<string>'
+        return True
+    filename = os.path.abspath(filename)
+    return filename.startswith(_LIBRARY_PATHS) or any(
+        directory in filename for directory in _PACKAGE_DIRECTORIES
+    )
+
+
+class CallSiteSampler(object):
+    """Records the first application frame that executed a query,
+    for one out of every ``sample_rate`` queries.
+
+    :param sample_rate: Record one query out of N.
+    :type sample_rate: int
+    :param max_depth: The maximum number of frames to walk up looking for
+                      application code.
+    :type max_depth: int
+    :param rootdir: The directory the reported paths are made relative to.
+    :type rootdir: str
+    """
+
+    def __init__(
+        self, sample_rate=DEFAULT_SAMPLE_RATE, max_depth=DEFAULT_MAX_DEPTH, rootdir=None
+    ):
+        self.sample_rate = max(sample_rate, 1)
+        self.max_depth = max_depth
+        self.rootdir = rootdir
+        self.reset()
+
+    def reset(self):
+        self.call_sites = Counter()
+        self._query_index = 0
+
+    def snapshot(self):
+        """Returns the recorded call sites, see ``rewind``."""
+        return self.call_sites.copy(), self._query_index
+
+    def rewind(self, snapshot):
+        """Forgets the call sites recorded since the given snapshot."""
+        call_sites, self._query_index = snapshot
+        self.call_sites = call_sites.copy()
+
+    def sample(self, depth=1):
+        """Records the call site of the query being executed if it is sampled.
+
+        :param depth: The number of frames to skip (the callers
+                      from the capture code).
+        """
+        self._query_index += 1
+        if self._query_index % self.sample_rate:
+            return
+
+        frame = sys._getframe(depth + 1)
+        for _ in range(self.max_depth):
+            if frame is None:
+                break
+            if not is_library_file(frame.f_code.co_filename):
+                self.call_sites[(frame.f_code.co_filename, frame.f_lineno)] += 1
+                return
+            frame = frame.f_back
+        self.call_sites[(UNKNOWN_CALL_SITE, None)] += 1
+
+    def _format_call_site(self, filename, lineno):
+        if lineno is None:
+            return filename
+        if self.rootdir and filename.startswith(os.path.join(self.rootdir, "")):
+            filename = os.path.relpath(filename, self.rootdir)
+        return "%s:%d" % (filename, lineno)
+
+    def get_results(self):
+        """Returns the most frequent call sites as (file:line, count) pairs."""
+        call_sites = Counter()
+        for (filename, lineno), count in self.call_sites.items():
+            call_sites[self._format_call_site(filename, lineno)] += count
+        if not call_sites:
+            return {}
+        return {
+            "call-sites": [
+                [call_site, count]
+                for call_site, count in call_sites.most_common(TOP_CALL_SITES_COUNT)
+            ]
+        }
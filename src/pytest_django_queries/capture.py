@@ -0,0 +1,868 @@
+from array import array
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from copy import deepcopy
+from itertools import islice
+from time import perf_counter
+
+from django.core.cache import caches
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, reset_queries
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+
+from pytest_django_queries.cache import CacheCounter
+from pytest_django_queries.entry import PHASE_CALL
+from pytest_django_queries.explain import is_select
+from pytest_django_queries.instances import InstanceCounter
+from pytest_django_queries.resources import ResourceMeter
+from pytest_django_queries.rows import RowCounter
+from pytest_django_queries.sql import (
+    classify_statement,
+    fingerprint_sql,
+    is_transaction_control,
+)
+from pytest_django_queries.utils import percentile
+
+CAPTURE_MODE_FULL = "full"
+CAPTURE_MODE_COUNT = "count"
+CAPTURE_MODES = (CAPTURE_MODE_FULL, CAPTURE_MODE_COUNT)
+
+# Transaction statements that Django logs itself when the debug cursor is used,
+# without going through the execute wrappers.
+# Format: (method name, logged SQL)
+_TRANSACTION_METHODS = (("_commit", "COMMIT"), ("_rollback", "ROLLBACK"))
+
+# The maximum number of repeated query fingerprints to report per test
+TOP_FINGERPRINTS_COUNT = 5
+
+
+def get_query_key(sql, params, many):
+    """Returns a hashable key identifying a query the same way
+    ``CaptureQueriesContext`` would log it."""
+    if many:
+        try:
+            times = len(params)
+        except TypeError:
+            # params could be an iterator.
+            times = "?"
+        return "%s times: %s" % (times, sql), None
+    return sql, repr(params) if params else None
+
+
+def get_time_stats(durations):
+    """Returns the total, max, median and 95th percentile of the given
+    query durations (in seconds), in milliseconds."""
+    durations = sorted(durations)
+    stats = {
+        "db-time": sum(durations),
+        "db-time-max": durations[-1] if durations else 0,
+        "db-time-p50": percentile(durations, 50),
+        "db-time-p95": percentile(durations, 95),
+    }
+    return {key: round(value * 1000, 3) for key, value in stats.items()}
+
+
+def clear_caches():
+    """Clears every configured cache, for the next queries to run
+    against cold caches."""
+    for cache in caches.all():
+        cache.clear()
+
+
+def get_stability_stats(pass_counts):
+    """Returns the min, max and most common query counts of the passes of
+    a repeated test, and whether the count varied between the passes."""
+    frequencies = Counter(pass_counts)
+    results = {
+        "query-count-min": min(pass_counts),
+        "query-count-max": max(pass_counts),
+        # The lowest of the most common counts
+        "query-count-mode": max(
+            frequencies, key=lambda count: (frequencies[count], -count)
+        ),
+    }
+    results["unstable"] = results["query-count-min"] != results["query-count-max"]
+    return results
+
+
+def get_fingerprint_stats(fingerprints):
+    """Returns the number of queries similar to a previous one, and the most
+    repeated fingerprints.
+
+    :param fingerprints: The number of data queries per fingerprint.
+    :type fingerprints: Counter
+    """
+    results = {"similar": sum(fingerprints.values()) - len(fingerprints)}
+    top_fingerprints = [
+        [fingerprint, count]
+        for fingerprint, count in fingerprints.most_common(TOP_FINGERPRINTS_COUNT)
+        if count > 1
+    ]
+    if top_fingerprints:
+        results["top-fingerprints"] = top_fingerprints
+    return results
+
+
+def get_statement_stats(fingerprints):
+    """Returns the number of data queries per verb, and per table and verb.
+
+    The statements are classified by fingerprint, thus each distinct
+    statement is only scanned once.
+
+    :param fingerprints: The number of data queries per fingerprint.
+    :type fingerprints: Counter
+    """
+    statements = Counter()
+    tables = {}
+    for fingerprint, count in fingerprints.items():
+        verb, statement_tables = classify_statement(fingerprint)
+        statements[verb] += count
+        for table in statement_tables:
+            table_verbs = tables.setdefault(table, Counter())
+            table_verbs[verb] += count
+
+    results = {}
+    if statements:
+        results["statements"] = dict(sorted(statements.items()))
+    if tables:
+        results["tables"] = {
+            table: dict(sorted(verbs.items()))
+            for table, verbs in sorted(tables.items())
+        }
+    return results
+
+
+def get_endpoint(environ=None, scope=None):
+    """Returns the method and the resolved URL name of a request,
+    e.g. ``GET book-detail``, or its path if it could not be resolved.
+
+    :param environ: The WSGI environ of the request.
+    :type environ: dict
+    :param scope: The ASGI scope of the request.
+    :type scope: dict
+    """
+    if scope is not None:
+        method, path = scope.get("method", ""), scope.get("path", "")
+    else:
+        environ = environ or {}
+        method, path = environ.get("REQUEST_METHOD", ""), environ.get("PATH_INFO", "")
+    try:
+        name = resolve(path).view_name
+    except Resolver404:
+        name = path
+    return ("%s %s" % (method, name)).strip()
+
+
+class QueryCounter(object):
+    """Counts the queries executed against a connection without storing them.
+
+    Unlike ``CaptureQueriesContext``, it does not force the debug cursor,
+    thus Django does not format and log each executed query. Only running
+    counters, the hash of every distinct query, the number of queries per
+    fingerprint and the query durations are kept.
+    """
+
+    def __init__(self, connection, call_sites=None, explain=False, rows=False):
+        """
+        :param call_sites: The sampler recording the call sites of the queries,
+                           if enabled.
+        :type call_sites: CallSiteSampler
+        :param explain: Whether to keep the first SELECT query of each
+                        fingerprint, to explain them.
+        :type explain: bool
+        :param rows: Whether to count the rows fetched and affected,
+                     which wraps the database cursors executing the queries.
+        :type rows: bool
+        """
+        self.connection = connection
+        self.call_sites = call_sites
+        self.explain = explain
+        self.rows = RowCounter() if rows else None
+        self._patched_methods = {}
+        self.reset()
+
+    def reset(self):
+        self.query_count = 0
+        self.transaction_count = 0
+        self.duplicate_count = 0
+        self.durations = array("d")
+        self.fingerprints = Counter()
+        # The (sql, params) of the first SELECT query of each fingerprint
+        self.select_samples = {}
+        if self.rows is not None:
+            self.rows.reset()
+        # The keys of the queries seen, in their order to rewind them
+        self._seen = {}
+
+    def __len__(self):
+        return self.query_count
+
+    @property
+    def data_query_count(self):
+        """The number of queries, without the transaction control statements."""
+        return self.query_count - self.transaction_count
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.call_sites is not None:
+            self.call_sites.sample()
+        query_rows = None
+        if self.rows is not None:
+            query_rows = self.rows.track(context["cursor"], fingerprint_sql(sql))
+        start = perf_counter()
+        try:
+            result = execute(sql, params, many, context)
+        finally:
+            self.record(sql, params, many, perf_counter() - start)
+        if query_rows is not None and not is_select(sql):
+            self.rows.add_affected(query_rows, context["cursor"])
+        return result
+
+    def record(self, sql, params, many, duration):
+        self.query_count += 1
+        self.durations.append(duration)
+        if is_transaction_control(sql):
+            # Depends on how the code is wrapped into transactions, thus
+            # left out of the duplicated and similar queries
+            self.transaction_count += 1
+            return
+
+        key = hash(get_query_key(sql, params, many))
+        fingerprint = fingerprint_sql(sql)
+        self.fingerprints[fingerprint] += 1
+        if (
+            self.explain
+            and not many
+            and fingerprint not in self.select_samples
+            and is_select(sql)
+        ):
+            self.select_samples[fingerprint] = (sql, params)
+        if key in self._seen:
+            self.duplicate_count += 1
+        else:
+            self._seen[key] = None
+
+    def snapshot(self):
+        """Returns the running counters, to later get the results
+        of the queries executed after the snapshot."""
+        rows_fetched = rows_affected = 0
+        if self.rows is not None:
+            rows_fetched, rows_affected = (
+                self.rows.rows_fetched,
+                self.rows.rows_affected,
+            )
+        return (
+            self.query_count,
+            self.transaction_count,
+            self.duplicate_count,
+            len(self.durations),
+            self.fingerprints.copy(),
+            rows_fetched,
+            rows_affected,
+        )
+
+    def checkpoint(self):
+        """Returns the whole state of the counter, to later forget the queries
+        executed after the checkpoint, see ``rewind``."""
+        worst_query = self.rows.worst_query if self.rows is not None else None
+        return (
+            self.snapshot(),
+            len(self.select_samples),
+            len(self._seen),
+            worst_query,
+        )
+
+    def rewind(self, checkpoint):
+        """Forgets the queries executed since the given checkpoint."""
+        snapshot, sample_count, seen_count, worst_query = checkpoint
+        (
+            self.query_count,
+            self.transaction_count,
+            self.duplicate_count,
+            duration_count,
+            fingerprints,
+            rows_fetched,
+            rows_affected,
+        ) = snapshot
+        del self.durations[duration_count:]
+        self.fingerprints = fingerprints.copy()
+        self.select_samples = dict(islice(self.select_samples.items(), sample_count))
+        self._seen = dict.fromkeys(islice(self._seen, seen_count))
+        if self.rows is not None:
+            self.rows.rows_fetched = rows_fetched
+            self.rows.rows_affected = rows_affected
+            self.rows.worst_query = worst_query
+
+    def get_results(self):
+        results = {
+            "query-count": self.query_count,
+            "data-query-count": self.data_query_count,
+            "transaction-count": self.transaction_count,
+            "duplicates": self.duplicate_count,
+        }
+        results.update(get_time_stats(self.durations))
+        results.update(get_fingerprint_stats(self.fingerprints))
+        results.update(get_statement_stats(self.fingerprints))
+        if self.rows is not None:
+            results.update(self.rows.get_results())
+        return results
+
+    def _wrap_transaction_method(self, method, sql):
+        def wrapper(*args, **kwargs):
+            if self.connection.connection is None:
+                return method(*args, **kwargs)
+
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(sql, None, False, perf_counter() - start)
+
+        return wrapper
+
+    def _wrap_set_autocommit(self, method):
+        def wrapper(autocommit):
+            if autocommit:
+                return method(autocommit)
+
+            start = perf_counter()
+            try:
+                return method(autocommit)
+            finally:
+                self.record("BEGIN", None, False, perf_counter() - start)
+
+        return wrapper
+
+    def _patch(self, name, wrapper):
+        self._patched_methods[name] = vars(self.connection).get(name)
+        setattr(self.connection, name, wrapper)
+
+    def _unpatch(self):
+        for name, original in self._patched_methods.items():
+            if original is None:
+                delattr(self.connection, name)
+            else:
+                setattr(self.connection, name, original)
+        self._patched_methods.clear()
+
+    def __enter__(self):
+        self.connection.execute_wrappers.append(self)
+        for name, sql in _TRANSACTION_METHODS:
+            self._patch(
+                name, self._wrap_transaction_method(getattr(self.connection, name), sql)
+            )
+        self._patch(
+            "_set_autocommit",
+            self._wrap_set_autocommit(self.connection._set_autocommit),
+        )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._unpatch()
+        self.connection.execute_wrappers.remove(self)
+        if self.rows is not None:
+            self.rows.untrack()
+
+
+class QuerySegment(object):
+    """The queries executed against some counters between snapshots of them,
+    such as the queries of a phase or of a section of a test."""
+
+    def __init__(self):
+        self.query_count = 0
+        self.transaction_count = 0
+        self.duplicate_count = 0
+        self.durations = array("d")
+        self.fingerprints = Counter()
+        # Whether the rows were counted, and the rows fetched and affected
+        self.counts_rows = False
+        self.rows_fetched = 0
+        self.rows_affected = 0
+
+    def add(self, counter, snapshot):
+        """Adds the queries executed against a counter since the given snapshot.
+
+        :type counter: QueryCounter
+        :param snapshot: The snapshot of the counter, see ``QueryCounter.snapshot``.
+        :type snapshot: tuple
+        """
+        (
+            query_count,
+            transaction_count,
+            duplicate_count,
+            duration_count,
+            fingerprints,
+            rows_fetched,
+            rows_affected,
+        ) = snapshot
+        self.query_count += counter.query_count - query_count
+        self.transaction_count += counter.transaction_count - transaction_count
+        self.duplicate_count += counter.duplicate_count - duplicate_count
+        self.durations += counter.durations[duration_count:]
+        self.fingerprints += counter.fingerprints - fingerprints
+        if counter.rows is not None:
+            self.counts_rows = True
+            self.rows_fetched += counter.rows.rows_fetched - rows_fetched
+            self.rows_affected += counter.rows.rows_affected - rows_affected
+
+    def get_results(self):
+        results = {
+            "query-count": self.query_count,
+            "data-query-count": self.query_count - self.transaction_count,
+            "transaction-count": self.transaction_count,
+            "duplicates": self.duplicate_count,
+        }
+        results.update(get_time_stats(self.durations))
+        results.update(get_fingerprint_stats(self.fingerprints))
+        return results
+
+    def get_row_results(self):
+        """Returns the rows fetched and affected, if they were counted."""
+        if not self.counts_rows:
+            return {}
+        return {
+            "rows-fetched": self.rows_fetched,
+            "rows-affected": self.rows_affected,
+        }
+
+    def merge(self, segment):
+        """Adds the queries of another segment."""
+        self.query_count += segment.query_count
+        self.transaction_count += segment.transaction_count
+        self.duplicate_count += segment.duplicate_count
+        self.durations += segment.durations
+        self.fingerprints += segment.fingerprints
+        self.counts_rows = self.counts_rows or segment.counts_rows
+        self.rows_fetched += segment.rows_fetched
+        self.rows_affected += segment.rows_affected
+
+
+def get_phase_segment_results(segment):
+    """Returns the results of the queries of a phase, with the same query
+    breakdowns as the results of the whole test."""
+    results = segment.get_results()
+    results.update(get_statement_stats(segment.fingerprints))
+    results.update(segment.get_row_results())
+    return results
+
+
+class EndpointSegment(QuerySegment):
+    """The queries executed by the requests to an endpoint."""
+
+    def __init__(self):
+        super(EndpointSegment, self).__init__()
+        self.request_count = 0
+        self.max_request_query_count = 0
+
+    def add_request(self, segment):
+        """Adds the queries of a request to the endpoint."""
+        self.request_count += 1
+        self.max_request_query_count = max(
+            self.max_request_query_count,
+            segment.query_count - segment.transaction_count,
+        )
+        self.merge(segment)
+
+    def get_results(self):
+        results = super(EndpointSegment, self).get_results()
+        results["request-count"] = self.request_count
+        results["request-query-count-max"] = self.max_request_query_count
+        return results
+
+
+class LazyCaptureQueriesContext(CaptureQueriesContext):
+    """Same as ``CaptureQueriesContext`` but without opening the connection
+    when entering the context, as the test may not be allowed to access
+    the database or may never use it."""
+
+    def __enter__(self):
+        self.force_debug_cursor = self.connection.force_debug_cursor
+        self.connection.force_debug_cursor = True
+        self.initial_queries = len(self.connection.queries_log)
+        self.final_queries = None
+        request_started.disconnect(reset_queries)
+        return self
+
+
+class QueryCapture(object):
+    """Captures the queries executed against every given connection.
+
+    Each connection gets its own counter, thus a query only goes through
+    the counter of the connection it was executed against. In the full
+    capture mode, the queries are also stored using ``CaptureQueriesContext``
+    for the test to inspect them.
+    """
+
+    def __init__(
+        self,
+        connections,
+        mode=CAPTURE_MODE_FULL,
+        call_sites=None,
+        explain=False,
+        resources=False,
+        models=False,
+        cache=False,
+    ):
+        """
+        :param call_sites: The sampler recording the call sites of the queries,
+                           if enabled.
+        :type call_sites: CallSiteSampler
+        :param explain: Whether to keep the SELECT queries to explain.
+        :type explain: bool
+        :param resources: Whether to measure the wall time, CPU time
+                          and memory peak.
+        :type resources: bool
+        :param models: Whether to count the model instances created.
+        :type models: bool
+        :param cache: Whether to count the operations on the cache backends.
+        :type cache: bool
+        """
+        self.mode = mode
+        self.call_sites = call_sites
+        # The optional measures of the test other than its queries,
+        # the resources being measured last to leave out the other ones
+        self.meters = []
+        if models:
+            self.meters.append(InstanceCounter())
+        if cache:
+            self.meters.append(CacheCounter(caches))
+        if resources:
+            self.meters.append(ResourceMeter())
+        self.counters = {}
+        self.capture_contexts = {}
+        for connection in connections:
+            # The rows are not counted in the counting-only mode,
+            # which leaves the database cursors untouched
+            self.counters[connection.alias] = QueryCounter(
+                connection,
+                call_sites=call_sites,
+                explain=explain,
+                rows=mode == CAPTURE_MODE_FULL,
+            )
+            if mode == CAPTURE_MODE_FULL:
+                self.capture_contexts[connection.alias] = self._make_context(connection)
+        # The query count of each pass when the test is repeated
+        self.pass_counts = []
+        # The query count of the pass run against cold caches, if any
+        self.cold_count = None
+        # The results of the ended phases of the test (setup, call, teardown)
+        self.phases = {}
+        # The queries of each named section of the test
+        self.sections = {}
+        # The queries of the requests to each endpoint, and the endpoint
+        # and the snapshot of the requests in progress
+        self.endpoints = {}
+        self._requests = []
+        self._phase = None
+        self._phase_start = None
+        self._phase_meters_start = None
+        # The whole state of the capture at the start of the current phase,
+        # to forget the previous passes of a repeated test
+        self._phase_checkpoint = None
+        self._exit_stack = None
+
+    @staticmethod
+    def _make_context(connection):
+        if connection.alias == DEFAULT_DB_ALIAS:
+            return CaptureQueriesContext(connection)
+        return LazyCaptureQueriesContext(connection)
+
+    @property
+    def connection(self):
+        """The default connection, for compatibility with
+        ``CaptureQueriesContext``."""
+        return self.counters[DEFAULT_DB_ALIAS].connection
+
+    @property
+    def captured_queries(self):
+        """The queries captured from every connection,
+        only available in the full capture mode."""
+        if self.mode != CAPTURE_MODE_FULL:
+            raise AttributeError(
+                "Queries are only stored in the '%s' capture mode" % CAPTURE_MODE_FULL
+            )
+        queries = []
+        for _, context in sorted(self.capture_contexts.items()):
+            queries += context.captured_queries
+        return queries
+
+    def __iter__(self):
+        return iter(self.captured_queries)
+
+    def __getitem__(self, index):
+        return self.captured_queries[index]
+
+    def __len__(self):
+        return sum(len(counter) for counter in self.counters.values())
+
+    @property
+    def data_query_count(self):
+        """The number of queries, without the transaction control statements."""
+        return sum(counter.data_query_count for counter in self.counters.values())
+
+    def get_totals(self):
+        """Returns the query counts and the database time of the whole capture,
+        without computing the other results."""
+        counters = self.counters.values()
+        return {
+            "query-count": len(self),
+            "data-query-count": self.data_query_count,
+            "duplicates": sum(counter.duplicate_count for counter in counters),
+            "db-time": round(
+                sum(sum(counter.durations) for counter in counters) * 1000, 3
+            ),
+        }
+
+    def get_select_samples(self):
+        """Returns the connection, SQL and parameters of the first
+        SELECT query of each fingerprint."""
+        samples = {}
+        for _, counter in sorted(self.counters.items()):
+            for fingerprint, (sql, params) in counter.select_samples.items():
+                samples.setdefault(fingerprint, (counter.connection, sql, params))
+        return samples
+
+    def _snapshot(self):
+        return {alias: counter.snapshot() for alias, counter in self.counters.items()}
+
+    def _get_phase_data_query_count(self):
+        """The data query count of the current phase,
+        or of the whole capture outside of a phase."""
+        count = self.data_query_count
+        if self._phase is not None:
+            for query_count, transaction_count, *_ in self._phase_start.values():
+                count -= query_count - transaction_count
+        return count
+
+    def _get_segment(self, snapshot, segment=None):
+        """Returns the queries executed since the given snapshot,
+        added to the given segment if any."""
+        if segment is None:
+            segment = QuerySegment()
+        for alias, counter in sorted(self.counters.items()):
+            segment.add(counter, snapshot[alias])
+        return segment
+
+    def start_phase(self, name):
+        """Ends the current phase of the test, if any, and starts the given one."""
+        self.end_phase()
+        self._phase = name
+        self._phase_checkpoint = self._checkpoint()
+        self._phase_start = {
+            alias: checkpoint[0]
+            for alias, checkpoint in self._phase_checkpoint[0].items()
+        }
+        self._phase_meters_start = [meter.snapshot() for meter in self.meters]
+
+    def _get_phase_results(self):
+        """Returns the results of the current phase, broken down by database
+        alias as the results of the whole test."""
+        total = QuerySegment()
+        databases = {}
+        for alias, counter in sorted(self.counters.items()):
+            segment = QuerySegment()
+            segment.add(counter, self._phase_start[alias])
+            total.merge(segment)
+            databases[alias] = get_phase_segment_results(segment)
+
+        results = get_phase_segment_results(total)
+        if len(databases) > 1:
+            results["databases"] = databases
+        for meter, start in zip(self.meters, self._phase_meters_start):
+            results.update(meter.get_results(start))
+        return results
+
+    def end_phase(self):
+        """Records the results of the current phase of the test, if any."""
+        if self._phase is None:
+            return
+        self.phases[self._phase] = self._get_phase_results()
+        self._phase = None
+        self._phase_start = None
+        self._phase_meters_start = None
+        self._phase_checkpoint = None
+
+    def get_phases(self):
+        """Returns the results of each phase of the test,
+        including the current one."""
+        phases = dict(self.phases)
+        if self._phase is not None:
+            phases[self._phase] = self._get_phase_results()
+        return phases
+
+    @contextmanager
+    def section(self, name):
+        """Counts the queries executed within the block separately,
+        under the given name. The queries of a section entered multiple times
+        are added up.
+
+        >>> with count_queries.section("list-render"):
+        ...     client.get("/books/")
+        """
+        if not name or not isinstance(name, str):
+            raise ValueError("Invalid section name: %r" % (name,))
+        snapshot = self._snapshot()
+        try:
+            yield
+        finally:
+            self._get_segment(snapshot, self.sections.setdefault(name, QuerySegment()))
+
+    def end_pass(self):
+        """Records the query count of a pass of a repeated test."""
+        self.pass_counts.append(self._get_phase_data_query_count())
+
+    def end_cold_pass(self):
+        """Records the query count of the pass run against cold caches,
+        the next passes being run against warm caches."""
+        self.cold_count = self._get_phase_data_query_count()
+
+    def _checkpoint(self):
+        """Returns the state of the counters, of the captured queries,
+        of the call sites, of the sections and of the endpoints."""
+        return (
+            {alias: counter.checkpoint() for alias, counter in self.counters.items()},
+            {
+                alias: len(context.connection.queries_log)
+                for alias, context in self.capture_contexts.items()
+            },
+            self.call_sites.snapshot() if self.call_sites is not None else None,
+            deepcopy(self.sections),
+            deepcopy(self.endpoints),
+        )
+
+    def _rewind(self, checkpoint):
+        """Forgets everything captured since the given checkpoint."""
+        counters, query_logs, call_sites, sections, endpoints = checkpoint
+        for alias, counter in self.counters.items():
+            counter.rewind(counters[alias])
+        for alias, context in self.capture_contexts.items():
+            queries_log = context.connection.queries_log
+            while len(queries_log) > query_logs[alias]:
+                queries_log.pop()
+        if call_sites is not None:
+            self.call_sites.rewind(call_sites)
+        self.sections = deepcopy(sections)
+        self.endpoints = deepcopy(endpoints)
+
+    def reset(self):
+        """Forgets the queries of the previous pass of a repeated test, the
+        results are then the ones of the last pass and their stability.
+
+        Within a phase, only the queries of the phase are forgotten, thus
+        the results of the test remain the ones of the previous phases
+        (e.g. the fixtures) and of the last pass.
+        """
+        if self._phase is not None:
+            self._rewind(self._phase_checkpoint)
+            self._phase_meters_start = [
+                meter.rewind(start)
+                for meter, start in zip(self.meters, self._phase_meters_start)
+            ]
+            return
+
+        for counter in self.counters.values():
+            counter.reset()
+        for context in self.capture_contexts.values():
+            context.initial_queries = len(context.connection.queries_log)
+        if self.call_sites is not None:
+            self.call_sites.reset()
+        for meter in self.meters:
+            meter.reset()
+        self.sections = {}
+        self.endpoints = {}
+
+    def __enter__(self):
+        with ExitStack() as stack:
+            # Capture contexts are entered first as they may open the
+            # connection which should not be timed
+            for context in self.capture_contexts.values():
+                stack.enter_context(context)
+            for counter in self.counters.values():
+                stack.enter_context(counter)
+            request_started.connect(self._request_started)
+            stack.callback(request_started.disconnect, self._request_started)
+            request_finished.connect(self._request_finished)
+            stack.callback(request_finished.disconnect, self._request_finished)
+            for meter in self.meters:
+                stack.enter_context(meter)
+            self._exit_stack = stack.pop_all()
+        return self
+
+    def _request_started(self, sender, environ=None, scope=None, **kwargs):
+        self._requests.append((get_endpoint(environ, scope), self._snapshot()))
+
+    def _request_finished(self, sender, **kwargs):
+        if not self._requests:
+            return
+        endpoint, snapshot = self._requests.pop()
+        self.endpoints.setdefault(endpoint, EndpointSegment()).add_request(
+            self._get_segment(snapshot)
+        )
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._exit_stack.__exit__(exc_type, exc_value, traceback)
+
+    def get_results(self):
+        """Returns the results to save into the report.
+
+        When multiple databases are configured, the results are
+        also broken down by database alias."""
+        databases = {}
+        durations = array("d")
+        fingerprints = Counter()
+        for alias, counter in sorted(self.counters.items()):
+            databases[alias] = counter.get_results()
+            durations += counter.durations
+            fingerprints += counter.fingerprints
+
+        query_count = sum(db["query-count"] for db in databases.values())
+        results = {
+            "query-count": query_count,
+            "data-query-count": self.data_query_count,
+            "transaction-count": sum(
+                db["transaction-count"] for db in databases.values()
+            ),
+            "duplicates": sum(db["duplicates"] for db in databases.values()),
+        }
+        results.update(get_time_stats(durations))
+        results.update(get_fingerprint_stats(fingerprints))
+        results.update(get_statement_stats(fingerprints))
+        if self.mode == CAPTURE_MODE_FULL:
+            results.update(
+                RowCounter.combine(
+                    counter.rows for _, counter in sorted(self.counters.items())
+                ).get_results()
+            )
+        if self.call_sites is not None:
+            results.update(self.call_sites.get_results())
+        for meter in self.meters:
+            results.update(meter.get_results())
+        pass_stats = {}
+        if self.cold_count is not None:
+            pass_stats["query-count-cold"] = self.cold_count
+            # The warm count is the one of the last pass, as the cold count
+            # it does not include the queries of the fixtures
+            pass_stats["query-count-warm"] = self.pass_counts[-1]
+        if len(self.pass_counts) > 1:
+            pass_stats.update(get_stability_stats(self.pass_counts))
+        results.update(pass_stats)
+        if len(databases) > 1:
+            results["databases"] = databases
+
+        if self.endpoints:
+            results["requests"] = {
+                endpoint: segment.get_results()
+                for endpoint, segment in sorted(self.endpoints.items())
+            }
+        if self.sections:
+            results["sections"] = {
+                name: segment.get_results() for name, segment in self.sections.items()
+            }
+
+        phases = self.get_phases()
+        if phases:
+            if PHASE_CALL in phases:
+                # The passes are all run during the call phase
+                phases[PHASE_CALL].update(pass_stats)
+            results["phases"] = phases
+        return results
@@ -6,13 +6,29 @@ import click
 from jinja2 import Template
 from jinja2 import exceptions as jinja_exceptions
 
-from pytest_django_queries.diff import DiffGenerator
-from pytest_django_queries.entry import flatten_entries
+from pytest_django_queries.diff import DiffGenerator, DiffLayout, iter_module_diffs
+from pytest_django_queries.entry import (
+    PHASE_ALL,
+    PHASE_CALL,
+    PHASE_CHOICES,
+    Entry,
+    flatten_entries,
+)
+from pytest_django_queries.explain import diff_plans
 from pytest_django_queries.plugin import (
     DEFAULT_OLD_RESULT_FILENAME,
     DEFAULT_RESULT_FILENAME,
+    DEFAULT_STORE_FILENAME,
+)
+from pytest_django_queries.results import ReportError, iter_report_modules, load_report
+from pytest_django_queries.store import LATEST_RUN, ResultStore, StoreError
+from pytest_django_queries.tables import (
+    entries_to_html,
+    print_details,
+    print_endpoints,
+    print_entries,
+    print_hot_tables,
 )
-from pytest_django_queries.tables import entries_to_html, print_entries
 from pytest_django_queries.utils import create_backup
 
 HERE = dirname(__file__)
@@ -22,6 +38,9 @@ DEFAULT_HTML_SAVE_PATH = "django-queries-results.html"
 DIFF_TERM_COLOR = {"-": "red", "+": "green"}
 DEFAULT_TERM_DIFF_COLOR = None
 
+# Displays every optional column of the show command
+ALL_COLUMNS = "all"
+
 
 def _write_html_to_file(content, path):
     with open(path, "w") as fp:
@@ -42,6 +61,88 @@ class JsonReportFileParamType(click.File):
                 self.fail("The file is not valid json: %s" % str(e), param, ctx)
 
 
+def get_run_results(param_type, store, value, param, ctx):
+    """Returns the results of the run referred to by the given value."""
+    try:
+        return store.get_results(store.resolve_run(value))
+    except StoreError as e:
+        param_type.fail(str(e), param, ctx)
+
+
+class ReportParamType(JsonReportFileParamType):
+    """A JSON report file, or a run reference if a result store is passed."""
+
+    name = "report"
+
+    def convert(self, value, param, ctx):
+        store = ctx.params.get("store") if ctx else None
+        if store is None:
+            return super(ReportParamType, self).convert(value, param, ctx)
+        return get_run_results(self, store, value, param, ctx)
+
+
+class StreamedReportParamType(click.Path):
+    """The path to a JSON report file to read incrementally, or the results
+    of a run if a result store is passed."""
+
+    name = "report"
+
+    def __init__(self):
+        super(StreamedReportParamType, self).__init__(exists=True, dir_okay=False)
+
+    def convert(self, value, param, ctx):
+        store = ctx.params.get("store") if ctx else None
+        if store is None:
+            return super(StreamedReportParamType, self).convert(value, param, ctx)
+        return get_run_results(self, store, value, param, ctx)
+
+
+def iter_report(report):
+    """Yields the name and tests of each module of the results of a run,
+    or of a JSON report read incrementally."""
+    if isinstance(report, dict):
+        for module in sorted(report.items()):
+            yield module
+        return
+    with open(report) as fp:
+        for module in iter_report_modules(fp):
+            yield module
+
+
+def scan_report(report, layout, by_database, phase):
+    """Adds the entries of a report to the layout of the diff, and returns
+    its modules sorted by name.
+
+    The modules are read again incrementally when the report has them sorted,
+    as written by the plugin. Otherwise, the report is loaded into memory."""
+    module_names = []
+    for module_name, module_entries in iter_report(report):
+        layout.add_entries(
+            flatten_entries({module_name: module_entries}, by_database, phase)
+        )
+        module_names.append(module_name)
+    if module_names == sorted(set(module_names)):
+        return iter_report(report)
+    return sorted(load_report(report).items())
+
+
+class ResultStorePath(click.Path):
+    name = "store_file"
+
+    def __init__(self):
+        super(ResultStorePath, self).__init__(exists=True, dir_okay=False)
+
+    def convert(self, value, param, ctx):
+        path = super(ResultStorePath, self).convert(value, param, ctx)
+        try:
+            store = ResultStore(path)
+        except StoreError as e:
+            self.fail(str(e), param, ctx)
+        if ctx is not None:
+            ctx.call_on_close(store.close)
+        return store
+
+
 class Jinja2TemplateFile(click.File):
     name = "jinja2_file"
 
@@ -55,23 +156,95 @@ class Jinja2TemplateFile(click.File):
                 )
 
 
+by_database_option = click.option(
+    "--by-database",
+    is_flag=True,
+    default=False,
+    help="Break down the results of each test by database alias.",
+)
+
+
+def phase_option(default):
+    return click.option(
+        "--phase",
+        type=click.Choice(PHASE_CHOICES),
+        default=default,
+        show_default=True,
+        help="The phase of the tests to use the results of.",
+    )
+
+
+store_option = click.option(
+    "--store",
+    type=ResultStorePath(),
+    default=None,
+    is_eager=True,
+    help="Read the runs of a SQLite result store instead of JSON reports, "
+    "the reports are then referred to by run ID, label, 'latest' or 'latest~N'.",
+)
+
+
+def report_default(filename, run=LATEST_RUN):
+    """Returns the default report argument: the given file, or the given run
+    if a result store is passed."""
+
+    def get_default():
+        ctx = click.get_current_context(silent=True)
+        if ctx is not None and ctx.params.get("store") is not None:
+            return run
+        return filename
+
+    return get_default
+
+
 @click.group()
 def main():
     """Command line tool for pytest-django-queries."""
 
 
 @main.command()
+@store_option
 @click.argument(
-    "input_file", type=JsonReportFileParamType("r"), default=DEFAULT_RESULT_FILENAME
+    "input_file",
+    type=ReportParamType("r"),
+    default=report_default(DEFAULT_RESULT_FILENAME),
 )
-def show(input_file):
+@by_database_option
+@phase_option(default=PHASE_ALL)
+@click.option(
+    "-c",
+    "--column",
+    "columns",
+    type=click.Choice([ALL_COLUMNS] + [field for field, _ in Entry.EXTRA_FIELDS]),
+    multiple=True,
+    help="Also display the given optional column when the report contains it, "
+    "e.g. db-time, or '%s' for every optional column. Can be passed multiple times."
+    % ALL_COLUMNS,
+)
+@click.option(
+    "--details",
+    is_flag=True,
+    default=False,
+    help="Also list the details of each test, such as their most repeated queries.",
+)
+def show(store, input_file, by_database, phase, columns, details):
     """View a given report."""
-    return print_entries(input_file)
+    print_entries(
+        input_file,
+        by_database=by_database,
+        phase=phase,
+        columns=None if ALL_COLUMNS in columns else columns,
+    )
+    if details:
+        print_details(input_file, by_database=by_database, phase=phase)
 
 
 @main.command()
+@store_option
 @click.argument(
-    "input_file", type=JsonReportFileParamType("r"), default=DEFAULT_RESULT_FILENAME
+    "input_file",
+    type=ReportParamType("r"),
+    default=report_default(DEFAULT_RESULT_FILENAME),
 )
 @click.option(
     "-o",
@@ -87,12 +260,16 @@ def show(input_file):
     default=DEFAULT_TEMPLATE_PATH,
     help="Use a custom jinja2 template for rendering HTML results.",
 )
-def html(input_file, output, template):
+@by_database_option
+@phase_option(default=PHASE_ALL)
+def html(store, input_file, output, template, by_database, phase):
     """
     Render the results as HTML instead of a raw table.
 
     Note: you can pass a dash (-) as the path to print the HTML content to stdout."""
-    html_content = entries_to_html(input_file, template)
+    html_content = entries_to_html(
+        input_file, template, by_database=by_database, phase=phase
+    )
 
     if output == "-":
         click.echo(html_content, nl=False)
@@ -101,28 +278,159 @@ def html(input_file, output, template):
     _write_html_to_file(html_content, output)
 
 
+@main.command("hot-tables")
+@store_option
+@click.argument(
+    "input_file",
+    type=ReportParamType("r"),
+    default=report_default(DEFAULT_RESULT_FILENAME),
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The maximum number of tables to list.",
+)
+def hot_tables(store, input_file, limit):
+    """List the tables queried the most across every test."""
+    print_hot_tables(input_file, limit=limit)
+
+
+@main.command()
+@store_option
+@click.argument(
+    "input_file",
+    type=ReportParamType("r"),
+    default=report_default(DEFAULT_RESULT_FILENAME),
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The maximum number of endpoints to list.",
+)
+def endpoints(store, input_file, limit):
+    """List the endpoints running the most queries across every test."""
+    print_endpoints(input_file, limit=limit)
+
+
 @main.command()
+@store_option
 @click.argument(
-    "left_file", type=JsonReportFileParamType("r"), default=DEFAULT_OLD_RESULT_FILENAME
+    "left_file",
+    type=StreamedReportParamType(),
+    default=report_default(DEFAULT_OLD_RESULT_FILENAME, run=LATEST_RUN + "~1"),
 )
 @click.argument(
-    "right_file", type=JsonReportFileParamType("r"), default=DEFAULT_RESULT_FILENAME
+    "right_file",
+    type=StreamedReportParamType(),
+    default=report_default(DEFAULT_RESULT_FILENAME),
 )
-def diff(left_file, right_file):
+@by_database_option
+@phase_option(default=PHASE_CALL)
+def diff(store, left_file, right_file, by_database, phase):
     """Render the diff as a console table with colors."""
-    left = flatten_entries(left_file)
-    right = flatten_entries(right_file)
+    # The reports are read twice, a module at a time: to compute the columns
+    # of the whole diff, then to render the diff of each module
+    layout = DiffLayout()
+    try:
+        left_modules = scan_report(left_file, layout, by_database, phase)
+        right_modules = scan_report(right_file, layout, by_database, phase)
+        module_diffs = iter_module_diffs(
+            left_modules, right_modules, layout, by_database=by_database, phase=phase
+        )
+        first_line = True
+        for module_name, lines in module_diffs:
+            if not first_line:
+                click.echo()
+            else:
+                first_line = False
+
+            click.echo("# %s" % module_name)
+            for line in lines:
+                fg_color = DIFF_TERM_COLOR.get(line[0], DEFAULT_TERM_DIFF_COLOR)
+                click.secho(line, fg=fg_color)
+    except ReportError as e:
+        raise click.UsageError(str(e))
+
+
+@main.command()
+@store_option
+@click.argument(
+    "left_file",
+    type=ReportParamType("r"),
+    default=report_default(DEFAULT_OLD_RESULT_FILENAME, run=LATEST_RUN + "~1"),
+)
+@click.argument(
+    "right_file",
+    type=ReportParamType("r"),
+    default=report_default(DEFAULT_RESULT_FILENAME),
+)
+def plans(store, left_file, right_file):
+    """Render the query plans that changed between two reports."""
+    diff = DiffGenerator(flatten_entries(left_file), flatten_entries(right_file))
     first_line = True
-    for module_name, lines in DiffGenerator(left, right):
+    for comparison in diff.iter_comparisons():
+        if comparison.left is None or comparison.right is None:
+            continue
+        changed_plans = list(diff_plans(comparison.left.plans, comparison.right.plans))
+        if not changed_plans:
+            continue
+
         if not first_line:
             click.echo()
         else:
             first_line = False
 
-        click.echo("# %s" % module_name)
-        for line in lines:
-            fg_color = DIFF_TERM_COLOR.get(line[0], DEFAULT_TERM_DIFF_COLOR)
-            click.secho(line, fg=fg_color)
+        click.echo(
+            "# %s::%s" % (comparison.test.module_name, comparison.test.test_name)
+        )
+        for fingerprint, left_plan, right_plan in changed_plans:
+            click.echo("  %s" % fingerprint)
+            for line in left_plan["plan"]:
+                click.secho("- %s" % line, fg=DIFF_TERM_COLOR["-"])
+            for line in right_plan["plan"]:
+                click.secho("+ %s" % line, fg=DIFF_TERM_COLOR["+"])
+            new_flags = set(right_plan["flags"]) - set(left_plan["flags"])
+            click.secho(
+                "  flags: %s -> %s"
+                % (
+                    ", ".join(left_plan["flags"]) or "none",
+                    ", ".join(right_plan["flags"]) or "none",
+                ),
+                fg="red" if new_flags else None,
+            )
+
+
+@main.command()
+@click.argument("store", type=ResultStorePath(), default=DEFAULT_STORE_FILENAME)
+def runs(store):
+    """List the runs of a SQLite result store."""
+    for run in store.get_runs():
+        click.echo(
+            "%d\t%s\t%s\t%s\t%s\t%d tests"
+            % (
+                run["id"],
+                run["created_at"],
+                run["label"] or "-",
+                (run["git_sha"] or "-")[:12],
+                run["git_branch"] or "-",
+                run["tests"],
+            )
+        )
+
+
+@main.command()
+@click.argument("store", type=ResultStorePath(), default=DEFAULT_STORE_FILENAME)
+@click.option(
+    "--keep",
+    type=click.IntRange(min=0),
+    required=True,
+    help="The number of latest runs to keep.",
+)
+def prune(store, keep):
+    """Delete the oldest runs of a SQLite result store."""
+    click.echo("Deleted %d run(s)" % store.prune(keep))
 
 
 @main.command()
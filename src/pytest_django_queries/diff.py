@@ -1,24 +1,74 @@
 # coding=utf-8
 from collections import namedtuple
 
-from pytest_django_queries.entry import Entry  # noqa
+from pytest_django_queries.entry import PHASE_ALL, Entry, flatten_entries  # noqa
 from pytest_django_queries.filters import format_underscore_name_to_human
+from pytest_django_queries.results import ReportError
 
 _ROW_FIELD = namedtuple("_RowField", ("comp_field", "align_char", "length_field"))
 _ROW_FIELDS = (
     _ROW_FIELD("test_name", "<", "test_name"),
-    _ROW_FIELD("left_count", ">", "query_count"),
-    _ROW_FIELD("right_count", ">", "query_count"),
+    _ROW_FIELD("left_count", ">", "data_query_count"),
+    _ROW_FIELD("right_count", ">", "data_query_count"),
     _ROW_FIELD("duplicate_count", ">", "duplicate_count"),
 )
+# Only displayed if one of the compared entries has the given field
+# Format: (entry field, row fields)
+_EXTRA_ROW_FIELDS = (
+    ("similar", (_ROW_FIELD("similar_count", ">", "similar_count"),)),
+    (
+        "query-count-cold",
+        (
+            _ROW_FIELD("left_cold", ">", "cold_query_count"),
+            _ROW_FIELD("right_cold", ">", "cold_query_count"),
+            _ROW_FIELD("left_warm", ">", "warm_query_count"),
+            _ROW_FIELD("right_warm", ">", "warm_query_count"),
+        ),
+    ),
+    (
+        "rows-fetched",
+        (
+            _ROW_FIELD("left_rows", ">", "rows_fetched"),
+            _ROW_FIELD("right_rows", ">", "rows_fetched"),
+        ),
+    ),
+    (
+        "model-instances",
+        (
+            _ROW_FIELD("left_instances", ">", "model_instance_count"),
+            _ROW_FIELD("right_instances", ">", "model_instance_count"),
+        ),
+    ),
+    (
+        "cache-calls",
+        (
+            _ROW_FIELD("left_cache_calls", ">", "cache_call_count"),
+            _ROW_FIELD("right_cache_calls", ">", "cache_call_count"),
+        ),
+    ),
+    (
+        "db-time",
+        (
+            _ROW_FIELD("left_db_time", ">", "db_time"),
+            _ROW_FIELD("right_db_time", ">", "db_time"),
+        ),
+    ),
+    ("wall-time", (_ROW_FIELD("wall_time_delta", ">", "wall_time_delta"),)),
+    ("cpu-time", (_ROW_FIELD("cpu_time_delta", ">", "cpu_time_delta"),)),
+    ("memory-peak", (_ROW_FIELD("memory_peak_delta", ">", "memory_peak_delta"),)),
+)
+# Every row field that can be displayed
+_ALL_ROW_FIELDS = _ROW_FIELDS + tuple(
+    row_field for _, row_fields in _EXTRA_ROW_FIELDS for row_field in row_fields
+)
 _ROW_PREFIX = "  "
 _NA_CHAR = "-"
 
 
-def entry_row(entry_comp, lengths):
+def entry_row(entry_comp, lengths, fields=_ROW_FIELDS):
     cols = []
 
-    for field, align, length_key in _ROW_FIELDS:
+    for field, align, length_key in fields:
         fmt = "{cmp.%s: %s%d}" % (field, align, lengths[length_key])
         cols.append(fmt.format(cmp=entry_comp, lengths=lengths))
 
@@ -27,11 +77,11 @@ def entry_row(entry_comp, lengths):
     )
 
 
-def get_header_row(lengths):
+def get_header_row(lengths, fields=_ROW_FIELDS):
     sep_row = []
     head_row = []
 
-    for field, _, length_key in _ROW_FIELDS:
+    for field, _, length_key in fields:
         length = lengths[length_key]
         sep_row.append("%s" % ("-" * length))
         head_row.append(
@@ -77,12 +127,28 @@ class SingleEntryComparison(object):
         Returns the query count difference from the previous version.
         If there is no older version, we assume it's an "improvement" (positive output)
         If there is no new version, we assume it's not an improvement (negative output)
+        If the query count varies within the known variance of the test, we assume
+        it's unchanged
         """
         if self.left is None:
             return DiffChars.POSITIVE
         if self.right is None:
             return DiffChars.NEGATIVE
-        return DiffChars.convert(self.right.query_count - self.left.query_count)
+        if self.within_variance:
+            return DiffChars.NEUTRAL
+        return DiffChars.convert(
+            self.right.data_query_count - self.left.data_query_count
+        )
+
+    @property
+    def within_variance(self):
+        """Whether the query count ranges of both versions overlap,
+        thus the change could be caused by a nondeterministic query count."""
+        if self.left is None or self.right is None:
+            return False
+        left_min, left_max = self.left.query_count_range
+        right_min, right_max = self.right.query_count_range
+        return left_min <= right_max and right_min <= left_max
 
     @property
     def test(self):
@@ -94,11 +160,91 @@ class SingleEntryComparison(object):
 
     @property
     def left_count(self):
-        return str(self.left.query_count) if self.left else _NA_CHAR
+        return str(self.left.data_query_count) if self.left else _NA_CHAR
 
     @property
     def right_count(self):
-        return str(self.right.query_count) if self.right else _NA_CHAR
+        return str(self.right.data_query_count) if self.right else _NA_CHAR
+
+    @property
+    def similar_count(self):
+        if self.right:
+            return self.right.similar_count
+        elif self.left:
+            return self.left.similar_count
+        return _NA_CHAR
+
+    @property
+    def left_cold(self):
+        return str(self.left.cold_query_count) if self.left else _NA_CHAR
+
+    @property
+    def right_cold(self):
+        return str(self.right.cold_query_count) if self.right else _NA_CHAR
+
+    @property
+    def left_warm(self):
+        return str(self.left.warm_query_count) if self.left else _NA_CHAR
+
+    @property
+    def right_warm(self):
+        return str(self.right.warm_query_count) if self.right else _NA_CHAR
+
+    @property
+    def left_rows(self):
+        return str(self.left.rows_fetched) if self.left else _NA_CHAR
+
+    @property
+    def right_rows(self):
+        return str(self.right.rows_fetched) if self.right else _NA_CHAR
+
+    @property
+    def left_instances(self):
+        return str(self.left.model_instance_count) if self.left else _NA_CHAR
+
+    @property
+    def right_instances(self):
+        return str(self.right.model_instance_count) if self.right else _NA_CHAR
+
+    @property
+    def left_cache_calls(self):
+        return str(self.left.cache_call_count) if self.left else _NA_CHAR
+
+    @property
+    def right_cache_calls(self):
+        return str(self.right.cache_call_count) if self.right else _NA_CHAR
+
+    @property
+    def left_db_time(self):
+        return str(self.left.db_time) if self.left else _NA_CHAR
+
+    @property
+    def right_db_time(self):
+        return str(self.right.db_time) if self.right else _NA_CHAR
+
+    def _get_delta(self, field):
+        """Returns the change of a field from the previous version,
+        if both versions have it."""
+        if not (
+            self.left
+            and self.right
+            and self.left.has_field(field)
+            and self.right.has_field(field)
+        ):
+            return _NA_CHAR
+        return "{:+}".format(round(self.right[field] - self.left[field], 3))
+
+    @property
+    def wall_time_delta(self):
+        return self._get_delta("wall-time")
+
+    @property
+    def cpu_time_delta(self):
+        return self._get_delta("cpu-time")
+
+    @property
+    def memory_peak_delta(self):
+        return self._get_delta("memory-peak")
 
     @property
     def duplicate_count(self):
@@ -112,12 +258,41 @@ class SingleEntryComparison(object):
     def diff(self):
         return self._diff_from_newest()
 
-    def to_string(self, lengths):
-        return entry_row(self, lengths=lengths)
+    def to_string(self, lengths, fields=_ROW_FIELDS):
+        return entry_row(self, lengths=lengths, fields=fields)
+
+
+class DiffLayout(object):
+    """The columns of a diff and their widths, which depend on every compared
+    entry. They can thus be computed ahead of the diff, a module at a time."""
+
+    def __init__(self):
+        self.longest_props = {
+            field.length_field: len(field.comp_field) for field in _ALL_ROW_FIELDS
+        }
+        self._entry_fields = set()
+
+    def add_entries(self, entries):
+        for entry in entries:
+            for entry_field, _ in _EXTRA_ROW_FIELDS:
+                if entry.has_field(entry_field):
+                    self._entry_fields.add(entry_field)
+            for field in _ALL_ROW_FIELDS:
+                current_length = len(str(getattr(entry, field.comp_field, None)))
+                if current_length > self.longest_props[field.length_field]:
+                    self.longest_props[field.length_field] = current_length
+
+    @property
+    def row_fields(self):
+        row_fields = _ROW_FIELDS
+        for entry_field, extra_row_fields in _EXTRA_ROW_FIELDS:
+            if entry_field in self._entry_fields:
+                row_fields += extra_row_fields
+        return row_fields
 
 
 class DiffGenerator(object):
-    def __init__(self, entries_left, entries_right):
+    def __init__(self, entries_left, entries_right, layout=None):
         """
         Generates the diffs from two files.
 
@@ -125,27 +300,25 @@ class DiffGenerator(object):
         :type entries_left: List[Entry]
         :param entries_right:
         :type entries_right: List[Entry]
+        :param layout: The columns computed from every compared entry,
+                       by default from the given entries.
+        :type layout: DiffLayout
         """
 
         self.entries_left = entries_left
         self.entries_right = entries_right
 
+        if layout is None:
+            layout = DiffLayout()
+            layout.add_entries(entries_left + entries_right)
+
         self._mapping = {}
         self._generate_mapping()
-        self.longest_props = self._get_longest_per_prop()
-        self.header_rows = get_header_row(lengths=self.longest_props)
-
-    def _get_longest_per_prop(self):
-        longest = {field.length_field: len(field.comp_field) for field in _ROW_FIELDS}
-        entries = self.entries_left + self.entries_right
-
-        for entry in entries:
-            for field in _ROW_FIELDS:
-                current_length = len(str(getattr(entry, field.comp_field, None)))
-                if current_length > longest[field.length_field]:
-                    longest[field.length_field] = current_length
-
-        return longest
+        self.row_fields = layout.row_fields
+        self.longest_props = layout.longest_props
+        self.header_rows = get_header_row(
+            lengths=self.longest_props, fields=self.row_fields
+        )
 
     def _map_side(self, entries, side_name):
         for entry in entries:
@@ -160,10 +333,21 @@ class DiffGenerator(object):
         self._map_side(self.entries_left, "left")
         self._map_side(self.entries_right, "right")
 
+    def iter_comparisons(self):
+        """Yields the comparison of every test, sorted by module and test name.
+
+        :rtype: Iterator[SingleEntryComparison]
+        """
+        for _, module_entries in sorted(self._mapping.items()):
+            for _, test_comparison in sorted(module_entries.items()):
+                yield test_comparison
+
     def _iter_module(self, module_entries):
         yield self.header_rows
         for _, test_comparison in sorted(module_entries.items()):  # type: SingleEntryComparison
-            yield test_comparison.to_string(lengths=self.longest_props)
+            yield test_comparison.to_string(
+                lengths=self.longest_props, fields=self.row_fields
+            )
 
     def _iter_modules(self):
         for module_name, module_entries in sorted(self._mapping.items()):
@@ -174,3 +358,66 @@ class DiffGenerator(object):
 
     def __iter__(self):
         return self._iter_modules()
+
+
+def _iter_sorted(modules, side_name):
+    previous = None
+    for module_name, module_entries in modules:
+        if previous is not None and module_name <= previous:
+            raise ReportError(
+                "The modules of the %s report are not sorted: %r after %r"
+                % (side_name, module_name, previous)
+            )
+        previous = module_name
+        yield module_name, module_entries
+
+
+def merge_join_modules(left_modules, right_modules):
+    """Yields the name and the tests of both versions of each module,
+    joining two streams of modules sorted by name in a single pass.
+
+    :param left_modules: The name and tests of each module of the previous
+                         version, sorted by name.
+    :type left_modules: Iterable[Tuple[str, dict]]
+    :param right_modules: The same for the newest version.
+    :type right_modules: Iterable[Tuple[str, dict]]
+    """
+    left_modules = _iter_sorted(left_modules, "left")
+    right_modules = _iter_sorted(right_modules, "right")
+    left = next(left_modules, None)
+    right = next(right_modules, None)
+    while left is not None or right is not None:
+        if right is None or (left is not None and left[0] < right[0]):
+            yield left[0], left[1], {}
+            left = next(left_modules, None)
+        elif left is None or right[0] < left[0]:
+            yield right[0], {}, right[1]
+            right = next(right_modules, None)
+        else:
+            yield left[0], left[1], right[1]
+            left = next(left_modules, None)
+            right = next(right_modules, None)
+
+
+def iter_module_diffs(
+    left_modules, right_modules, layout, by_database=False, phase=PHASE_ALL
+):
+    """Yields the diff of each module of two versions, a module at a time:
+    only one module of each version is held in memory.
+
+    :param left_modules: The name and tests of each module of the previous
+                         version, sorted by name.
+    :param right_modules: The same for the newest version.
+    :param layout: The columns computed from every entry of both versions.
+    :type layout: DiffLayout
+    """
+    for module_name, left_tests, right_tests in merge_join_modules(
+        left_modules, right_modules
+    ):
+        diff = DiffGenerator(
+            flatten_entries({module_name: left_tests}, by_database, phase),
+            flatten_entries({module_name: right_tests}, by_database, phase),
+            layout=layout,
+        )
+        for module_diff in diff:
+            yield module_diff
@@ -1,5 +1,29 @@
+from collections import Counter, namedtuple
+
 from pytest_django_queries.utils import assert_type, raise_error
 
+# The phases of a test, the queries of each phase are also counted separately
+PHASE_SETUP = "setup"
+PHASE_CALL = "call"
+PHASE_TEARDOWN = "teardown"
+PHASES = (PHASE_SETUP, PHASE_CALL, PHASE_TEARDOWN)
+# Every phase of a test, i.e. its whole results
+PHASE_ALL = "all"
+PHASE_CHOICES = PHASES + (PHASE_ALL,)
+
+HotTable = namedtuple("HotTable", ("table", "query_count", "verbs", "test_count"))
+Endpoint = namedtuple(
+    "Endpoint",
+    (
+        "endpoint",
+        "request_count",
+        "query_count",
+        "duplicate_count",
+        "max_request_query_count",
+        "test_count",
+    ),
+)
+
 
 class Entry(object):
     BASE_FIELDS = [("test_name", "Test Name")]
@@ -7,6 +31,46 @@ class Entry(object):
     OPTIONAL_FIELDS = [("duplicates", "Duplicated")]
     FIELDS = BASE_FIELDS + REQUIRED_FIELDS + OPTIONAL_FIELDS
 
+    # Whether the entry holds the results of a named section of a test
+    is_section = False
+
+    # Optional fields that are only displayed if the entries have them,
+    # older reports do not contain them
+    EXTRA_FIELDS = [
+        ("data-query-count", "Data queries"),
+        ("transaction-count", "Transactions"),
+        ("setup-count", "Setups"),
+        ("similar", "Similar"),
+        ("query-count-min", "Min queries"),
+        ("query-count-max", "Max queries"),
+        ("unstable", "Unstable"),
+        ("query-count-cold", "Cold queries"),
+        ("query-count-warm", "Warm queries"),
+        ("rows-fetched", "Rows fetched"),
+        ("rows-affected", "Rows affected"),
+        ("model-instances", "Instances"),
+        ("cache-calls", "Cache calls"),
+        ("cache-hits", "Cache hits"),
+        ("cache-misses", "Cache misses"),
+        ("cache-repeated-keys", "Repeated keys"),
+        ("db-time", "DB ms"),
+        ("db-time-max", "Max ms"),
+        ("db-time-p50", "P50 ms"),
+        ("db-time-p95", "P95 ms"),
+        ("wall-time", "Wall ms"),
+        ("cpu-time", "CPU ms"),
+        ("memory-peak", "Peak KiB"),
+    ]
+
+    # Optional lists of (label, count) pairs detailing the results
+    DETAIL_FIELDS = [
+        ("top-fingerprints", "Repeated queries"),
+        ("call-sites", "Top call sites"),
+        ("worst-query", "Query fetching or affecting the most rows"),
+        ("top-models", "Most instantiated models"),
+        ("top-cache-keys", "Repeatedly read cache keys"),
+    ]
+
     def __init__(self, test_name, module_name, data):
         """
         :param data: The test entry's data.
@@ -22,7 +86,7 @@ class Entry(object):
         for field, _ in self.REQUIRED_FIELDS:
             setattr(self, field, self._get_required_key(field))
 
-        for field, _ in self.OPTIONAL_FIELDS:
+        for field, _ in self.OPTIONAL_FIELDS + self.EXTRA_FIELDS:
             setattr(self, field, self._get_key(field, "UNK"))
 
     def __getitem__(self, item):
@@ -32,10 +96,124 @@ class Entry(object):
     def query_count(self):
         return self["query-count"]
 
+    @property
+    def data_query_count(self):
+        """The query count without the transaction control statements,
+        older reports only have the total query count."""
+        return self._get_key("data-query-count", self.query_count)
+
+    @property
+    def query_count_range(self):
+        """The min and max data query counts of the test if it was repeated,
+        otherwise its data query count."""
+        return (
+            self._get_key("query-count-min", self.data_query_count),
+            self._get_key("query-count-max", self.data_query_count),
+        )
+
+    @property
+    def cold_query_count(self):
+        return self["query-count-cold"]
+
+    @property
+    def warm_query_count(self):
+        return self["query-count-warm"]
+
     @property
     def duplicate_count(self):
         return self["duplicates"]
 
+    @property
+    def similar_count(self):
+        return self["similar"]
+
+    @property
+    def rows_fetched(self):
+        return self["rows-fetched"]
+
+    @property
+    def model_instance_count(self):
+        return self["model-instances"]
+
+    @property
+    def cache_call_count(self):
+        return self["cache-calls"]
+
+    @property
+    def db_time(self):
+        return self["db-time"]
+
+    def get_details(self):
+        """Returns the display name and the (label, count) pairs
+        of each detail field the entry has."""
+        details = []
+        for field, name in self.DETAIL_FIELDS:
+            rows = self._get_key(field, [])
+            assert_type(rows, list)
+            if rows:
+                details.append((name, rows))
+        return details
+
+    def has_field(self, field):
+        return field in self._raw_data
+
+    @classmethod
+    def get_extra_fields(cls, entries, columns=None):
+        """Returns the extra fields that at least one of the entries has.
+
+        :param columns: The extra fields to only return if any.
+        :type columns: collections.abc.Container
+        """
+        return [
+            (field, name)
+            for field, name in cls.EXTRA_FIELDS
+            if (columns is None or field in columns)
+            and any(entry.has_field(field) for entry in entries)
+        ]
+
+    @classmethod
+    def get_fields(cls, entries, columns=None):
+        """Returns the fields to display for the given entries."""
+        return cls.FIELDS + cls.get_extra_fields(entries, columns=columns)
+
+    @property
+    def databases(self):
+        """The results broken down by database alias, if any."""
+        databases = self._get_key("databases", {})
+        assert_type(databases, dict)
+        return databases
+
+    @property
+    def tables(self):
+        """The number of queries per table and verb, if any."""
+        tables = self._get_key("tables", {})
+        assert_type(tables, dict)
+        return tables
+
+    @property
+    def requests(self):
+        """The queries of the requests made by the test, by endpoint."""
+        requests = self._get_key("requests", {})
+        assert_type(requests, dict)
+        return requests
+
+    @property
+    def plans(self):
+        """The plan of each distinct SELECT query, if they were explained."""
+        plans = self._get_key("explain", {})
+        assert_type(plans, dict)
+        return plans
+
+    def iter_databases(self):
+        """Yields an entry for each database alias the test has results for,
+        or the entry itself if the results are not broken down by alias."""
+        if not self.databases:
+            yield self
+            return
+
+        for alias, data in sorted(self.databases.items()):
+            yield Entry("%s[%s]" % (self.test_name, alias), self.module_name, data)
+
     def _get_key(self, key, default):
         return self._raw_data.get(key, default)
 
@@ -45,21 +223,116 @@ class Entry(object):
         raise_error("Got invalid data. It is missing a required key: %s" % key)
 
 
-def iter_entries(entries):
+def get_phase_results(test_data, phase):
+    """Returns the results of the given phase of a test,
+    or its whole results for every phase or for older reports."""
+    if phase == PHASE_ALL:
+        return test_data
+    phases = test_data.get("phases", {})
+    assert_type(phases, dict)
+    return phases.get(phase, test_data)
+
+
+def get_section_name(test_name, section_name):
+    return "%s::%s" % (test_name, section_name)
+
+
+def iter_sections(module_name, test_name, test_data):
+    """Yields an entry for each named section of a test, in their execution order."""
+    sections = test_data.get("sections", {})
+    assert_type(sections, dict)
+    for section_name, section_data in sections.items():
+        entry = Entry(
+            get_section_name(test_name, section_name), module_name, section_data
+        )
+        entry.is_section = True
+        yield entry
+
+
+def _iter_module_entries(module_name, module_data, by_database, phase):
+    for test_name, test_data in sorted(module_data.items()):
+        assert_type(test_data, dict)
+        entry = Entry(test_name, module_name, get_phase_results(test_data, phase))
+        if by_database:
+            for database_entry in entry.iter_databases():
+                yield database_entry
+        else:
+            yield entry
+        for section_entry in iter_sections(module_name, test_name, test_data):
+            yield section_entry
+
+
+def iter_entries(entries, by_database=False, phase=PHASE_ALL):
+    """Yields the module names and their test entries.
+
+    :param by_database: Whether to yield an entry per database alias
+                        instead of the combined results of each test.
+    :type by_database: bool
+    :param phase: The phase of the tests to yield the results of
+                  (setup, call, teardown or all).
+    :type phase: str
+    """
     for module_name, module_data in sorted(entries.items()):
         assert_type(module_data, dict)
 
         yield (
             module_name,
-            (
-                Entry(test_name, module_name, test_data)
-                for test_name, test_data in sorted(module_data.items())
-            ),
+            _iter_module_entries(module_name, module_data, by_database, phase),
         )
 
 
-def flatten_entries(file_content):
+def flatten_entries(file_content, by_database=False, phase=PHASE_ALL):
     entries = []
-    for _, data in iter_entries(file_content):
+    for _, data in iter_entries(file_content, by_database=by_database, phase=phase):
         entries += list(data)
     return entries
+
+
+def get_hot_tables(entries, limit=None):
+    """Returns the tables queried the most across the given entries,
+    with their query count per verb and the number of tests querying them.
+
+    :param limit: The maximum number of tables to return, if any.
+    :type limit: int
+    :rtype: list[HotTable]
+    """
+    verbs = {}
+    test_counts = Counter()
+    for entry in entries:
+        for table, table_verbs in entry.tables.items():
+            assert_type(table_verbs, dict)
+            verbs.setdefault(table, Counter()).update(table_verbs)
+            test_counts[table] += 1
+    hot_tables = [
+        HotTable(table, sum(table_verbs.values()), table_verbs, test_counts[table])
+        for table, table_verbs in verbs.items()
+    ]
+    hot_tables.sort(key=lambda hot_table: (-hot_table.query_count, hot_table.table))
+    return hot_tables[:limit]
+
+
+def get_endpoints(entries, limit=None):
+    """Returns the endpoints requested by the given entries, from the one
+    running the most data queries in total.
+
+    :param limit: The maximum number of endpoints to return, if any.
+    :type limit: int
+    :rtype: list[Endpoint]
+    """
+    totals = {}
+    for entry in entries:
+        for endpoint, data in entry.requests.items():
+            assert_type(data, dict)
+            request_count, query_count, duplicate_count, max_count, test_count = (
+                totals.get(endpoint, (0, 0, 0, 0, 0))
+            )
+            totals[endpoint] = (
+                request_count + data.get("request-count", 0),
+                query_count + data.get("data-query-count", data["query-count"]),
+                duplicate_count + data.get("duplicates", 0),
+                max(max_count, data.get("request-query-count-max", 0)),
+                test_count + 1,
+            )
+    endpoints = [Endpoint(endpoint, *total) for endpoint, total in totals.items()]
+    endpoints.sort(key=lambda endpoint: (-endpoint.query_count, endpoint.endpoint))
+    return endpoints[:limit]
@@ -0,0 +1,91 @@
+import re
+
+from django.db import DatabaseError, NotSupportedError, transaction
+
+# Format: (flag, pattern matching a line of the plan)
+PLAN_FLAGS = (
+    # SQLite, PostgreSQL and MySQL full table scans
+    ("scan", re.compile(r"^\s*SCAN (?!CONSTANT ROW)|\bSeq Scan\b|\btype=ALL\b")),
+    ("temp-b-tree", re.compile(r"\bUSE TEMP B-TREE\b")),
+    ("filesort", re.compile(r"\bUsing filesort\b")),
+)
+PLAN_FLAG_NAMES = tuple(flag for flag, _ in PLAN_FLAGS)
+
+_SELECT_RE = re.compile(r"^\s*(?:SELECT|WITH)\b", re.IGNORECASE)
+
+
+def is_select(sql):
+    return _SELECT_RE.match(sql) is not None
+
+
+def condense_plan_row(columns, row):
+    """Returns a plan row as a single line."""
+    if len(row) == 1:
+        return str(row[0])
+    values = dict(zip(columns, row))
+    if "detail" in values:
+        # SQLite: (id, parent, notused, detail)
+        return str(values["detail"])
+    return ", ".join(
+        "%s=%s" % (column, value)
+        for column, value in zip(columns, row)
+        if value is not None
+    )
+
+
+def get_plan_flags(plan):
+    """Returns the flags of the lines of a plan, e.g. whether it scans a table."""
+    return [
+        flag
+        for flag, pattern in PLAN_FLAGS
+        if any(pattern.search(line) for line in plan)
+    ]
+
+
+def explain_query(connection, sql, params):
+    """Returns the lines of the plan of a query,
+    or None if it could not be explained."""
+    try:
+        prefix = connection.ops.explain_query_prefix()
+    except NotSupportedError:
+        return None
+
+    try:
+        # Uses a savepoint as a failing query would otherwise
+        # break the transaction of the test
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute("%s %s" % (prefix, sql), params)
+                columns = [column[0] for column in cursor.description]
+                rows = cursor.fetchall()
+    except DatabaseError:
+        return None
+    return [condense_plan_row(columns, row) for row in rows]
+
+
+def explain_queries(samples):
+    """Returns the condensed plan and the flags of each query.
+
+    :param samples: The (connection, sql, params) of each fingerprint.
+    :type samples: dict
+    """
+    plans = {}
+    for fingerprint, (connection, sql, params) in sorted(samples.items()):
+        plan = explain_query(connection, sql, params)
+        if plan is not None:
+            plans[fingerprint] = {"plan": plan, "flags": get_plan_flags(plan)}
+    return plans
+
+
+def diff_plans(left, right):
+    """Yields the queries of both versions of a test whose plan changed,
+    with their left and right plans.
+
+    :param left: The plans of the previous version, by fingerprint.
+    :type left: dict
+    :param right: The plans of the newest version, by fingerprint.
+    :type right: dict
+    """
+    for fingerprint in sorted(set(left) & set(right)):
+        if left[fingerprint]["plan"] != right[fingerprint]["plan"]:
+            yield fingerprint, left[fingerprint], right[fingerprint]
@@ -0,0 +1,135 @@
+from collections import Counter
+from contextlib import ExitStack
+
+from pytest_django_queries.capture import QueryCounter, QuerySegment
+from pytest_django_queries.entry import PHASE_SETUP, PHASE_TEARDOWN
+
+# The snapshot of a counter that did not record any query yet
+_EMPTY_SNAPSHOT = (0, 0, 0, 0, Counter(), 0, 0)
+
+# The results kept for each fixture, they can be summed between processes
+FIXTURE_RESULT_KEYS = (
+    "query-count",
+    "data-query-count",
+    "transaction-count",
+    "duplicates",
+    "db-time",
+    "db-time-max",
+)
+
+
+def get_fixture_entry_name(name, scope):
+    return "%s[%s]" % (name, scope)
+
+
+def get_segment_totals(segment):
+    """Returns the counters of a segment that can be summed between processes."""
+    results = segment.get_results()
+    return {key: results[key] for key in FIXTURE_RESULT_KEYS}
+
+
+class FixtureStats(object):
+    """The queries of the setups and teardowns of a fixture."""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.setup_count = 0
+        self.setup = QuerySegment()
+        self.teardown = QuerySegment()
+
+    @property
+    def query_count(self):
+        return self.setup.query_count + self.teardown.query_count
+
+    def get_results(self):
+        total = QuerySegment()
+        total.merge(self.setup)
+        total.merge(self.teardown)
+        results = get_segment_totals(total)
+        results["scope"] = self.scope
+        results["setup-count"] = self.setup_count
+        results["phases"] = {
+            PHASE_SETUP: get_segment_totals(self.setup),
+            PHASE_TEARDOWN: get_segment_totals(self.teardown),
+        }
+        return results
+
+
+class FixtureProfiler(object):
+    """Counts the queries of the setup and teardown of every fixture,
+    by fixture name and scope.
+
+    Each setup and teardown gets its own counters, entered when it starts
+    and exited when it ends. A fixture requested through
+    ``request.getfixturevalue`` is thus also counted into the fixture
+    requesting it.
+    """
+
+    def __init__(self, connections, ignored_fixtures=()):
+        """
+        :param connections: The Django connection handler.
+        :type connections: django.db.utils.ConnectionHandler
+        :param ignored_fixtures: The names of the fixtures not to profile.
+        :type ignored_fixtures: collections.abc.Container
+        """
+        self.connections = connections
+        self.ignored_fixtures = ignored_fixtures
+        self.fixtures = {}
+        # The counters of the teardowns in progress, by fixture definition
+        self._teardowns = {}
+
+    def is_profiled(self, fixturedef):
+        return fixturedef.argname not in self.ignored_fixtures
+
+    def _start(self):
+        counters = [QueryCounter(connection) for connection in self.connections.all()]
+        stack = ExitStack()
+        for counter in counters:
+            stack.enter_context(counter)
+        return stack, counters
+
+    @staticmethod
+    def _end(started, segment):
+        stack, counters = started
+        stack.close()
+        for counter in counters:
+            segment.add(counter, _EMPTY_SNAPSHOT)
+
+    def _get_stats(self, fixturedef):
+        key = (fixturedef.argname, fixturedef.scope)
+        stats = self.fixtures.get(key)
+        if stats is None:
+            stats = self.fixtures[key] = FixtureStats(fixturedef.scope)
+        return stats
+
+    def start_setup(self):
+        """Starts counting the queries of the setup of a fixture.
+
+        :returns: The counters to pass to ``end_setup``.
+        """
+        return self._start()
+
+    def end_setup(self, fixturedef, started):
+        stats = self._get_stats(fixturedef)
+        stats.setup_count += 1
+        self._end(started, stats.setup)
+
+    def start_teardown(self, fixturedef):
+        """Starts counting the queries of the teardown of a fixture,
+        to be called before its finalizers run."""
+        self._teardowns[fixturedef] = self._start()
+
+    def end_teardown(self, fixturedef):
+        """Ends counting the queries of the teardown of a fixture, if started."""
+        started = self._teardowns.pop(fixturedef, None)
+        if started is not None:
+            self._end(started, self._get_stats(fixturedef).teardown)
+
+    def get_results(self):
+        """Returns the results of the fixtures that executed queries,
+        by entry name."""
+        return {
+            get_fixture_entry_name(name, scope): stats.get_results()
+            for (name, scope), stats in sorted(self.fixtures.items())
+            if stats.query_count
+        }
@@ -0,0 +1,63 @@
+from collections import Counter
+
+from django.db.models.signals import post_init
+
+# The maximum number of models to report per test
+TOP_MODELS_COUNT = 10
+
+
+class InstanceCounter(object):
+    """Counts the model instances created, by model class, using the
+    ``post_init`` signal sent at the end of ``Model.__init__``.
+
+    Connecting to the signal makes every model instantiation dispatch it,
+    thus the counter is only connected while capturing.
+    """
+
+    def __init__(self):
+        self.instances = Counter()
+
+    def _post_init(self, sender, **kwargs):
+        self.instances[sender] += 1
+
+    def snapshot(self):
+        """Returns the instance counts, to later get the instances
+        created after the snapshot."""
+        return self.instances.copy()
+
+    def reset(self):
+        self.instances.clear()
+
+    def rewind(self, snapshot):
+        """Forgets the instances created since the given snapshot,
+        and returns the snapshot to measure from."""
+        self.instances = snapshot.copy()
+        return snapshot
+
+    def get_results(self, snapshot=None):
+        """Returns the number of created instances and the most instantiated
+        models, since the given snapshot if any."""
+        instances = self.instances
+        if snapshot is not None:
+            instances = instances - snapshot
+        by_label = Counter()
+        for model, count in instances.items():
+            by_label[model._meta.label] += count
+
+        results = {"model-instances": sum(by_label.values())}
+        top_models = [
+            [label, count]
+            for label, count in sorted(
+                by_label.items(), key=lambda item: (-item[1], item[0])
+            )[:TOP_MODELS_COUNT]
+        ]
+        if top_models:
+            results["top-models"] = top_models
+        return results
+
+    def __enter__(self):
+        post_init.connect(self._post_init)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        post_init.disconnect(self._post_init)
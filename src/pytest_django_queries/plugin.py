@@ -1,14 +1,59 @@
+import functools
+import inspect
 import json
 import os.path
 import shutil
 import tempfile
 import warnings
-from os import listdir
 from os.path import isfile
 
 import pytest
-from django.test.utils import CaptureQueriesContext
 
+from pytest_django_queries.baseline import (
+    BaselineError,
+    find_regressions,
+    format_regression,
+    load_baseline,
+    ratchet_baseline,
+)
+from pytest_django_queries.budgets import (
+    BUDGET_NAMES,
+    BudgetError,
+    BudgetResolver,
+    check_budgets,
+    format_budget_failure,
+    parse_budget_value,
+    parse_module_budgets,
+)
+from pytest_django_queries.callsites import (
+    DEFAULT_MAX_DEPTH,
+    DEFAULT_SAMPLE_RATE,
+    CallSiteSampler,
+)
+from pytest_django_queries.capture import (
+    CAPTURE_MODE_FULL,
+    CAPTURE_MODES,
+    QueryCapture,
+    clear_caches,
+)
+from pytest_django_queries.entry import (
+    PHASE_ALL,
+    PHASE_CALL,
+    PHASE_SETUP,
+    PHASE_TEARDOWN,
+    get_phase_results,
+)
+from pytest_django_queries.explain import explain_queries
+from pytest_django_queries.fixtures import FixtureProfiler
+from pytest_django_queries.results import (
+    FIXTURES_MODULE_NAME,
+    ReportError,
+    ResultAccumulator,
+    load_report,
+    merge_report,
+    read_spilled_results,
+)
+from pytest_django_queries.store import ResultStore, StoreError, get_git_metadata
 from pytest_django_queries.utils import create_backup
 
 # Defines the plugin marker name
@@ -16,6 +61,16 @@ PYTEST_QUERY_COUNT_MARKER = "count_queries"
 PYTEST_QUERY_COUNT_FIXTURE_NAME = "count_queries"
 DEFAULT_RESULT_FILENAME = ".pytest-queries"
 DEFAULT_OLD_RESULT_FILENAME = ".pytest-queries.old"
+DEFAULT_STORE_FILENAME = ".pytest-queries.sqlite3"
+MODULE_BUDGETS_INI_NAME = "django_queries_module_budgets"
+
+# The keys of the results and collected tests sent by the xdist workers
+# to the controller
+WORKER_OUTPUT_RESULTS_KEY = "django_queries_results"
+WORKER_OUTPUT_COLLECTED_KEY = "django_queries_collected"
+
+# Stores the query capture of the current test
+capture_key = pytest.StashKey["QueryCapture"]()
 
 
 def get_worker_input(node):
@@ -33,6 +88,12 @@ def is_worker(config: pytest.Config):
     return hasattr(config, "workerinput") or hasattr(config, "slaveinput")
 
 
+def can_stream_results(config: pytest.Config):
+    """Returns whether the results can be sent to the controller through
+    the xdist worker output instead of the shared directory."""
+    return hasattr(config, "workeroutput")
+
+
 def get_workerid(config: pytest.Config):
     if hasattr(config, "workerinput"):
         return config.workerinput["workerid"]
@@ -47,34 +108,36 @@ def save_results_to_json(save_path, backup_path, data):
     if backup_path and isfile(save_path):
         create_backup(save_path, backup_path)
 
+    # The modules are sorted for the reports to be streamed by the diff
     with open(save_path, "w") as fp:
-        json.dump(data, fp, indent=2)
+        json.dump(dict(sorted(data.items())), fp, indent=2)
 
 
-def add_entry(request: pytest.FixtureRequest, queries, dirout):
-    module_name = request.node.module.__name__
-    test_name = request.node.name
-    queries = queries[:]
-    query_count = len(queries)
-    duplicate_count = query_count - len(set((q["sql"] for q in queries)))
-
-    result_line = "%s\t%s\t%d\t%d\n" % (
-        module_name,
-        test_name,
-        query_count,
-        duplicate_count,
+def add_entry(request: pytest.FixtureRequest, results):
+    request.config.django_queries_results.add(
+        request.node.module.__name__, request.node.name, results
     )
-    save_path = os.path.join(dirout, get_workerid(request.config))
-    if os.path.isfile(save_path):
-        mode = "a"
-    else:
-        mode = "w"
 
-    with open(save_path, mode=mode) as fp:
-        fp.write(result_line)
+
+def get_budget_ini_name(budget_name):
+    return "django_queries_%s" % budget_name
 
 
 def pytest_addoption(parser):
+    for budget_name in BUDGET_NAMES:
+        parser.addini(
+            get_budget_ini_name(budget_name),
+            "Default %s query budget of the count_queries tests." % budget_name,
+            default="",
+        )
+    parser.addini(
+        MODULE_BUDGETS_INI_NAME,
+        "Per-module query budgets of the count_queries tests, one module per line: "
+        "'<module name pattern>: <budget>=<value>, ...'.",
+        type="linelist",
+        default=[],
+    )
+
     group = parser.getgroup("django-queries")
     group.addoption(
         "--django-db-bench",
@@ -93,6 +156,181 @@ def pytest_addoption(parser):
         help="Whether the old results should be backed up or not before overriding",
         nargs="?",
     )
+    group.addoption(
+        "--django-queries-merge",
+        dest="queries_merge_results",
+        action="store_true",
+        default=False,
+        help="Only update the results of the tests that ran instead of overriding "
+        "the whole output file, the tests that no longer exist are removed",
+    )
+    group.addoption(
+        "--django-queries-store",
+        dest="queries_store_path",
+        action="store",
+        default=None,
+        metavar="PATH",
+        help="Also append the results to a SQLite database keeping the history "
+        "of the runs",
+    )
+    group.addoption(
+        "--django-queries-run-label",
+        dest="queries_run_label",
+        action="store",
+        default=None,
+        metavar="LABEL",
+        help="The label of the run saved into the SQLite database",
+    )
+    group.addoption(
+        "--django-queries-store-keep",
+        dest="queries_store_keep",
+        action="store",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Only keep the N latest runs into the SQLite database. Default: 0 "
+        "(keep every run)",
+    )
+    group.addoption(
+        "--django-queries-capture",
+        dest="queries_capture_mode",
+        action="store",
+        default=CAPTURE_MODE_FULL,
+        choices=CAPTURE_MODES,
+        help="How queries are captured: 'full' stores every query, 'count' only "
+        "keeps counters. Default: full",
+    )
+    group.addoption(
+        "--django-queries-repeat",
+        dest="queries_repeat",
+        action="store",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Run each test N times to detect the tests whose query count varies "
+        "between runs. Default: 1",
+    )
+    group.addoption(
+        "--django-queries-cold-cache",
+        dest="queries_cold_cache",
+        action="store_true",
+        default=False,
+        help="Clear the caches and run each test against cold caches, "
+        "then against warm caches",
+    )
+    group.addoption(
+        "--django-queries-explain",
+        dest="queries_explain",
+        action="store_true",
+        default=False,
+        help="Store the plan of each distinct SELECT query, "
+        "explained once the test body ran",
+    )
+    group.addoption(
+        "--django-queries-resources",
+        dest="queries_resources",
+        action="store_true",
+        default=False,
+        help="Also measure the wall time, CPU time and memory peak of the tests, "
+        "the memory being traced using tracemalloc",
+    )
+    group.addoption(
+        "--django-queries-models",
+        dest="queries_models",
+        action="store_true",
+        default=False,
+        help="Also count the model instances created by the tests, by model",
+    )
+    group.addoption(
+        "--django-queries-cache",
+        dest="queries_cache",
+        action="store_true",
+        default=False,
+        help="Also count the operations on the cache backends, their hits, misses "
+        "and repeatedly read keys",
+    )
+    group.addoption(
+        "--django-queries-call-sites",
+        dest="queries_call_sites",
+        action="store_true",
+        default=False,
+        help="Record the application source lines executing the queries",
+    )
+    group.addoption(
+        "--django-queries-call-sites-sample-rate",
+        dest="queries_call_sites_sample_rate",
+        action="store",
+        type=int,
+        default=DEFAULT_SAMPLE_RATE,
+        metavar="N",
+        help="Only record the source line of one query out of N. Default: %d"
+        % DEFAULT_SAMPLE_RATE,
+    )
+    group.addoption(
+        "--django-queries-call-sites-depth",
+        dest="queries_call_sites_depth",
+        action="store",
+        type=int,
+        default=DEFAULT_MAX_DEPTH,
+        metavar="N",
+        help="The maximum number of frames to walk up looking for application "
+        "code when recording source lines. Default: %d" % DEFAULT_MAX_DEPTH,
+    )
+    group.addoption(
+        "--django-queries-fixtures",
+        dest="queries_fixtures",
+        action="store_true",
+        default=False,
+        help="Count the queries of the setup and teardown of every fixture, "
+        "by fixture name and scope, into the '%s' module of the results"
+        % FIXTURES_MODULE_NAME,
+    )
+    group.addoption(
+        "--django-queries-phase",
+        dest="queries_phase",
+        action="store",
+        default=PHASE_CALL,
+        choices=(PHASE_CALL, PHASE_ALL),
+        help="The phase of the tests checked against the query budgets and "
+        "the baseline: 'call' for the test body only, 'all' to include "
+        "the fixtures. Default: call",
+    )
+    group.addoption(
+        "--django-queries-baseline",
+        dest="queries_baseline_path",
+        action="store",
+        default=None,
+        metavar="PATH",
+        help="Fail the session if the query count of a test increased compared "
+        "to the given report",
+    )
+    group.addoption(
+        "--django-queries-update-baseline",
+        dest="queries_update_baseline",
+        action="store_true",
+        default=False,
+        help="Update the baseline with the tests that improved or are new",
+    )
+    group.addoption(
+        "--django-queries-tolerance",
+        dest="queries_baseline_tolerance",
+        action="store",
+        type=int,
+        default=0,
+        metavar="N",
+        help="The number of additional queries tolerated compared to the "
+        "baseline. Default: 0",
+    )
+    group.addoption(
+        "--django-queries-tolerance-percent",
+        dest="queries_baseline_tolerance_percent",
+        action="store",
+        type=float,
+        default=0.0,
+        metavar="PERCENT",
+        help="The percentage of additional queries tolerated compared to the "
+        "baseline. Default: 0",
+    )
 
 
 @pytest.hookimpl(tryfirst=True)
@@ -140,7 +378,36 @@ def _pytest_query_marker(request: pytest.FixtureRequest):
           Whether the fixture should be used automatically.
           This might be useful if you are executing fixtures
           that are making queries and still want to mark the test
-          but place the fixture manually."""
+          but place the fixture manually.
+        - capture (str, default: --django-queries-capture)
+          'full' to store every executed query, 'count' to only keep counters.
+          The counting mode is much cheaper on tests running a lot of queries
+          but the fixture no longer exposes the captured queries.
+        - repeat (int, default: --django-queries-repeat)
+          Run the test N times and record the min, max and most common query
+          counts, the test is flagged as unstable if its query count varies.
+        - cold_cache (bool, default: --django-queries-cold-cache)
+          Clear the caches and run the test against cold caches,
+          then against warm caches.
+        - explain (bool, default: --django-queries-explain)
+          Whether to store the plan of each distinct SELECT query.
+        - resources (bool, default: --django-queries-resources)
+          Whether to measure the wall time, CPU time and memory peak.
+        - models (bool, default: --django-queries-models)
+          Whether to count the model instances created, by model.
+        - cache (bool, default: --django-queries-cache)
+          Whether to count the operations on the cache backends.
+        - call_sites (bool, default: --django-queries-call-sites)
+          Whether to record the source lines executing the queries.
+        - call_sites_sample_rate (int,
+          default: --django-queries-call-sites-sample-rate)
+          Only record the source line of one query out of N.
+        - call_sites_depth (int, default: --django-queries-call-sites-depth)
+          The maximum number of frames to walk up looking for application code.
+        - max_queries, max_duplicates, max_db_time_ms (default: from the
+          django_queries_* ini options)
+          Fail the test if it exceeds the given query count, duplicated query count
+          or time spent in the database (in milliseconds)."""
     marker = request.node.get_closest_marker(PYTEST_QUERY_COUNT_MARKER)
     if marker:
         _process_query_count_marker(
@@ -148,6 +415,19 @@ def _pytest_query_marker(request: pytest.FixtureRequest):
         )
 
 
+def get_budget_resolver(config: pytest.Config):
+    """Returns the resolver of the test budgets from the ini options."""
+    try:
+        global_budgets = {
+            name: parse_budget_value(name, config.getini(get_budget_ini_name(name)))
+            for name in BUDGET_NAMES
+        }
+        module_budgets = parse_module_budgets(config.getini(MODULE_BUDGETS_INI_NAME))
+    except BudgetError as e:
+        raise pytest.UsageError(str(e))
+    return BudgetResolver(global_budgets, module_budgets)
+
+
 def pytest_configure(config: pytest.Config) -> None:
     config.django_queries_shared_directory = tempfile.mkdtemp(
         prefix="pytest-django-queries"
@@ -160,39 +440,196 @@ def pytest_configure(config: pytest.Config) -> None:
         "django"
     ) or config.pluginmanager.hasplugin("pytest_django.plugin")
 
+    # The results of the tests: kept in memory until the end of the session,
+    # except on the workers that cannot send them to the controller
+    # which write them into the shared directory
+    spill_path = None
+    if is_worker(config) and not can_stream_results(config):
+        spill_path = os.path.join(get_shared_directory(config), get_workerid(config))
+    config.django_queries_results = ResultAccumulator(spill_path=spill_path)
+
+    config.django_queries_budgets = get_budget_resolver(config)
+
+    config.django_queries_baseline = None
+    baseline_path = config.getoption("queries_baseline_path")
+    if config.getoption("queries_update_baseline") and not baseline_path:
+        raise pytest.UsageError(
+            "--django-queries-update-baseline requires --django-queries-baseline"
+        )
+    if baseline_path and not is_worker(config):
+        try:
+            config.django_queries_baseline = load_baseline(
+                baseline_path,
+                allow_missing=config.getoption("queries_update_baseline"),
+            )
+        except BaselineError as e:
+            raise pytest.UsageError(str(e))
+
+    # The names of the collected tests by module, when merging the results
+    config.django_queries_collected = {}
+    config.django_queries_previous_results = None
+    if config.getoption("queries_merge_results") and not is_worker(config):
+        try:
+            config.django_queries_previous_results = load_report(
+                config.getoption("queries_results_save_path")
+            )
+        except ReportError as e:
+            raise pytest.UsageError(str(e))
+
+    config.django_queries_fixture_profiler = None
+    if config.getoption("queries_fixtures"):
+        from django.db import connections
+
+        config.django_queries_fixture_profiler = FixtureProfiler(
+            connections,
+            # Their queries are counted by the tests, and the capture they
+            # start outlives their setup
+            ignored_fixtures={PYTEST_QUERY_COUNT_FIXTURE_NAME, "_pytest_query_marker"},
+        )
 
-def pytest_unconfigure(config: pytest.Config):
-    results_path = config.django_queries_shared_directory
-    test_results = {}
+    config.django_queries_store = None
+    store_path = config.getoption("queries_store_path")
+    if store_path and not is_worker(config):
+        try:
+            config.django_queries_store = ResultStore(store_path)
+        except StoreError as e:
+            raise pytest.UsageError(str(e))
 
-    for filename in listdir(results_path):
-        with open(os.path.join(results_path, filename)) as fp:
-            for result_line in fp.readlines():
-                result_line = result_line.strip()
 
-                if not result_line:
-                    continue
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config: pytest.Config, items):
+    """Records the collected tests before they get deselected,
+    to remove the tests that no longer exist when merging the results."""
+    if not config.getoption("queries_merge_results"):
+        return
+    for item in items:
+        module = getattr(item, "module", None)
+        if module is not None:
+            config.django_queries_collected.setdefault(module.__name__, set()).add(
+                item.name
+            )
+
+
+def collect_results(config: pytest.Config):
+    """Returns the results of every test, from the shared directory
+    and from the results sent by the workers."""
+    test_results = read_spilled_results(config.django_queries_shared_directory)
+    config.django_queries_results.merge(test_results)
+    return config.django_queries_results.results
+
+
+def check_baseline(session: pytest.Session, test_results):
+    """Fails the session if a test regressed compared to the baseline,
+    and updates the baseline if asked to."""
+    config = session.config
+    baseline_path = config.getoption("queries_baseline_path")
+    regressions = find_regressions(
+        config.django_queries_baseline,
+        test_results,
+        tolerance=config.getoption("queries_baseline_tolerance"),
+        tolerance_percent=config.getoption("queries_baseline_tolerance_percent"),
+        phase=config.getoption("queries_phase"),
+    )
 
-                module_name, test_name, query_count, duplicates = result_line.split(
-                    "\t"
-                )
+    # Reported in the terminal summary, after the progress of the tests
+    config.django_queries_regressions = regressions
+    if regressions:
+        session.exitstatus = pytest.ExitCode.TESTS_FAILED
 
-                module_entries = test_results.setdefault(module_name, {})
-                module_entries[test_name] = {
-                    "query-count": int(query_count),
-                    "duplicates": int(duplicates),
-                }
+    if config.getoption("queries_update_baseline"):
+        save_results_to_json(
+            save_path=baseline_path,
+            backup_path=None,
+            data=ratchet_baseline(
+                config.django_queries_baseline,
+                test_results,
+                phase=config.getoption("queries_phase"),
+            ),
+        )
 
-    if test_results:
+
+def pytest_terminal_summary(terminalreporter, config: pytest.Config):
+    """Reports the tests that regressed compared to the baseline."""
+    regressions = getattr(config, "django_queries_regressions", None)
+    if not regressions:
+        return
+    terminalreporter.write_sep(
+        "=",
+        "%d test(s) regressed compared to the baseline %s"
+        % (len(regressions), config.getoption("queries_baseline_path")),
+        red=True,
+    )
+    for comparison in regressions:
+        terminalreporter.write_line(format_regression(comparison))
+
+
+def add_fixture_entries(config: pytest.Config):
+    """Adds the queries of the fixtures to the results of the process."""
+    for name, results in config.django_queries_fixture_profiler.get_results().items():
+        config.django_queries_results.add(FIXTURES_MODULE_NAME, name, results)
+
+
+def pytest_sessionfinish(session: pytest.Session, exitstatus):
+    config = session.config
+    if config.django_queries_fixture_profiler is not None:
+        add_fixture_entries(config)
+
+    if is_worker(config):
+        if can_stream_results(config):
+            config.workeroutput[WORKER_OUTPUT_RESULTS_KEY] = (
+                config.django_queries_results.results
+            )
+            config.workeroutput[WORKER_OUTPUT_COLLECTED_KEY] = {
+                module_name: sorted(test_names)
+                for module_name, test_names in config.django_queries_collected.items()
+            }
+        else:
+            config.django_queries_results.flush()
+        return
+
+    test_results = collect_results(config)
+    report = test_results
+    if config.django_queries_previous_results is not None:
+        report = merge_report(
+            config.django_queries_previous_results,
+            test_results,
+            config.django_queries_collected,
+        )
+    if report or config.django_queries_previous_results:
         save_results_to_json(
             save_path=config.known_args_namespace.queries_results_save_path,
             backup_path=config.known_args_namespace.queries_backup_results,
-            data=test_results,
+            data=report,
         )
 
+    if config.django_queries_baseline is not None:
+        check_baseline(session, test_results)
+
+    if config.django_queries_store is not None and test_results:
+        save_results_to_store(config, test_results)
+
+
+def save_results_to_store(config: pytest.Config, test_results):
+    """Appends the results of the session to the store
+    and deletes the runs exceeding the retention."""
+    store = config.django_queries_store
+    store.add_run(
+        test_results,
+        label=config.getoption("queries_run_label"),
+        **get_git_metadata(cwd=str(config.rootpath)),
+    )
+    keep = config.getoption("queries_store_keep")
+    if keep > 0:
+        store.prune(keep)
+
+
+def pytest_unconfigure(config: pytest.Config):
     # clean up the temporary directory
     shutil.rmtree(config.django_queries_shared_directory)
 
+    if getattr(config, "django_queries_store", None) is not None:
+        config.django_queries_store.close()
+
 
 @pytest.hookimpl(optionalhook=True)
 def pytest_configure_node(node):
@@ -202,21 +639,232 @@ def pytest_configure_node(node):
     )
 
 
-def get_shared_directory(request: pytest.FixtureRequest):
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    """Merges the results of a worker as soon as it finishes."""
+    workeroutput = getattr(node, "workeroutput", {})
+    node.config.django_queries_results.merge(
+        workeroutput.get(WORKER_OUTPUT_RESULTS_KEY, {})
+    )
+    for module_name, test_names in workeroutput.get(
+        WORKER_OUTPUT_COLLECTED_KEY, {}
+    ).items():
+        node.config.django_queries_collected.setdefault(module_name, set()).update(
+            test_names
+        )
+
+
+def get_shared_directory(config: pytest.Config):
     """Returns a unique and temporary directory which can be shared by
     master or worker nodes in xdist runs.
     """
-    if not is_worker(request.config):
-        return request.config.django_queries_shared_directory
+    if not is_worker(config):
+        return config.django_queries_shared_directory
     else:
-        return get_worker_input(request.config)["_django_queries_shared_dir"]
+        return get_worker_input(config)["_django_queries_shared_dir"]
+
+
+def get_item_marker_option(item: pytest.Item, name, dest):
+    """Returns the value of a keyword-argument of the marker if provided,
+    otherwise the value of the command line option."""
+    value = item.config.getoption(dest)
+    marker = item.get_closest_marker(PYTEST_QUERY_COUNT_MARKER)
+    if marker:
+        value = marker.kwargs.get(name, value)
+    return value
+
+
+def get_marker_option(request: pytest.FixtureRequest, name, dest):
+    return get_item_marker_option(request.node, name, dest)
+
+
+def get_capture_mode(request: pytest.FixtureRequest):
+    """Returns the capture mode from the marker if provided,
+    otherwise from the command line."""
+    mode = get_marker_option(request, "capture", "queries_capture_mode")
+    if mode not in CAPTURE_MODES:
+        raise ValueError(
+            "Invalid capture mode: %r, expected one of: %s"
+            % (mode, ", ".join(CAPTURE_MODES))
+        )
+    return mode
+
+
+def get_call_site_sampler(request: pytest.FixtureRequest):
+    """Returns the sampler recording the call sites of the queries
+    if enabled, otherwise None."""
+    if not get_marker_option(request, "call_sites", "queries_call_sites"):
+        return None
+    return CallSiteSampler(
+        sample_rate=get_marker_option(
+            request, "call_sites_sample_rate", "queries_call_sites_sample_rate"
+        ),
+        max_depth=get_marker_option(
+            request, "call_sites_depth", "queries_call_sites_depth"
+        ),
+        rootdir=str(request.config.rootpath),
+    )
 
 
 @pytest.fixture
 def count_queries(request: pytest.FixtureRequest):
-    """Wrap a test to count the number of performed queries."""
-    from django.db import connection
+    """Wrap a test to count the number of performed queries
+    on every configured database.
+
+    The queries of the stages of the test can be counted separately using
+    ``with count_queries.section("name"):``."""
+    from django.db import connections
+
+    explain = get_marker_option(request, "explain", "queries_explain")
+    capture = QueryCapture(
+        connections.all(),
+        mode=get_capture_mode(request),
+        call_sites=get_call_site_sampler(request),
+        explain=explain,
+        resources=get_marker_option(request, "resources", "queries_resources"),
+        models=get_marker_option(request, "models", "queries_models"),
+        cache=get_marker_option(request, "cache", "queries_cache"),
+    )
+    request.node.stash[capture_key] = capture
+    try:
+        with capture as context:
+            capture.start_phase(PHASE_SETUP)
+            yield context
+            capture.end_phase()
+    finally:
+        del request.node.stash[capture_key]
+
+    results = context.get_results()
+    if explain:
+        # Explained outside of the capture for the EXPLAIN queries
+        # not to be counted
+        plans = explain_queries(context.get_select_samples())
+        if plans:
+            results["explain"] = plans
+    add_entry(request, results)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_fixture_setup(fixturedef, request: pytest.FixtureRequest):
+    """Count the queries of the setup of the fixture when profiling the fixtures,
+    and of its teardown once its finalizers start running."""
+    profiler = request.config.django_queries_fixture_profiler
+    if profiler is None or not profiler.is_profiled(fixturedef):
+        yield
+        return
+
+    started = profiler.start_setup()
+    try:
+        yield
+    finally:
+        profiler.end_setup(fixturedef, started)
+    # The finalizers run in the reverse order, thus this one runs
+    # before the teardown of the fixture
+    fixturedef.addfinalizer(functools.partial(profiler.start_teardown, fixturedef))
+
+
+def pytest_fixture_post_finalizer(fixturedef, request: pytest.FixtureRequest):
+    """Ends counting the queries of the teardown of the fixture."""
+    profiler = request.config.django_queries_fixture_profiler
+    if profiler is not None:
+        profiler.end_teardown(fixturedef)
+
+
+def get_repeat(item: pytest.Item):
+    """Returns the number of times the test should be run."""
+    repeat = get_item_marker_option(item, "repeat", "queries_repeat")
+    if type(repeat) is not int or repeat < 1:
+        raise ValueError("Invalid repeat count: %r, expected at least 1" % (repeat,))
+    return repeat
+
+
+def get_test_arguments(pyfuncitem: pytest.Function):
+    """Returns the fixture values and parameters the test function takes.
+
+    The signature follows ``__wrapped__``, thus the tests decorated using
+    ``functools.wraps`` (e.g. ``override_settings``) get their arguments."""
+    funcargs = pyfuncitem.funcargs
+    return {
+        arg: funcargs[arg]
+        for arg in inspect.signature(pyfuncitem.obj).parameters
+        if arg in funcargs
+    }
+
 
-    with CaptureQueriesContext(connection) as context:
-        yield context
-    add_entry(request, context, get_shared_directory(request))
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem: pytest.Function):
+    """Run the test as many times as requested, each pass being captured
+    separately. When measuring cold caches, the first pass is run after
+    clearing the caches and is not part of the repeated passes.
+
+    The other tests are left to the other implementations of the hook."""
+    capture = pyfuncitem.stash.get(capture_key, None)
+    if capture is None:
+        return None
+
+    repeat = get_repeat(pyfuncitem)
+    cold_cache = get_item_marker_option(pyfuncitem, "cold_cache", "queries_cold_cache")
+    if repeat == 1 and not cold_cache:
+        return None
+
+    testargs = get_test_arguments(pyfuncitem)
+    if cold_cache:
+        # Clearing a database cache runs queries
+        clear_caches()
+        capture.reset()
+        pyfuncitem.obj(**testargs)
+        capture.end_cold_pass()
+        capture.reset()
+
+    for index in range(repeat):
+        if index:
+            capture.reset()
+        pyfuncitem.obj(**testargs)
+        capture.end_pass()
+    return True
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_runtest_setup(item: pytest.Item):
+    """Start counting the queries of the test body separately,
+    once the fixtures are set up."""
+    capture = item.stash.get(capture_key, None)
+    if capture is not None:
+        capture.start_phase(PHASE_CALL)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_teardown(item: pytest.Item):
+    """Count the queries of the fixture teardowns separately."""
+    capture = item.stash.get(capture_key, None)
+    if capture is not None:
+        capture.start_phase(PHASE_TEARDOWN)
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_runtest_call(item: pytest.Item):
+    """Fail the test if it exceeded its query budgets, once its body ran."""
+    capture = item.stash.get(capture_key, None)
+    if capture is None:
+        return
+    capture.end_phase()
+
+    marker = item.get_closest_marker(PYTEST_QUERY_COUNT_MARKER)
+    budgets = item.config.django_queries_budgets.get_budgets(
+        item.module.__name__, marker.kwargs if marker else {}
+    )
+    if not budgets:
+        return
+
+    # The results of the call phase were computed when it ended, the whole
+    # results are only computed to report the exceeded budgets
+    phase = item.config.getoption("queries_phase")
+    if phase == PHASE_CALL:
+        results = capture.phases[PHASE_CALL]
+    else:
+        results = capture.get_totals()
+    errors = check_budgets(budgets, results)
+    if errors:
+        if phase != PHASE_CALL:
+            results = get_phase_results(capture.get_results(), phase)
+        pytest.fail(format_budget_failure(errors, results), pytrace=False)
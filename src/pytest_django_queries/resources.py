@@ -0,0 +1,82 @@
+import tracemalloc
+from time import perf_counter, process_time
+
+
+class ResourceMeter(object):
+    """Measures the wall time, the CPU time of the process and the peak
+    of the memory allocated by Python (traced using ``tracemalloc``)
+    between snapshots.
+
+    The memory peak of tracemalloc is reset on every snapshot, thus the peak
+    between two snapshots is the highest of the peaks recorded in-between.
+    """
+
+    def __init__(self):
+        # The memory peak since the previous snapshot, for each snapshot
+        self._peaks = []
+        self._started_tracing = False
+        self.start = None
+        self.end = None
+
+    def snapshot(self):
+        """Returns the wall and CPU time, the allocated memory and the index
+        of the memory peak, to later get the usage since the snapshot."""
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self._peaks.append(peak)
+        return perf_counter(), process_time(), current, len(self._peaks)
+
+    def reset(self):
+        """Measures the usage from now on, forgetting the previous usage."""
+        self.start = self.snapshot()
+
+    def rewind(self, snapshot):
+        """Forgets the usage since the given snapshot, and returns
+        the snapshot to measure from.
+
+        The time spent since the snapshot is taken off by moving the start
+        of the measure forward, and the memory peaks recorded since then
+        are dropped.
+        """
+        now = self.snapshot()
+        wall_time, cpu_time, current, peak_index = self.start
+        self.start = (
+            wall_time + now[0] - snapshot[0],
+            cpu_time + now[1] - snapshot[1],
+            current,
+            peak_index,
+        )
+        for index in range(snapshot[3], now[3]):
+            self._peaks[index] = 0
+        return now
+
+    def get_results(self, start=None, end=None):
+        """Returns the wall and CPU time (in milliseconds) and the memory peak
+        above the memory allocated at the start (in KiB) between two snapshots.
+
+        :param start: The start snapshot, the start of the measure by default.
+        :param end: The end snapshot, the end of the measure or now by default.
+        """
+        start = start or self.start
+        end = end or self.end or self.snapshot()
+        wall_time, cpu_time, current, peak_index = start
+        memory_peak = max(self._peaks[peak_index : end[3]]) - current
+        return {
+            "wall-time": round((end[0] - wall_time) * 1000, 3),
+            "cpu-time": round((end[1] - cpu_time) * 1000, 3),
+            "memory-peak": round(max(memory_peak, 0) / 1024, 1),
+        }
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.end = None
+        self.reset()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = self.snapshot()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
@@ -0,0 +1,245 @@
+import json
+import os.path
+import re
+from os import listdir
+
+# The number of results buffered before being written into the shared directory
+DEFAULT_BATCH_SIZE = 1000
+
+# The number of characters read at once when streaming a report
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE_RE = re.compile(r"\s*")
+
+# The pseudo-module holding the queries of the fixtures, by fixture name
+# and scope. Unlike the tests, a fixture can run in several processes,
+# thus its results are summed when merged.
+FIXTURES_MODULE_NAME = "<fixtures>"
+
+
+class ReportError(ValueError):
+    pass
+
+
+def load_report(path):
+    """Loads the results of a previous report, or returns empty results
+    if there is none."""
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as fp:
+        try:
+            report = json.load(fp)
+        except ValueError as e:
+            raise ReportError("The report %s is not valid json: %s" % (path, str(e)))
+    if type(report) is not dict:
+        raise ReportError("The report %s is not a dictionary" % path)
+    return report
+
+
+class _ReportReader(object):
+    """Reads the modules of a JSON report incrementally.
+
+    The top-level dictionary is parsed by hand, each module being decoded
+    using ``JSONDecoder.raw_decode`` once the buffer holds it entirely.
+    When it does not, the buffer is extended by an increasing amount
+    for large modules not to be decoded too many times.
+    """
+
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.name = getattr(fp, "name", "<stream>")
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def _read(self, size):
+        chunk = self.fp.read(size)
+        self.buffer = self.buffer[self.position :] + chunk
+        self.position = 0
+        if not chunk:
+            self.eof = True
+
+    def _peek(self):
+        """Returns the next non-whitespace character, or None at the end
+        of the file."""
+        while True:
+            self.position = _WHITESPACE_RE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if self.eof:
+                return None
+            self._read(self.chunk_size)
+
+    def _error(self, message):
+        return ReportError("The report %s is not valid json: %s" % (self.name, message))
+
+    def _consume(self, char):
+        if self._peek() != char:
+            raise self._error("expected %r" % char)
+        self.position += 1
+
+    def _decode(self):
+        self._peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, self.position = self.decoder.raw_decode(
+                    self.buffer, self.position
+                )
+                return value
+            except ValueError as e:
+                if self.eof:
+                    raise self._error(str(e))
+            self._read(size)
+            size *= 2
+
+    def __iter__(self):
+        if self._peek() != "{":
+            self._decode()
+            raise ReportError("The report %s is not a dictionary" % self.name)
+        self.position += 1
+
+        if self._peek() == "}":
+            self.position += 1
+        else:
+            while True:
+                if self._peek() != '"':
+                    raise self._error("expected a module name")
+                module_name = self._decode()
+                self._consume(":")
+                yield module_name, self._decode()
+                if self._peek() != ",":
+                    break
+                self.position += 1
+            self._consume("}")
+
+        if self._peek() is not None:
+            raise self._error("extra data")
+
+
+def iter_report_modules(fp, chunk_size=STREAM_CHUNK_SIZE):
+    """Yields the name and the tests of each module of a JSON report,
+    in the order of the file.
+
+    The report is read incrementally: a single module is held in memory
+    at once, instead of the whole report.
+
+    :raises ReportError: If the report is not a valid JSON dictionary.
+    """
+    return iter(_ReportReader(fp, chunk_size))
+
+
+def merge_report(report, test_results, collected_tests):
+    """Returns the results of a previous report updated with the results of
+    the session.
+
+    The tests of the collected modules that were not collected this time
+    no longer exist, thus they are pruned. The modules that were not collected
+    are kept as they are.
+
+    :param collected_tests: The names of the collected tests, by module.
+    :type collected_tests: dict[str, collections.abc.Container]
+    """
+    merged = {}
+    for module_name, module_entries in report.items():
+        if module_name == FIXTURES_MODULE_NAME and module_name in test_results:
+            # Replaced by the fixtures of the session instead of being summed
+            continue
+        if module_name not in collected_tests:
+            merged[module_name] = module_entries
+            continue
+        collected = collected_tests[module_name]
+        module_entries = {
+            test_name: test_data
+            for test_name, test_data in module_entries.items()
+            if test_name in collected
+        }
+        if module_entries:
+            merged[module_name] = module_entries
+    merge_results(merged, test_results)
+    return merged
+
+
+def add_fixture_results(left, right):
+    """Returns the sum of the results of a fixture from two processes."""
+    total = dict(left)
+    for key, value in right.items():
+        if key not in total:
+            total[key] = value
+        elif isinstance(value, dict):
+            total[key] = add_fixture_results(total[key], value)
+        elif key == "db-time-max":
+            total[key] = max(total[key], value)
+        elif isinstance(value, (int, float)):
+            total[key] = round(total[key] + value, 3)
+    return total
+
+
+def merge_results(test_results, new_results):
+    """Merges the results of some tests into the results of the session."""
+    for module_name, module_entries in new_results.items():
+        entries = test_results.setdefault(module_name, {})
+        if module_name != FIXTURES_MODULE_NAME:
+            entries.update(module_entries)
+            continue
+        for fixture_name, fixture_data in module_entries.items():
+            entries[fixture_name] = add_fixture_results(
+                entries.get(fixture_name, {}), fixture_data
+            )
+
+
+class ResultAccumulator(object):
+    """Accumulates the results of the tests in memory, by module and test name.
+
+    When a spill path is given, the results are also written to it in batches
+    of ``batch_size`` results, for processes that cannot send their results
+    in memory (xdist workers without a worker output). Each result is written
+    as a JSON line, thus test names are not restricted.
+    """
+
+    def __init__(self, spill_path=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param spill_path: The file to write the results to, if any.
+        :type spill_path: str
+        :param batch_size: The number of results buffered before writing them.
+        :type batch_size: int
+        """
+        self.results = {}
+        self.spill_path = spill_path
+        self.batch_size = max(batch_size, 1)
+        self._pending = []
+
+    def add(self, module_name, test_name, test_results):
+        if self.spill_path is not None:
+            self._pending.append([module_name, test_name, test_results])
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+            return
+        self.results.setdefault(module_name, {})[test_name] = test_results
+
+    def merge(self, new_results):
+        merge_results(self.results, new_results)
+
+    def flush(self):
+        """Writes the pending results to the spill path."""
+        if not self._pending:
+            return
+        with open(self.spill_path, mode="a") as fp:
+            fp.writelines(json.dumps(entry) + "\n" for entry in self._pending)
+        del self._pending[:]
+
+
+def read_spilled_results(directory):
+    """Returns the results written into the given directory
+    by the accumulators having a spill path."""
+    test_results = {}
+    for filename in listdir(directory):
+        with open(os.path.join(directory, filename)) as fp:
+            for result_line in fp:
+                if not result_line.strip():
+                    continue
+                module_name, test_name, results = json.loads(result_line)
+                merge_results(test_results, {module_name: {test_name: results}})
+    return test_results
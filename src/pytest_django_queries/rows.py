@@ -0,0 +1,135 @@
+import weakref
+
+
+class QueryRows(object):
+    """The number of rows fetched or affected by an executed query."""
+
+    __slots__ = ("counter", "fingerprint", "rows", "returning")
+
+    def __init__(self, counter, fingerprint):
+        self.counter = counter
+        self.fingerprint = fingerprint
+        self.rows = 0
+        # Whether the rows fetched are the rows affected by the query,
+        # e.g. the rows returned by 'INSERT ... RETURNING'
+        self.returning = False
+
+    def add(self, rows):
+        self.rows += rows
+        self.counter.update_worst_query(self)
+
+
+class RowCountingCursor(object):
+    """Wraps a database cursor to count the rows fetched by the last query
+    executed on it, however they are fetched."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.query = None
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def _count(self, rows):
+        if self.query is not None and rows:
+            self.query.add(rows)
+            self.query.counter.rows_fetched += rows
+            if self.query.returning:
+                self.query.counter.rows_affected += rows
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self._count(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self.cursor:
+            self._count(1)
+            yield row
+
+
+class RowCounter(object):
+    """Counts the rows fetched and affected by the queries of a connection,
+    and finds the query fetching or affecting the most rows."""
+
+    def __init__(self):
+        # The Django cursors whose database cursor is wrapped
+        self._cursor_wrappers = weakref.WeakSet()
+        self.reset()
+
+    def reset(self):
+        self.rows_fetched = 0
+        self.rows_affected = 0
+        self.worst_query = None
+
+    @classmethod
+    def combine(cls, row_counters):
+        """Returns the combined counts of the given row counters."""
+        combined = cls()
+        for row_counter in row_counters:
+            combined.rows_fetched += row_counter.rows_fetched
+            combined.rows_affected += row_counter.rows_affected
+            if row_counter.worst_query is not None:
+                combined.update_worst_query(row_counter.worst_query)
+        return combined
+
+    def track(self, cursor_wrapper, fingerprint):
+        """Starts counting the rows of a query about to be executed.
+
+        :param cursor_wrapper: The Django cursor executing the query.
+        :type cursor_wrapper: django.db.backends.utils.CursorWrapper
+        :rtype: QueryRows
+        """
+        cursor = cursor_wrapper.cursor
+        if not isinstance(cursor, RowCountingCursor):
+            cursor = cursor_wrapper.cursor = RowCountingCursor(cursor)
+            self._cursor_wrappers.add(cursor_wrapper)
+        cursor.query = QueryRows(self, fingerprint)
+        return cursor.query
+
+    def untrack(self):
+        """Restores the database cursors wrapped to count the rows,
+        for the cursors outliving the counting not to keep counting."""
+        for cursor_wrapper in list(self._cursor_wrappers):
+            cursor = cursor_wrapper.cursor
+            if isinstance(cursor, RowCountingCursor):
+                cursor_wrapper.cursor = cursor.cursor
+        self._cursor_wrappers.clear()
+
+    def add_affected(self, query, cursor_wrapper):
+        """Counts the rows affected by a data modification query.
+
+        Some databases (e.g. SQLite) only count the rows of a query returning
+        rows once fetched, the rows fetched are then counted as affected."""
+        rowcount = getattr(cursor_wrapper, "rowcount", -1)
+        if rowcount is not None and rowcount > 0:
+            self.rows_affected += rowcount
+            query.add(rowcount)
+        else:
+            query.returning = True
+
+    def update_worst_query(self, query):
+        if self.worst_query is None or query.rows > self.worst_query.rows:
+            self.worst_query = query
+
+    def get_results(self):
+        results = {
+            "rows-fetched": self.rows_fetched,
+            "rows-affected": self.rows_affected,
+        }
+        if self.worst_query is not None:
+            results["worst-query"] = [
+                [self.worst_query.fingerprint, self.worst_query.rows]
+            ]
+        return results
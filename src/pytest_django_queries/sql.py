@@ -0,0 +1,106 @@
+import re
+from functools import lru_cache
+
+PLACEHOLDER = "?"
+COLLAPSED_LIST = "(...)"
+
+STATEMENT_VERBS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+OTHER_VERB = "OTHER"
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+|\?")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+# A parenthesized list of placeholders, e.g. the values of 'IN (?, ?, ?)',
+# optionally repeated, e.g. the rows of 'VALUES (?, ?), (?, ?)'
+_PARAM_LIST_RE = re.compile(
+    r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*"
+)
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRANSACTION_CONTROL_RE = re.compile(
+    r"^\s*(?:BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|START\s+TRANSACTION|END)\b",
+    re.IGNORECASE,
+)
+_VERB_RE = re.compile(r"^\s*\(*\s*(\w+)")
+# A table name following a keyword, optionally quoted and schema-qualified,
+# or a parenthesis opening a subquery or another group, or closing a group.
+# The keywords preceded by DISTINCT (e.g. 'IS DISTINCT FROM'), DO or FOR
+# (e.g. 'ON CONFLICT DO UPDATE', 'FOR UPDATE NOWAIT') do not refer to tables
+_TABLE_RE = re.compile(
+    r"(?P<open>\()\s*(?P<subquery>SELECT\b|WITH\b)?"
+    r"|(?P<close>\))"
+    r"|\b(?P<prefix>(?:DISTINCT|DO|FOR)\s+)?(?P<keyword>FROM|JOIN|INTO|UPDATE)\s+"
+    r"(?P<table>(?:[\"`\[]?\w+[\"`\]]?\.)*[\"`\[]?\w+[\"`\]]?)",
+    re.IGNORECASE,
+)
+_QUOTES_RE = re.compile(r"[\"`\[\]]")
+# The names of the common table expressions, which are not tables
+_CTE_NAME_RE = re.compile(
+    r"(?:\bWITH(?:\s+RECURSIVE)?|,)\s+[\"`]?(\w+)[\"`]?\s+AS\s*\(", re.IGNORECASE
+)
+
+
+@lru_cache(maxsize=4096)
+def fingerprint_sql(sql):
+    """Returns the fingerprint of a SQL query: the query without its
+    parameters and literals, and with its lists of values collapsed.
+
+    Thus queries only differing by their parameters,
+    such as the ones of a N+1 pattern, have the same fingerprint:
+
+    >>> fingerprint_sql("SELECT * FROM book WHERE id IN (1, 2) AND title = 'a'")
+    'SELECT * FROM book WHERE id IN (...) AND title = ?'
+    """
+    sql = _STRING_RE.sub(PLACEHOLDER, sql)
+    sql = _PARAM_RE.sub(PLACEHOLDER, sql)
+    sql = _NUMBER_RE.sub(PLACEHOLDER, sql)
+    sql = _PARAM_LIST_RE.sub(COLLAPSED_LIST, sql)
+    return _WHITESPACE_RE.sub(" ", sql).strip()
+
+
+@lru_cache(maxsize=4096)
+def is_transaction_control(sql):
+    """Returns whether a statement controls a transaction (e.g. ``BEGIN``,
+    ``SAVEPOINT``, ``RELEASE SAVEPOINT``) instead of querying data."""
+    return _TRANSACTION_CONTROL_RE.match(sql) is not None
+
+
+@lru_cache(maxsize=4096)
+def classify_statement(sql):
+    """Returns the verb of a statement (``SELECT``, ``INSERT``, ``UPDATE``,
+    ``DELETE`` or ``OTHER``) and the tables it reads from or writes to.
+
+    >>> classify_statement('SELECT "a"."id" FROM "a" INNER JOIN "b" ON ...')
+    ('SELECT', ('a', 'b'))
+    """
+    match = _VERB_RE.match(sql)
+    verb = match.group(1).upper() if match else OTHER_VERB
+    if verb == "WITH":
+        verb = "SELECT"
+    if verb not in STATEMENT_VERBS:
+        return OTHER_VERB, ()
+    tables = []
+    cte_names = set(_CTE_NAME_RE.findall(sql))
+    for table in _iter_table_names(sql):
+        table = _QUOTES_RE.sub("", table)
+        if table not in tables and table not in cte_names:
+            tables.append(table)
+    return verb, tuple(tables)
+
+
+def _iter_table_names(sql):
+    """Yields the names of the tables referred to by a statement, skipping the
+    ``FROM`` of the function calls, e.g. ``EXTRACT(MONTH FROM "created")``."""
+    # Whether each parenthesized group being parsed is a subquery
+    groups = []
+    for match in _TABLE_RE.finditer(sql):
+        if match.group("open"):
+            groups.append(match.group("subquery") is not None)
+        elif match.group("close"):
+            if groups:
+                groups.pop()
+        elif match.group("prefix"):
+            continue
+        elif match.group("keyword").upper() == "FROM" and groups and not groups[-1]:
+            continue
+        else:
+            yield match.group("table")
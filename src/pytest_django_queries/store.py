@@ -0,0 +1,161 @@
+import json
+import sqlite3
+import subprocess
+from datetime import datetime, timezone
+
+LATEST_RUN = "latest"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    label TEXT,
+    git_sha TEXT,
+    git_branch TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_label ON runs (label, id);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    module_name TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (run_id, module_name, test_name)
+);
+CREATE INDEX IF NOT EXISTS results_test ON results (module_name, test_name, run_id);
+"""
+
+
+class StoreError(ValueError):
+    pass
+
+
+def _run_git(*args, cwd=None):
+    try:
+        output = subprocess.check_output(
+            ("git",) + args, cwd=cwd, stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip() or None
+
+
+def get_git_metadata(cwd=None):
+    """Returns the current git commit SHA and branch,
+    or None for the values that could not be found."""
+    return {
+        "git_sha": _run_git("rev-parse", "HEAD", cwd=cwd),
+        "git_branch": _run_git("rev-parse", "--abbrev-ref", "HEAD", cwd=cwd),
+    }
+
+
+class ResultStore(object):
+    """Stores the results of every run into a SQLite database.
+
+    A run can be referred to by its ID, by its label (the latest run having it),
+    by ``latest`` or by ``latest~N`` for the Nth run before the latest one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.db = sqlite3.connect(path)
+            self.db.execute("PRAGMA foreign_keys = ON")
+            self.db.executescript(_SCHEMA)
+        except sqlite3.DatabaseError as e:
+            raise StoreError("Invalid result store %s: %s" % (path, str(e)))
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_run(self, results, label=None, git_sha=None, git_branch=None):
+        """Saves the results of a run.
+
+        :returns: The ID of the run.
+        :rtype: int
+        """
+        created_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO runs (created_at, label, git_sha, git_branch) "
+                "VALUES (?, ?, ?, ?)",
+                (created_at, label, git_sha, git_branch),
+            )
+            run_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO results (run_id, module_name, test_name, data) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    (run_id, module_name, test_name, json.dumps(test_data))
+                    for module_name, module_entries in results.items()
+                    for test_name, test_data in module_entries.items()
+                ),
+            )
+        return run_id
+
+    def get_runs(self):
+        """Returns the runs, from the latest to the oldest.
+
+        :rtype: list[dict]
+        """
+        cursor = self.db.execute(
+            "SELECT runs.id, created_at, label, git_sha, git_branch, "
+            "(SELECT COUNT(*) FROM results WHERE run_id = runs.id) "
+            "FROM runs ORDER BY runs.id DESC"
+        )
+        columns = ("id", "created_at", "label", "git_sha", "git_branch", "tests")
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def resolve_run(self, reference):
+        """Returns the ID of the run matching the given reference."""
+        reference = str(reference)
+        if reference.isdigit():
+            row = self.db.execute(
+                "SELECT id FROM runs WHERE id = ?", (int(reference),)
+            ).fetchone()
+        elif reference == LATEST_RUN or reference.startswith(LATEST_RUN + "~"):
+            offset = reference[len(LATEST_RUN) + 1 :] or "0"
+            if not offset.isdigit():
+                raise StoreError("Invalid run reference: %r" % reference)
+            row = self.db.execute(
+                "SELECT id FROM runs ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (int(offset),),
+            ).fetchone()
+        else:
+            row = self.db.execute(
+                "SELECT id FROM runs WHERE label = ? ORDER BY id DESC LIMIT 1",
+                (reference,),
+            ).fetchone()
+        if row is None:
+            raise StoreError("No such run: %s" % reference)
+        return row[0]
+
+    def get_results(self, run_id):
+        """Returns the results of a run in the format of the JSON reports."""
+        results = {}
+        cursor = self.db.execute(
+            "SELECT module_name, test_name, data FROM results WHERE run_id = ?",
+            (run_id,),
+        )
+        for module_name, test_name, data in cursor:
+            results.setdefault(module_name, {})[test_name] = json.loads(data)
+        return results
+
+    def prune(self, keep):
+        """Deletes every run but the ``keep`` latest ones.
+
+        :returns: The number of deleted runs.
+        :rtype: int
+        """
+        with self.db:
+            cursor = self.db.execute(
+                "DELETE FROM runs WHERE id NOT IN "
+                "(SELECT id FROM runs ORDER BY id DESC LIMIT ?)",
+                (max(keep, 0),),
+            )
+        return cursor.rowcount
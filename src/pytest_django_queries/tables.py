@@ -1,24 +1,116 @@
+import shutil
+
 import click
 from beautifultable import BeautifulTable
 
-from pytest_django_queries.entry import Entry, iter_entries
+from pytest_django_queries.entry import (
+    PHASE_ALL,
+    Entry,
+    flatten_entries,
+    get_endpoints,
+    get_hot_tables,
+    iter_entries,
+)
 from pytest_django_queries.filters import format_underscore_name_to_human
+from pytest_django_queries.sql import STATEMENT_VERBS
+
+# The number of tables listed by the hot tables view of the HTML report
+HOT_TABLES_COUNT = 20
+
+
+def get_table_width():
+    """Returns the width of the tables: the whole terminal width to not wrap
+    the extra columns, BeautifulTable defaults to 80 characters."""
+    return max(shutil.get_terminal_size().columns, 80)
 
 
-def print_entries(data):
-    table = BeautifulTable()
+def print_entries(data, by_database=False, phase=PHASE_ALL, columns=()):
+    """Prints the tests of each module.
+
+    :param columns: The extra fields to display when the entries have them,
+                    e.g. ``db-time``, or None to display every extra field.
+    :type columns: collections.abc.Container
+    """
+    maxwidth = get_table_width()
+    table = BeautifulTable(maxwidth=maxwidth)
     table.columns.header = ["Module", "Tests"]
-    for module_name, module_entries in iter_entries(data):
-        subtable = BeautifulTable()
-        subtable.columns.header = [field for _, field in Entry.FIELDS]
+    for module_name, module_entries in iter_entries(
+        data, by_database=by_database, phase=phase
+    ):
+        module_entries = list(module_entries)
+        fields = Entry.get_fields(module_entries, columns=columns)
+        subtable = BeautifulTable(maxwidth=maxwidth)
+        subtable.columns.header = [field for _, field in fields]
         for entry in module_entries:
-            subtable.rows.append([getattr(entry, field) for field, _ in Entry.FIELDS])
+            subtable.rows.append([getattr(entry, field) for field, _ in fields])
         table.rows.append([module_name, subtable])
     click.echo(table)
 
 
-def entries_to_html(data, template):
+def print_details(data, by_database=False, phase=PHASE_ALL):
+    """Prints the details of each test, such as their most repeated queries."""
+    for module_name, module_entries in iter_entries(
+        data, by_database=by_database, phase=phase
+    ):
+        for entry in module_entries:
+            details = entry.get_details()
+            if not details:
+                continue
+
+            click.echo()
+            click.echo("# %s::%s" % (module_name, entry.test_name))
+            for name, rows in details:
+                click.echo("  %s:" % name)
+                for label, count in rows:
+                    click.echo("  %6d  %s" % (count, label))
+
+
+def print_hot_tables(data, limit=None):
+    """Prints the tables queried the most across every test."""
+    table = BeautifulTable(maxwidth=get_table_width())
+    table.columns.header = ["Table", "Queries"] + list(STATEMENT_VERBS) + ["Tests"]
+    for hot_table in get_hot_tables(flatten_entries(data), limit=limit):
+        table.rows.append(
+            [hot_table.table, hot_table.query_count]
+            + [hot_table.verbs.get(verb, 0) for verb in STATEMENT_VERBS]
+            + [hot_table.test_count]
+        )
+    click.echo(table)
+
+
+def print_endpoints(data, limit=None):
+    """Prints the endpoints running the most queries across every test."""
+    table = BeautifulTable(maxwidth=get_table_width())
+    table.columns.header = [
+        "Endpoint",
+        "Requests",
+        "Queries",
+        "Avg",
+        "Max",
+        "Duplicated",
+        "Tests",
+    ]
+    for endpoint in get_endpoints(flatten_entries(data), limit=limit):
+        table.rows.append(
+            [
+                endpoint.endpoint,
+                endpoint.request_count,
+                endpoint.query_count,
+                "%.1f" % (endpoint.query_count / max(endpoint.request_count, 1)),
+                endpoint.max_request_query_count,
+                endpoint.duplicate_count,
+                endpoint.test_count,
+            ]
+        )
+    click.echo(table)
+
+
+def entries_to_html(data, template, by_database=False, phase=PHASE_ALL):
     html_content = template.render(
-        data=iter_entries(data), humanize=format_underscore_name_to_human
+        data=iter_entries(data, by_database=by_database, phase=phase),
+        humanize=format_underscore_name_to_human,
+        get_extra_fields=Entry.get_extra_fields,
+        hot_tables=get_hot_tables(flatten_entries(data), limit=HOT_TABLES_COUNT),
+        statement_verbs=STATEMENT_VERBS,
     )
     return html_content
@@ -1,3 +1,4 @@
+import math
 import shutil
 import sys
 
@@ -19,3 +20,12 @@ def assert_type(value, expected_type):
 
 def create_backup(save_path, backup_path):
     shutil.copy(save_path, backup_path)
+
+
+def percentile(sorted_values, percent):
+    """Returns the given percentile of sorted values using the nearest-rank
+    method, or 0 if there are no values."""
+    if not sorted_values:
+        return 0
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
@@ -13,6 +13,61 @@ DEFAULT_PYTEST_FLAGS = [
     "django_queries",
 ]
 
+# The report keys holding query timings, they vary between runs
+TIMING_KEYS = ("db-time", "db-time-max", "db-time-p50", "db-time-p95")
+
+
+# The results of a phase of a test executing no queries
+EMPTY_PHASE_RESULTS = {
+    "query-count": 0,
+    "data-query-count": 0,
+    "transaction-count": 0,
+    "duplicates": 0,
+    "similar": 0,
+}
+# The rows of a phase of a test executing no queries, only counted
+# in the full capture mode
+EMPTY_PHASE_ROWS = {"rows-fetched": 0, "rows-affected": 0}
+
+
+def call_phases(call_results=None, rows=True):
+    """Returns the results of the phases of a test only executing queries
+    in its body, without their timings.
+
+    :param rows: Whether the rows were counted, i.e. the full capture mode.
+    """
+    empty_results = dict(EMPTY_PHASE_RESULTS, **(EMPTY_PHASE_ROWS if rows else {}))
+    return {
+        "setup": empty_results,
+        "call": dict(empty_results, **(call_results or {})),
+        "teardown": empty_results,
+    }
+
+
+def strip_timings(results):
+    """Ensure every test entry of a report holds the query timings
+    and return the report without them."""
+    stripped = {}
+    for module_name, module_entries in results.items():
+        stripped[module_name] = {
+            test_name: _strip_entry_timings(test_data)
+            for test_name, test_data in module_entries.items()
+        }
+    return stripped
+
+
+def _strip_entry_timings(test_data):
+    test_data = dict(test_data)
+    for key in TIMING_KEYS:
+        assert isinstance(test_data.pop(key), (int, float)), key
+    for key in ("databases", "phases", "sections", "requests"):
+        if key in test_data:
+            test_data[key] = {
+                name: _strip_entry_timings(data)
+                for name, data in test_data[key].items()
+            }
+    return test_data
+
 
 @pytest.fixture
 def valid_comparison_entries():
@@ -0,0 +1,49 @@
+from django.core.cache import CacheHandler
+
+from pytest_django_queries.cache import CacheCounter
+
+LOCMEM_BACKEND = "django.core.cache.backends.locmem.LocMemCache"
+
+
+def get_caches():
+    return CacheHandler(
+        {
+            "default": {"BACKEND": LOCMEM_BACKEND, "LOCATION": "default"},
+            "sessions": {"BACKEND": LOCMEM_BACKEND, "LOCATION": "sessions"},
+        }
+    )
+
+
+def test_counter_counts_operations_hits_and_misses():
+    caches = get_caches()
+    cache = caches["default"]
+    with CacheCounter(caches) as counter:
+        cache.set("book:1", "Dune")
+        assert cache.get("book:1") == "Dune"
+        assert cache.get("book:1") == "Dune"
+        assert cache.get("book:2", "missing") == "missing"
+        snapshot = counter.snapshot()
+        # Implemented using get and set, only counted once
+        assert cache.get_many(["book:1", "book:2", "book:3"]) == {"book:1": "Dune"}
+        cache.delete("book:1")
+        caches["sessions"].get("book:1")
+
+    # Not counted once exited
+    cache.get("book:1")
+    assert "get" not in vars(cache)
+
+    assert counter.get_results() == {
+        "cache-calls": 7,
+        "cache-hits": 3,
+        "cache-misses": 4,
+        "cache-repeated-keys": 3,
+        "cache-operations": {"delete": 1, "get": 4, "get_many": 1, "set": 1},
+        "top-cache-keys": [["book:1", 3], ["book:2", 2]],
+    }
+    assert counter.get_results(snapshot) == {
+        "cache-calls": 3,
+        "cache-hits": 1,
+        "cache-misses": 3,
+        "cache-repeated-keys": 0,
+        "cache-operations": {"delete": 1, "get": 1, "get_many": 1},
+    }
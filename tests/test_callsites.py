@@ -0,0 +1,31 @@
+import os.path
+import sys
+
+import django
+import pytest
+
+from pytest_django_queries import callsites
+
+
+@pytest.mark.parametrize(
+    "filename, expected",
+    [
+        (django.__file__, True),
+        (callsites.__file__, True),
+        (os.__file__, True),
+        ("<string>", True),
+        ("/venv/lib/python3.12/site-packages/pkg/module.py", True),
+        (__file__, False),
+    ],
+)
+def test_is_library_file(filename, expected):
+    assert callsites.is_library_file(filename) is expected
+
+
+def test_call_sites_are_relative_to_rootdir():
+    sampler = callsites.CallSiteSampler(rootdir=os.path.dirname(__file__))
+    sampler.sample(depth=0)
+    lineno = sys._getframe().f_lineno - 1
+    assert sampler.get_results() == {
+        "call-sites": [["test_callsites.py:%d" % lineno, 1]]
+    }
@@ -239,3 +239,431 @@ def test_backup_command_is_making_a_backup(testdir):
     assert backup_file.check()
     with open(str(backup_file), "r") as fp:
         assert fp.read() == "hello!"
+
+
+MULTI_DATABASE_DATA = {
+    "module1": {
+        "test1": {
+            "query-count": 3,
+            "duplicates": 1,
+            "databases": {
+                "default": {"query-count": 1, "duplicates": 0},
+                "replica": {"query-count": 2, "duplicates": 1},
+            },
+        },
+        "test2": {"query-count": 1, "duplicates": 0},
+    }
+}
+
+
+def test_show_breaks_down_results_by_database(testdir):
+    testdir.makefile(".json", test_file=json.dumps(MULTI_DATABASE_DATA))
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["show", "--by-database", "test_file.json"])
+    assert result.exit_code == 0, result.output
+    assert (
+        result.stdout.strip()
+        == dedent("""
+            +---------+-------------------------------------------+
+            | Module  |                   Tests                   |
+            +---------+-------------------------------------------+
+            | module1 | +----------------+---------+------------+ |
+            |         | |   Test Name    | Queries | Duplicated | |
+            |         | +----------------+---------+------------+ |
+            |         | | test1[default] |    1    |     0      | |
+            |         | +----------------+---------+------------+ |
+            |         | | test1[replica] |    2    |     1      | |
+            |         | +----------------+---------+------------+ |
+            |         | |     test2      |    1    |     0      | |
+            |         | +----------------+---------+------------+ |
+            +---------+-------------------------------------------+
+    """).strip()
+    )
+
+
+def test_html_breaks_down_results_by_database(testdir):
+    testdir.makefile(".json", test_file=json.dumps(MULTI_DATABASE_DATA))
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.main, ["html", "--by-database", "test_file.json", "-o", "-"]
+    )
+    assert result.exit_code == 0, result.stdout
+    soup = BeautifulSoup(result.stdout, "lxml")
+    rows = [
+        [cell.get_text(strip=True) for cell in row.select("td")]
+        for row in soup.select("tbody > tr")
+    ]
+    assert rows == [
+        ["1[default]", "1", "0"],
+        ["1[replica]", "2", "1"],
+        ["2", "1", "0"],
+    ]
+
+
+def test_show_displays_db_time_when_asked(testdir):
+    testdir.makefile(
+        ".json",
+        test_file=json.dumps(
+            {
+                "module1": {
+                    "test1": {
+                        "query-count": 2,
+                        "duplicates": 0,
+                        "db-time": 1.5,
+                        "db-time-max": 1.25,
+                        "db-time-p50": 0.25,
+                        "db-time-p95": 1.25,
+                    },
+                    "test2": {"query-count": 1},
+                }
+            }
+        ),
+    )
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["show", "test_file.json"], env={"COLUMNS": "120"})
+    assert result.exit_code == 0, result.output
+    assert "DB ms" not in result.stdout
+
+    result = runner.invoke(
+        cli.main, ["show", "-c", "all", "test_file.json"], env={"COLUMNS": "120"}
+    )
+    assert result.exit_code == 0, result.output
+    assert (
+        "| Test Name | Queries | Duplicated | DB ms | Max ms | P50 ms | P95 ms |"
+        in result.stdout
+    )
+    assert (
+        "|   test1   |    2    |     0      |  1.5  |  1.25  |  0.25  |  1.25  |"
+        in result.stdout
+    )
+    assert (
+        "|   test2   |    1    |    UNK     |  UNK  |  UNK   |  UNK   |  UNK   |"
+        in result.stdout
+    )
+
+
+def test_show_displays_the_given_columns_without_wrapping(testdir):
+    test_data = {
+        "query-count": 2,
+        "duplicates": 0,
+        "data-query-count": 2,
+        "transaction-count": 0,
+        "similar": 1,
+        "rows-fetched": 10,
+        "rows-affected": 0,
+        "db-time": 1.5,
+        "db-time-max": 1.25,
+        "db-time-p50": 0.25,
+        "db-time-p95": 1.25,
+    }
+    testdir.makefile(
+        ".json",
+        test_file=json.dumps({"module1": {"test_with_a_long_name": test_data}}),
+    )
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.main,
+        ["show", "-c", "db-time", "--column", "rows-fetched", "test_file.json"],
+        env={"COLUMNS": "120"},
+    )
+    assert result.exit_code == 0, result.output
+    assert "| Rows fetched | DB ms |" in result.stdout
+    assert "Similar" not in result.stdout
+
+    result = runner.invoke(
+        cli.main, ["show", "-c", "all", "test_file.json"], env={"COLUMNS": "250"}
+    )
+    assert result.exit_code == 0, result.output
+    assert (
+        "| test_with_a_long_name |    2    |     0      |      2       |      0       "
+        in result.stdout
+    )
+
+
+def test_html_displays_db_time_when_available(testdir):
+    testdir.makefile(
+        ".json",
+        test_file=json.dumps(
+            {
+                "module1": {
+                    "test1": {
+                        "query-count": 2,
+                        "duplicates": 0,
+                        "db-time": 1.5,
+                        "db-time-max": 1.25,
+                        "db-time-p50": 0.25,
+                        "db-time-p95": 1.25,
+                    }
+                }
+            }
+        ),
+    )
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["html", "test_file.json", "-o", "-"])
+    assert result.exit_code == 0, result.stdout
+    soup = BeautifulSoup(result.stdout, "lxml")
+    assert [th.get_text(strip=True) for th in soup.select("thead th")] == [
+        "Benchmark name",
+        "Query count",
+        "Duplicated count",
+        "DB ms",
+        "Max ms",
+        "P50 ms",
+        "P95 ms",
+    ]
+    assert [td.get_text(strip=True) for td in soup.select("tbody td")] == [
+        "1",
+        "2",
+        "0",
+        "1.5",
+        "1.25",
+        "0.25",
+        "1.25",
+    ]
+
+
+FINGERPRINTS_DATA = {
+    "module1": {
+        "test1": {
+            "query-count": 4,
+            "duplicates": 0,
+            "similar": 3,
+            "top-fingerprints": [["SELECT * FROM book WHERE id = ?", 4]],
+        },
+        "test2": {"query-count": 1, "duplicates": 0, "similar": 0},
+    }
+}
+
+
+def test_show_details_lists_repeated_queries(testdir):
+    testdir.makefile(".json", test_file=json.dumps(FINGERPRINTS_DATA))
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.main, ["show", "--details", "-c", "similar", "test_file.json"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "| Test Name | Queries | Duplicated | Similar |" in result.stdout
+    assert "|   test1   |    4    |     0      |    3    |" in result.stdout
+    assert result.stdout.endswith(
+        "\n# module1::test1\n"
+        "  Repeated queries:\n"
+        "       4  SELECT * FROM book WHERE id = ?\n"
+    )
+
+
+def test_html_lists_repeated_queries(testdir):
+    testdir.makefile(".json", test_file=json.dumps(FINGERPRINTS_DATA))
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["html", "test_file.json", "-o", "-"])
+    assert result.exit_code == 0, result.stdout
+    soup = BeautifulSoup(result.stdout, "lxml")
+    details = soup.select("tbody > tr.details")
+    assert len(details) == 1
+    assert details[0].select_one("small").get_text(strip=True) == "Repeated queries"
+    assert [li.get_text(" ", strip=True) for li in details[0].select("li")] == [
+        "4 × SELECT * FROM book WHERE id = ?"
+    ]
+
+
+TABLES_DATA = {
+    "module1": {
+        "test1": {
+            "query-count": 4,
+            "tables": {"book": {"SELECT": 3}, "author": {"SELECT": 1}},
+        },
+        "test2": {
+            "query-count": 3,
+            "tables": {"book": {"INSERT": 1, "UPDATE": 1}, "author": {"DELETE": 1}},
+        },
+    },
+    "module2": {"test1": {"query-count": 0}},
+}
+
+
+def test_hot_tables_lists_the_most_queried_tables(testdir):
+    testdir.makefile(".json", test_file=json.dumps(TABLES_DATA))
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["hot-tables", "test_file.json"])
+    assert result.exit_code == 0, result.output
+    assert (
+        result.stdout.strip()
+        == dedent("""
+        +--------+---------+--------+--------+--------+--------+-------+
+        | Table  | Queries | SELECT | INSERT | UPDATE | DELETE | Tests |
+        +--------+---------+--------+--------+--------+--------+-------+
+        |  book  |    5    |   3    |   1    |   1    |   0    |   2   |
+        +--------+---------+--------+--------+--------+--------+-------+
+        | author |    2    |   1    |   0    |   0    |   1    |   2   |
+        +--------+---------+--------+--------+--------+--------+-------+
+    """).strip()
+    )
+
+    result = runner.invoke(cli.main, ["hot-tables", "--limit", "1", "test_file.json"])
+    assert result.exit_code == 0, result.output
+    assert "book" in result.stdout
+    assert "author" not in result.stdout
+
+
+def test_html_lists_hot_tables(testdir):
+    testdir.makefile(".json", test_file=json.dumps(TABLES_DATA))
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["html", "test_file.json", "-o", "-"])
+    assert result.exit_code == 0, result.stdout
+    soup = BeautifulSoup(result.stdout, "lxml")
+    rows = soup.select("#hot-tables tbody > tr")
+    assert [
+        [cell.get_text(strip=True) for cell in row.select("td")] for row in rows
+    ] == [
+        ["book", "5", "3", "1", "1", "0", "2"],
+        ["author", "2", "1", "0", "0", "1", "2"],
+    ]
+
+
+REQUESTS_DATA = {
+    "module1": {
+        "test1": {
+            "query-count": 9,
+            "requests": {
+                "GET book-list": {
+                    "query-count": 6,
+                    "duplicates": 2,
+                    "request-count": 2,
+                    "request-query-count-max": 4,
+                },
+                "POST book-list": {
+                    "query-count": 3,
+                    "duplicates": 0,
+                    "request-count": 1,
+                    "request-query-count-max": 3,
+                },
+            },
+        },
+        "test2": {
+            "query-count": 5,
+            "requests": {
+                "GET book-list": {
+                    "query-count": 5,
+                    "duplicates": 0,
+                    "request-count": 1,
+                    "request-query-count-max": 5,
+                },
+            },
+        },
+    }
+}
+
+
+def test_endpoints_lists_the_endpoints_running_the_most_queries(testdir):
+    testdir.makefile(".json", test_file=json.dumps(REQUESTS_DATA))
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["endpoints", "test_file.json"])
+    assert result.exit_code == 0, result.output
+    assert (
+        result.stdout.strip()
+        == dedent("""
+        +----------------+----------+---------+-----+-----+------------+-------+
+        |    Endpoint    | Requests | Queries | Avg | Max | Duplicated | Tests |
+        +----------------+----------+---------+-----+-----+------------+-------+
+        | GET book-list  |    3     |   11    | 3.7 |  5  |     2      |   2   |
+        +----------------+----------+---------+-----+-----+------------+-------+
+        | POST book-list |    1     |    3    | 3.0 |  3  |     0      |   1   |
+        +----------------+----------+---------+-----+-----+------------+-------+
+    """).strip()
+    )
+
+    result = runner.invoke(cli.main, ["endpoints", "--limit", "1", "test_file.json"])
+    assert result.exit_code == 0, result.output
+    assert "POST book-list" not in result.stdout
+
+
+SECTIONS_DATA = {
+    "module1": {
+        "test1": {
+            "query-count": 4,
+            "duplicates": 1,
+            "sections": {
+                "load": {"query-count": 3, "duplicates": 1},
+                "render": {"query-count": 1, "duplicates": 0},
+            },
+        }
+    }
+}
+
+
+def test_show_lists_sections_as_sub_rows(testdir):
+    testdir.makefile(".json", test_file=json.dumps(SECTIONS_DATA))
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["show", "test_file.json"])
+    assert result.exit_code == 0, result.output
+    assert [line for line in result.stdout.splitlines() if "test1" in line] == [
+        "|         | |     test1     |    4    |     1      | |",
+        "|         | |  test1::load  |    3    |     1      | |",
+        "|         | | test1::render |    1    |     0      | |",
+    ]
+
+
+def test_html_lists_sections_as_sub_rows(testdir):
+    testdir.makefile(".json", test_file=json.dumps(SECTIONS_DATA))
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["html", "test_file.json", "-o", "-"])
+    assert result.exit_code == 0, result.stdout
+    soup = BeautifulSoup(result.stdout, "lxml")
+    rows = soup.select("tbody > tr")
+    assert [row.select_one("td").get_text(strip=True) for row in rows] == [
+        "1",
+        "1::load",
+        "1::render",
+    ]
+    assert [row.get("class") for row in rows] == [None, ["section"], ["section"]]
+
+
+@pytest.fixture
+def result_store(testdir):
+    from pytest_django_queries.store import ResultStore
+
+    with ResultStore(str(testdir.tmpdir.join("store.sqlite3"))) as store:
+        store.add_run({"module": {"test_foo": {"query-count": 1}}}, label="v1")
+        store.add_run({"module": {"test_foo": {"query-count": 2}}})
+    return "store.sqlite3"
+
+
+@pytest.mark.parametrize(
+    "args, expected_count",
+    (([], "2"), (["latest"], "2"), (["1"], "1"), (["v1"], "1"), (["latest~1"], "1")),
+)
+def test_show_reads_runs_from_store(result_store, args, expected_count):
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["show", "--store", result_store, *args])
+    assert result.exit_code == 0, result.output
+    assert "| test_foo  |    %s    |" % expected_count in result.stdout
+
+
+def test_show_unknown_run_from_store_triggers_error(result_store):
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["show", "--store", result_store, "v2"])
+    assert result.exit_code == 2, result.output
+    assert "Error: Invalid value for '[INPUT_FILE]': No such run: v2" in (result.stderr)
+
+
+def test_html_reads_runs_from_store(result_store):
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["html", "--store", result_store, "v1", "-o", "-"])
+    assert result.exit_code == 0, result.output
+    soup = BeautifulSoup(result.stdout, "lxml")
+    assert [td.text.strip() for td in soup.select("tbody td")] == ["foo", "1", "UNK"]
+
+
+def test_list_and_prune_store_runs(result_store):
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["runs", result_store])
+    assert result.exit_code == 0, result.output
+    lines = result.stdout.splitlines()
+    assert [line.split("\t")[0] for line in lines] == ["2", "1"]
+    assert lines[1].split("\t")[2:] == ["v1", "-", "-", "1 tests"]
+
+    result = runner.invoke(cli.main, ["prune", result_store, "--keep", "1"])
+    assert result.exit_code == 0, result.output
+    assert result.stdout == "Deleted 1 run(s)\n"
+
+    result = runner.invoke(cli.main, ["runs", result_store])
+    assert [line.split("\t")[0] for line in result.stdout.splitlines()] == ["2"]
@@ -1,8 +1,11 @@
 import json
+import os
 
+import mock
 from click.testing import CliRunner
 
 from pytest_django_queries import cli
+from tests.conftest import DEFAULT_PYTEST_FLAGS
 
 
 def test_show_diff(testdir, valid_comparison_entries):
@@ -27,3 +30,265 @@ def test_show_diff(testdir, valid_comparison_entries):
 + improved func      \t         20\t         19\t              0
   unchanged func     \t          1\t          1\t              0
 """)
+
+
+def test_show_diff_streams_sorted_reports(testdir, valid_comparison_entries):
+    """Ensure the reports having their modules sorted are read incrementally,
+    with the same output as when loading them."""
+    left, right = valid_comparison_entries
+    right = {"another_module": {"test_new_test": {"query-count": 1}}, **right}
+    testdir.makefile("json", left=json.dumps(left))
+    testdir.makefile("json", right=json.dumps(right))
+
+    runner = CliRunner()
+    with mock.patch.object(cli, "load_report") as load_report:
+        result = runner.invoke(cli.main, ["diff", "left.json", "right.json"])
+    assert result.exit_code == 0, result.stdout
+    load_report.assert_not_called()
+    assert result.stdout.startswith("""\
+# another module
+  test name          \tleft count \tright count\tduplicate count
+  -------------------\t-----------\t-----------\t---------------
++ new test           \t          -\t          1\t            UNK
+
+# module
+""")
+
+
+def test_show_diff_of_invalid_report(testdir):
+    testdir.makefile("json", left='{"test_module": {}')
+    testdir.makefile("json", right="{}")
+
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["diff", "left.json", "right.json"])
+    assert result.exit_code == 2, result.stdout
+    assert "The report left.json is not valid json" in result.stderr
+
+
+def test_show_diff_by_database(testdir):
+    left = {
+        "test_module": {
+            "test_func": {
+                "query-count": 2,
+                "duplicates": 0,
+                "databases": {
+                    "default": {"query-count": 1, "duplicates": 0},
+                    "replica": {"query-count": 1, "duplicates": 0},
+                },
+            }
+        }
+    }
+    right = {
+        "test_module": {
+            "test_func": {
+                "query-count": 2,
+                "duplicates": 0,
+                "databases": {
+                    "default": {"query-count": 2, "duplicates": 0},
+                    "replica": {"query-count": 0, "duplicates": 0},
+                },
+            }
+        }
+    }
+    testdir.makefile("json", left=json.dumps(left))
+    testdir.makefile("json", right=json.dumps(right))
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.main, ["diff", "--by-database", "left.json", "right.json"]
+    )
+    assert result.exit_code == 0, result.stdout
+    assert repr(result.stdout) == repr("""\
+# module
+  test name         \tleft count \tright count\tduplicate count
+  ------------------\t-----------\t-----------\t---------------
+- func[default]     \t          1\t          2\t              0
++ func[replica]     \t          1\t          0\t              0
+""")
+
+
+def test_show_diff_of_the_call_phase(testdir):
+    def make_report(setup_count, call_count):
+        return {
+            "test_module": {
+                "test_func": {
+                    "query-count": setup_count + call_count,
+                    "duplicates": 0,
+                    "phases": {
+                        "setup": {"query-count": setup_count, "duplicates": 0},
+                        "call": {"query-count": call_count, "duplicates": 0},
+                    },
+                }
+            }
+        }
+
+    testdir.makefile("json", left=json.dumps(make_report(1, 3)))
+    testdir.makefile("json", right=json.dumps(make_report(5, 3)))
+
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["diff", "left.json", "right.json"])
+    assert result.exit_code == 0, result.stdout
+    assert "  func     \t          3\t          3" in result.stdout
+
+    result = runner.invoke(
+        cli.main, ["diff", "--phase", "all", "left.json", "right.json"]
+    )
+    assert result.exit_code == 0, result.stdout
+    assert "- func     \t          4\t          8" in result.stdout
+
+
+def test_show_diff_of_sections(testdir):
+    def make_report(load_count, render_count):
+        return {
+            "test_module": {
+                "test_func": {
+                    "query-count": load_count + render_count,
+                    "duplicates": 0,
+                    "sections": {
+                        "load": {"query-count": load_count, "duplicates": 0},
+                        "render": {"query-count": render_count, "duplicates": 0},
+                    },
+                }
+            }
+        }
+
+    testdir.makefile("json", left=json.dumps(make_report(2, 3)))
+    testdir.makefile("json", right=json.dumps(make_report(4, 1)))
+
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["diff", "left.json", "right.json"])
+    assert result.exit_code == 0, result.stdout
+    assert repr(result.stdout) == repr("""\
+# module
+  test name        \tleft count \tright count\tduplicate count
+  -----------------\t-----------\t-----------\t---------------
+  func             \t          5\t          5\t              0
+- func::load       \t          2\t          4\t              0
++ func::render     \t          3\t          1\t              0
+""")
+
+
+def test_show_diff_from_store(testdir):
+    from pytest_django_queries.store import ResultStore
+
+    with ResultStore(str(testdir.tmpdir.join("store.sqlite3"))) as store:
+        store.add_run({"module": {"test_foo": {"query-count": 1}}}, label="v1")
+        store.add_run({"module": {"test_foo": {"query-count": 3}}})
+        store.add_run({"module": {"test_foo": {"query-count": 2}}})
+
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["diff", "--store", "store.sqlite3"])
+    assert result.exit_code == 0, result.stdout
+    assert "+ foo      \t          3\t          2" in result.stdout
+
+    result = runner.invoke(cli.main, ["diff", "--store", "store.sqlite3", "v1", "2"])
+    assert result.exit_code == 0, result.stdout
+    assert "- foo      \t          1\t          3" in result.stdout
+
+
+def test_show_plans_diff(testdir):
+    left = {
+        "test_module": {
+            "test_func": {
+                "query-count": 2,
+                "explain": {
+                    "SELECT * FROM book WHERE title = ?": {
+                        "plan": ["SEARCH book USING INDEX book_title (title=?)"],
+                        "flags": [],
+                    },
+                    "SELECT * FROM author": {
+                        "plan": ["SCAN author"],
+                        "flags": ["scan"],
+                    },
+                },
+            },
+            "test_unchanged": {"query-count": 1},
+        }
+    }
+    right = {
+        "test_module": {
+            "test_func": {
+                "query-count": 2,
+                "explain": {
+                    "SELECT * FROM book WHERE title = ?": {
+                        "plan": ["SCAN book"],
+                        "flags": ["scan"],
+                    },
+                    "SELECT * FROM author": {
+                        "plan": ["SCAN author"],
+                        "flags": ["scan"],
+                    },
+                },
+            },
+            "test_unchanged": {"query-count": 1},
+        }
+    }
+    testdir.makefile("json", left=json.dumps(left))
+    testdir.makefile("json", right=json.dumps(right))
+
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["plans", "left.json", "right.json"])
+    assert result.exit_code == 0, result.stdout
+    assert result.stdout == (
+        "# test_module::test_func\n"
+        "  SELECT * FROM book WHERE title = ?\n"
+        "- SEARCH book USING INDEX book_title (title=?)\n"
+        "+ SCAN book\n"
+        "  flags: none -> scan\n"
+    )
+
+
+def test_diff_by_database_of_a_plugin_report(testdir, monkeypatch):
+    """Ensure the call phase of the tests, compared by default,
+    is broken down by database alias."""
+    testdir.makepyfile(
+        multidb_settings="""
+        DATABASES = {
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"},
+            "replica": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"},
+        }
+    """
+    )
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+
+        @pytest.mark.count_queries
+        def test_multidb():
+            from django.db import connections
+
+            with connections["default"].cursor() as cursor:
+                cursor.execute("SELECT 1;")
+                cursor.fetchall()
+            with connections["replica"].cursor() as cursor:
+                cursor.execute("SELECT 1 UNION SELECT 2;")
+                cursor.fetchall()
+                cursor.execute("SELECT 1;")
+    """
+    )
+    monkeypatch.setenv("DJANGO_SETTINGS_MODULE", "multidb_settings")
+    monkeypatch.setenv("PYTHONPATH", str(testdir.tmpdir), prepend=os.pathsep)
+    results = testdir.runpytest_subprocess(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", "report.json"
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.main, ["diff", "--by-database", "report.json", "report.json"]
+    )
+    assert result.exit_code == 0, result.output
+    lines = result.stdout.splitlines()
+    assert lines[1].startswith(
+        "  test name            \tleft count \tright count\tduplicate count"
+        "\tsimilar count\tleft rows \tright rows\t"
+    )
+    # Followed by the database time of each side, which varies between runs
+    assert lines[3].startswith(
+        "  multidb[default]     \t          1\t          1\t              0"
+        "\t            0\t         1\t         1\t"
+    )
+    assert lines[4].startswith(
+        "  multidb[replica]     \t          2\t          2\t              0"
+        "\t            0\t         2\t         2\t"
+    )
@@ -1,7 +1,8 @@
 import pytest
 
-from pytest_django_queries.diff import DiffGenerator
+from pytest_django_queries.diff import DiffGenerator, merge_join_modules
 from pytest_django_queries.entry import flatten_entries
+from pytest_django_queries.results import ReportError
 
 
 @pytest.mark.parametrize("right", ({}, {"test_module": {}}, {"test_module_123": {}}))
@@ -54,3 +55,243 @@ def test_comparison_diff_is_correct(valid_comparison_entries):
         "  unchanged func     \t          1\t          1\t              0"
         in module_diffs
     )
+
+
+def test_comparison_shows_db_time_when_available():
+    left = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 2, "db-time": 1.5}}}
+    )
+    right = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 1, "db-time": 12.25}}}
+    )
+    module_diffs = list(next(iter(DiffGenerator(left, right)))[1])
+
+    assert module_diffs == [
+        "  test name\tleft count \tright count\tduplicate count\t"
+        "left db time \tright db time\n"
+        "  ---------\t-----------\t-----------\t---------------\t"
+        "-------------\t-------------",
+        "+ func     \t          2\t          1\t            UNK\t"
+        "          1.5\t        12.25",
+    ]
+
+
+def test_comparison_with_older_report_without_db_time():
+    left = flatten_entries({"test_module": {"test_func": {"query-count": 2}}})
+    right = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 2, "db-time": 1.5}}}
+    )
+    module_diffs = list(next(iter(DiffGenerator(left, right)))[1])
+    assert (
+        "  func     \t          2\t          2\t            UNK\t"
+        "          UNK\t          1.5" in module_diffs
+    )
+
+
+def test_comparison_shows_similar_count_when_available():
+    left = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 2, "similar": 0}}}
+    )
+    right = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 10, "similar": 8}}}
+    )
+    module_diffs = list(next(iter(DiffGenerator(left, right)))[1])
+    assert module_diffs[1] == (
+        "- func     \t          2\t         10\t            UNK\t            8"
+    )
+
+
+@pytest.mark.parametrize(
+    "left_data, right_data, expected_diff",
+    (
+        # Within the variance of the left version
+        ({"query-count-min": 3, "query-count-max": 5}, {}, " "),
+        # Within the variance of the right version
+        ({}, {"query-count-min": 4, "query-count-max": 6}, " "),
+        # Outside of the variance
+        ({"query-count-min": 3, "query-count-max": 4}, {}, "-"),
+        (
+            {"query-count-min": 3, "query-count-max": 4},
+            {"query-count-min": 5, "query-count-max": 6},
+            "-",
+        ),
+    ),
+)
+def test_comparison_ignores_changes_within_variance(
+    left_data, right_data, expected_diff
+):
+    left = flatten_entries(
+        {"test_module": {"test_func": dict({"query-count": 4}, **left_data)}}
+    )
+    right = flatten_entries(
+        {"test_module": {"test_func": dict({"query-count": 5}, **right_data)}}
+    )
+    comparison = next(DiffGenerator(left, right).iter_comparisons())
+    assert comparison.diff == expected_diff
+
+
+def test_comparison_ignores_transaction_control_statements():
+    left = flatten_entries(
+        {
+            "test_module": {
+                "test_func": {
+                    "query-count": 3,
+                    "data-query-count": 1,
+                    "transaction-count": 2,
+                }
+            }
+        }
+    )
+    right = flatten_entries(
+        {
+            "test_module": {
+                "test_func": {
+                    "query-count": 1,
+                    "data-query-count": 1,
+                    "transaction-count": 0,
+                }
+            }
+        }
+    )
+    comparison = next(DiffGenerator(left, right).iter_comparisons())
+    assert comparison.diff == " "
+    assert (comparison.left_count, comparison.right_count) == ("1", "1")
+
+
+def test_comparison_shows_cold_and_warm_counts_when_available():
+    left = flatten_entries(
+        {
+            "test_module": {
+                "test_func": {
+                    "query-count": 0,
+                    "query-count-cold": 3,
+                    "query-count-warm": 0,
+                }
+            }
+        }
+    )
+    right = flatten_entries(
+        {
+            "test_module": {
+                "test_func": {
+                    "query-count": 1,
+                    "query-count-cold": 3,
+                    "query-count-warm": 1,
+                }
+            }
+        }
+    )
+    module_diffs = list(next(iter(DiffGenerator(left, right)))[1])
+    assert module_diffs == [
+        "  test name\tleft count \tright count\tduplicate count"
+        "\tleft cold \tright cold\tleft warm \tright warm\n"
+        "  ---------\t-----------\t-----------\t---------------"
+        "\t----------\t----------\t----------\t----------",
+        "- func     \t          0\t          1\t            UNK"
+        "\t         3\t         3\t         0\t         1",
+    ]
+
+
+def test_comparison_shows_rows_fetched_when_available():
+    left = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 1, "rows-fetched": 200000}}}
+    )
+    right = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 1, "rows-fetched": 20}}}
+    )
+    module_diffs = list(next(iter(DiffGenerator(left, right)))[1])
+
+    assert module_diffs == [
+        "  test name\tleft count \tright count\tduplicate count\t"
+        "left rows \tright rows\n"
+        "  ---------\t-----------\t-----------\t---------------\t"
+        "----------\t----------",
+        "  func     \t          1\t          1\t            UNK\t"
+        "    200000\t        20",
+    ]
+
+
+def test_comparison_shows_resource_deltas_when_available():
+    resources = {"wall-time": 10.5, "cpu-time": 8, "memory-peak": 100.0}
+    left = flatten_entries(
+        {"test_module": {"test_func": dict(resources, **{"query-count": 2})}}
+    )
+    right = flatten_entries(
+        {
+            "test_module": {
+                "test_func": {
+                    "query-count": 2,
+                    "wall-time": 30.25,
+                    "cpu-time": 5,
+                    "memory-peak": 100.0,
+                },
+                "test_new": dict(resources, **{"query-count": 1}),
+            }
+        }
+    )
+    module_diffs = list(next(iter(DiffGenerator(left, right)))[1])
+
+    assert module_diffs == [
+        "  test name\tleft count \tright count\tduplicate count\t"
+        "wall time delta\tcpu time delta\tmemory peak delta\n"
+        "  ---------\t-----------\t-----------\t---------------\t"
+        "---------------\t--------------\t-----------------",
+        "  func     \t          2\t          2\t            UNK\t"
+        "         +19.75\t            -3\t             +0.0",
+        "+ new      \t          -\t          1\t            UNK\t"
+        "              -\t             -\t                -",
+    ]
+
+
+def test_comparison_shows_model_instances_when_available():
+    left = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 1, "model-instances": 3}}}
+    )
+    right = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 1, "model-instances": 50000}}}
+    )
+    module_diffs = list(next(iter(DiffGenerator(left, right)))[1])
+
+    assert module_diffs == [
+        "  test name\tleft count \tright count\tduplicate count\t"
+        "left instances \tright instances\n"
+        "  ---------\t-----------\t-----------\t---------------\t"
+        "---------------\t---------------",
+        "  func     \t          1\t          1\t            UNK\t"
+        "              3\t          50000",
+    ]
+
+
+def test_comparison_shows_cache_calls_when_available():
+    left = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 1, "cache-calls": 2}}}
+    )
+    right = flatten_entries(
+        {"test_module": {"test_func": {"query-count": 1, "cache-calls": 21}}}
+    )
+    module_diffs = list(next(iter(DiffGenerator(left, right)))[1])
+
+    assert module_diffs == [
+        "  test name\tleft count \tright count\tduplicate count\t"
+        "left cache calls \tright cache calls\n"
+        "  ---------\t-----------\t-----------\t---------------\t"
+        "-----------------\t-----------------",
+        "  func     \t          1\t          1\t            UNK\t"
+        "                2\t               21",
+    ]
+
+
+def test_modules_are_merge_joined():
+    left = [("test_a", {"test_foo": 1}), ("test_c", {"test_bar": 2})]
+    right = iter([("test_b", {"test_baz": 3}), ("test_c", {"test_bar": 4})])
+    assert list(merge_join_modules(left, right)) == [
+        ("test_a", {"test_foo": 1}, {}),
+        ("test_b", {}, {"test_baz": 3}),
+        ("test_c", {"test_bar": 2}, {"test_bar": 4}),
+    ]
+
+
+def test_merge_join_requires_sorted_modules():
+    left = [("test_b", {}), ("test_a", {})]
+    with pytest.raises(ReportError, match="left report are not sorted"):
+        list(merge_join_modules(left, []))
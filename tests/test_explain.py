@@ -0,0 +1,63 @@
+import pytest
+
+from pytest_django_queries import explain
+
+
+@pytest.mark.parametrize(
+    "plan, expected_flags",
+    [
+        (["SEARCH book USING INTEGER PRIMARY KEY (rowid=?)"], []),
+        (["SCAN CONSTANT ROW"], []),
+        (["SCAN book", "USE TEMP B-TREE FOR ORDER BY"], ["scan", "temp-b-tree"]),
+        (["Seq Scan on book  (cost=0.00..1.01 rows=1 width=4)"], ["scan"]),
+        (["Index Scan using book_pkey on book"], []),
+        (["table=book, type=ALL, rows=10, Extra=Using filesort"], ["scan", "filesort"]),
+    ],
+)
+def test_get_plan_flags(plan, expected_flags):
+    assert explain.get_plan_flags(plan) == expected_flags
+
+
+@pytest.mark.parametrize(
+    "columns, row, expected",
+    [
+        (["QUERY PLAN"], ("Seq Scan on book",), "Seq Scan on book"),
+        (["id", "parent", "notused", "detail"], (2, 0, 0, "SCAN book"), "SCAN book"),
+        (
+            ["id", "table", "type", "key"],
+            (1, "book", "ALL", None),
+            "id=1, table=book, type=ALL",
+        ),
+    ],
+)
+def test_condense_plan_row(columns, row, expected):
+    assert explain.condense_plan_row(columns, row) == expected
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("SELECT 1", True),
+        ("  with t as (select 1) select * from t", True),
+        ("INSERT INTO book VALUES (1)", False),
+        ("SELECTED", False),
+    ],
+)
+def test_is_select(sql, expected):
+    assert explain.is_select(sql) is expected
+
+
+def test_diff_plans():
+    left = {
+        "SELECT a": {"plan": ["SEARCH a"], "flags": []},
+        "SELECT b": {"plan": ["SCAN b"], "flags": ["scan"]},
+        "SELECT c": {"plan": ["SCAN c"], "flags": ["scan"]},
+    }
+    right = {
+        "SELECT a": {"plan": ["SCAN a"], "flags": ["scan"]},
+        "SELECT b": {"plan": ["SCAN b"], "flags": ["scan"]},
+        "SELECT d": {"plan": ["SCAN d"], "flags": ["scan"]},
+    }
+    assert list(explain.diff_plans(left, right)) == [
+        ("SELECT a", left["SELECT a"], right["SELECT a"])
+    ]
@@ -6,7 +6,20 @@ import shutil
 import mock
 import pytest
 
-from tests.conftest import DEFAULT_PYTEST_FLAGS
+from pytest_django_queries.results import FIXTURES_MODULE_NAME
+from tests.conftest import DEFAULT_PYTEST_FLAGS, call_phases, strip_timings
+
+# The results of the rows, only counted in the full capture mode
+ROW_KEYS = ("rows-fetched", "rows-affected", "worst-query")
+
+
+def strip_rows(test_results):
+    """Removes the rows from the results of a test and of its phases,
+    as reported by the counting-only capture mode."""
+    for results in [test_results, *test_results.get("phases", {}).values()]:
+        for key in ROW_KEYS:
+            results.pop(key, None)
+
 
 DUMMY_TEST_QUERY = """
     import pytest
@@ -43,8 +56,29 @@ def test_fixture_is_invoked_when_marked(testdir):
 
     # Ensure the results file was created
     assert results_path.check()
-    assert json.load(results_path) == {
-        "test_file": {"test_count_db_query_number": {"query-count": 2, "duplicates": 0}}
+    assert strip_timings(json.load(results_path)) == {
+        "test_file": {
+            "test_count_db_query_number": {
+                "query-count": 2,
+                "data-query-count": 2,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases(
+                    {
+                        "query-count": 2,
+                        "data-query-count": 2,
+                        "statements": {"SELECT": 2},
+                        "rows-fetched": 1,
+                        "rows-affected": 0,
+                    }
+                ),
+                "statements": {"SELECT": 2},
+                "similar": 0,
+                "rows-fetched": 1,
+                "rows-affected": 0,
+                "worst-query": [["SELECT ?;", 1]],
+            }
+        }
     }
 
 
@@ -95,9 +129,18 @@ def test_plugin_exports_results_even_when_test_fails(testdir):
 
     # Ensure the results file was created
     assert results_path.check()
-    assert json.load(results_path) == {
+    assert strip_timings(json.load(results_path)) == {
         "test_plugin_exports_results_even_when_test_fails": {
-            "test_failure": {"query-count": 0, "duplicates": 0}
+            "test_failure": {
+                "query-count": 0,
+                "data-query-count": 0,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases({"rows-fetched": 0, "rows-affected": 0}),
+                "similar": 0,
+                "rows-fetched": 0,
+                "rows-affected": 0,
+            }
         }
     }
 
@@ -131,9 +174,18 @@ def test_plugin_marker_without_autouse_handles_other_fixtures(testdir):
 
     # Ensure the results file was created
     assert results_path.check()
-    assert json.load(results_path) == {
+    assert strip_timings(json.load(results_path)) == {
         "test_plugin_marker_without_autouse_handles_other_fixtures": {
-            "test_with_side_effects": {"query-count": 0, "duplicates": 0}
+            "test_with_side_effects": {
+                "query-count": 0,
+                "data-query-count": 0,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases({"rows-fetched": 0, "rows-affected": 0}),
+                "similar": 0,
+                "rows-fetched": 0,
+                "rows-affected": 0,
+            }
         }
     }
 
@@ -208,16 +260,75 @@ def test_fixture_is_backing_up_old_results(testdir):
     assert old_results_path.check(), "The backup file should have been created"
 
     # Check contents
-    assert json.load(results_path) == {
+    assert strip_timings(json.load(results_path)) == {
         "test_file": {
-            "test_count_db_query_number": {"query-count": 2, "duplicates": 0}
+            "test_count_db_query_number": {
+                "query-count": 2,
+                "data-query-count": 2,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases(
+                    {
+                        "query-count": 2,
+                        "data-query-count": 2,
+                        "statements": {"SELECT": 2},
+                        "rows-fetched": 1,
+                        "rows-affected": 0,
+                    }
+                ),
+                "statements": {"SELECT": 2},
+                "similar": 0,
+                "rows-fetched": 1,
+                "rows-affected": 0,
+                "worst-query": [["SELECT ?;", 1]],
+            }
         },
         "test_otherfile": {
-            "test_count_db_query_number": {"query-count": 2, "duplicates": 0}
+            "test_count_db_query_number": {
+                "query-count": 2,
+                "data-query-count": 2,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases(
+                    {
+                        "query-count": 2,
+                        "data-query-count": 2,
+                        "statements": {"SELECT": 2},
+                        "rows-fetched": 1,
+                        "rows-affected": 0,
+                    }
+                ),
+                "statements": {"SELECT": 2},
+                "similar": 0,
+                "rows-fetched": 1,
+                "rows-affected": 0,
+                "worst-query": [["SELECT ?;", 1]],
+            }
         },
     }
-    assert json.load(old_results_path) == {
-        "test_file": {"test_count_db_query_number": {"query-count": 2, "duplicates": 0}}
+    assert strip_timings(json.load(old_results_path)) == {
+        "test_file": {
+            "test_count_db_query_number": {
+                "query-count": 2,
+                "data-query-count": 2,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases(
+                    {
+                        "query-count": 2,
+                        "data-query-count": 2,
+                        "statements": {"SELECT": 2},
+                        "rows-fetched": 1,
+                        "rows-affected": 0,
+                    }
+                ),
+                "statements": {"SELECT": 2},
+                "similar": 0,
+                "rows-fetched": 1,
+                "rows-affected": 0,
+                "worst-query": [["SELECT ?;", 1]],
+            }
+        }
     }
 
 
@@ -322,8 +433,33 @@ def test_duplicated_queries(testdir):
     assert results_path.check()
 
     # Check the resulst
-    assert json.load(results_path) == {
-        "test_module": {"test_foo": {"duplicates": 2, "query-count": 4}}
+    assert strip_timings(json.load(results_path)) == {
+        "test_module": {
+            "test_foo": {
+                "duplicates": 2,
+                "phases": call_phases(
+                    {
+                        "query-count": 4,
+                        "data-query-count": 4,
+                        "duplicates": 2,
+                        "similar": 2,
+                        "top-fingerprints": [["SELECT ?;", 3]],
+                        "statements": {"SELECT": 4},
+                        "rows-fetched": 1,
+                        "rows-affected": 0,
+                    }
+                ),
+                "statements": {"SELECT": 4},
+                "query-count": 4,
+                "data-query-count": 4,
+                "transaction-count": 0,
+                "similar": 2,
+                "top-fingerprints": [["SELECT ?;", 3]],
+                "rows-fetched": 1,
+                "rows-affected": 0,
+                "worst-query": [["SELECT ?;", 1]],
+            }
+        }
     }
 
 
@@ -367,3 +503,1825 @@ def test_xdist_combine_racecondition(testdir):
     results = json.load(results_path)
     assert list(results.keys()) == ["test_module"]
     assert len(results["test_module"]) == 500
+
+
+def test_xdist_results_are_sent_to_the_controller(testdir):
+    """Ensure the workers send their results to the controller
+    instead of writing them into the shared directory."""
+    results_path = testdir.tmpdir.join("results.json")
+
+    script = testdir.makepyfile(
+        test_module="""
+        import os
+
+        import pytest
+
+        @pytest.mark.parametrize("foo", range(20))
+        @pytest.mark.count_queries
+        def test_foo(request, foo):
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                for _ in range(foo):
+                    cursor.execute("SELECT 1;")
+
+            shared_dir = request.config.workerinput["_django_queries_shared_dir"]
+            assert os.listdir(shared_dir) == []"""
+    )
+
+    shutil.copytree(os.path.dirname(__file__), os.path.join(str(testdir) + "/tests"))
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path, "-n", "3", script
+    )
+    results.assert_outcomes(20, 0, 0)
+
+    results = json.load(results_path)
+    assert {
+        test_name: test_data["query-count"]
+        for test_name, test_data in results["test_module"].items()
+    } == {"test_foo[%d]" % foo: foo for foo in range(20)}
+
+
+def test_xdist_queries_of_fixtures_are_summed(testdir):
+    """Ensure the queries of a fixture set up by several workers are summed."""
+    results_path = testdir.tmpdir.join("results.json")
+
+    script = testdir.makepyfile(
+        test_module="""
+        import pytest
+
+        @pytest.fixture
+        def data():
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+
+        @pytest.mark.parametrize("foo", range(20))
+        def test_foo(data, foo):
+            pass"""
+    )
+
+    shutil.copytree(os.path.dirname(__file__), os.path.join(str(testdir) + "/tests"))
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-fixtures",
+        "-n",
+        "3",
+        script,
+    )
+    results.assert_outcomes(20, 0, 0)
+
+    fixture_results = json.load(results_path)[FIXTURES_MODULE_NAME]["data[function]"]
+    assert fixture_results["setup-count"] == 20
+    assert fixture_results["query-count"] == 20
+
+
+MIXED_WORKLOAD_TEST_QUERY = """
+    import pytest
+
+    @pytest.mark.count_queries%s
+    def test_mixed_workload():
+        from django.db import connection, transaction
+
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE IF NOT EXISTS t (id INTEGER, name TEXT);")
+            cursor.executemany("INSERT INTO t VALUES (%%s, %%s);", [(1, "a"), (2, "b")])
+            cursor.executemany("INSERT INTO t VALUES (%%s, %%s);", [(3, "c"), (4, "d")])
+            cursor.execute("SELECT name FROM t WHERE id = %%s;", [1])
+            cursor.execute("SELECT name FROM t WHERE id = %%s;", [1])
+            cursor.execute("SELECT name FROM t WHERE id = %%s;", [2])
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+
+        with pytest.raises(ZeroDivisionError):
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1;")
+                1 / 0
+"""
+
+
+@pytest.mark.parametrize(
+    "marker_args, cli_args",
+    (
+        ("", ["--django-queries-capture", "count"]),
+        ("(capture='count')", []),
+        ("(capture='count')", ["--django-queries-capture", "full"]),
+    ),
+)
+def test_counting_capture_mode_matches_full_mode(testdir, marker_args, cli_args):
+    """Ensure the counting-only capture mode reports exactly the same results
+    as the default mode but the rows, whether enabled from the marker
+    or the command line."""
+    full_results_path = testdir.tmpdir.join("full.json")
+    count_results_path = testdir.tmpdir.join("count.json")
+
+    testdir.makepyfile(test_file=MIXED_WORKLOAD_TEST_QUERY % "")
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", full_results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    testdir.makepyfile(test_file=MIXED_WORKLOAD_TEST_QUERY % marker_args)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", count_results_path, *cli_args
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    assert strip_timings(json.load(full_results_path)) == {
+        "test_file": {
+            "test_mixed_workload": {
+                "query-count": 12,
+                "data-query-count": 8,
+                "transaction-count": 4,
+                "duplicates": 3,
+                "phases": call_phases(
+                    {
+                        "query-count": 12,
+                        "data-query-count": 8,
+                        "transaction-count": 4,
+                        "duplicates": 3,
+                        "similar": 4,
+                        "top-fingerprints": [
+                            ["SELECT name FROM t WHERE id = ?;", 3],
+                            ["INSERT INTO t VALUES (...);", 2],
+                            ["SELECT ?;", 2],
+                        ],
+                        "statements": {"INSERT": 2, "OTHER": 1, "SELECT": 5},
+                        "tables": {"t": {"INSERT": 2, "SELECT": 3}},
+                        "rows-fetched": 0,
+                        "rows-affected": 4,
+                    }
+                ),
+                "statements": {"INSERT": 2, "OTHER": 1, "SELECT": 5},
+                "tables": {"t": {"INSERT": 2, "SELECT": 3}},
+                "similar": 4,
+                "top-fingerprints": [
+                    ["SELECT name FROM t WHERE id = ?;", 3],
+                    ["INSERT INTO t VALUES (...);", 2],
+                    ["SELECT ?;", 2],
+                ],
+                "rows-fetched": 0,
+                "rows-affected": 4,
+                "worst-query": [["INSERT INTO t VALUES (...);", 2]],
+            }
+        }
+    }
+    # The rows are only counted in the full mode
+    full_results = strip_timings(json.load(full_results_path))
+    strip_rows(full_results["test_file"]["test_mixed_workload"])
+    assert strip_timings(json.load(count_results_path)) == full_results
+
+
+def test_counting_capture_mode_does_not_force_debug_cursor(testdir):
+    """Ensure the counting-only capture mode is not storing the queries."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile("""
+        import pytest
+
+        @pytest.mark.count_queries(capture="count")
+        def test_counter(count_queries):
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+
+            assert connection.queries_logged is False
+            assert len(count_queries) == 1
+            assert not hasattr(count_queries, "captured_queries")
+    """)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+
+def test_invalid_capture_mode_errors(testdir):
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile("""
+        import pytest
+
+        @pytest.mark.count_queries(capture="everything")
+        def test_invalid_mode():
+            pass
+    """)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(errors=1)
+    results.stdout.fnmatch_lines(["*Invalid capture mode: 'everything'*"])
+
+
+def test_queries_are_captured_on_every_database(testdir, monkeypatch):
+    """Ensure the queries are counted on every database alias,
+    and broken down by alias into the results."""
+    results_path = testdir.tmpdir.join("results.json")
+
+    testdir.makepyfile(
+        multidb_settings="""
+        DATABASES = {
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"},
+            "replica": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"},
+            "unused": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"},
+        }
+    """
+    )
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+
+        @pytest.mark.parametrize("capture", ["full", "count"])
+        @pytest.mark.count_queries
+        def test_multidb(capture, count_queries):
+            from django.db import connections
+
+            with connections["default"].cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            with connections["replica"].cursor() as cursor:
+                cursor.execute("SELECT 1;")
+                cursor.execute("SELECT 1;")
+                cursor.execute("SELECT 2;")
+
+            assert len(count_queries) == 4
+            assert connections["unused"].connection is None
+    """
+    )
+    monkeypatch.setenv("DJANGO_SETTINGS_MODULE", "multidb_settings")
+    monkeypatch.setenv("PYTHONPATH", str(testdir.tmpdir), prepend=os.pathsep)
+
+    results = testdir.runpytest_subprocess(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+
+    # Ensure the tests have passed
+    results.assert_outcomes(2, 0, 0)
+
+    databases = {
+        "default": {
+            "query-count": 1,
+            "data-query-count": 1,
+            "transaction-count": 0,
+            "duplicates": 0,
+            "statements": {"SELECT": 1},
+            "similar": 0,
+            "rows-fetched": 0,
+            "rows-affected": 0,
+        },
+        "replica": {
+            "query-count": 3,
+            "data-query-count": 3,
+            "transaction-count": 0,
+            "duplicates": 1,
+            "statements": {"SELECT": 3},
+            "similar": 2,
+            "top-fingerprints": [["SELECT ?;", 3]],
+            "rows-fetched": 0,
+            "rows-affected": 0,
+        },
+        "unused": {
+            "query-count": 0,
+            "data-query-count": 0,
+            "transaction-count": 0,
+            "duplicates": 0,
+            "similar": 0,
+            "rows-fetched": 0,
+            "rows-affected": 0,
+        },
+    }
+    expected_results = {
+        "query-count": 4,
+        "data-query-count": 4,
+        "transaction-count": 0,
+        "duplicates": 1,
+        "phases": call_phases(
+            {
+                "query-count": 4,
+                "data-query-count": 4,
+                "duplicates": 1,
+                "similar": 3,
+                "top-fingerprints": [["SELECT ?;", 4]],
+                "statements": {"SELECT": 4},
+                "rows-fetched": 0,
+                "rows-affected": 0,
+                "databases": databases,
+            }
+        ),
+        "statements": {"SELECT": 4},
+        "similar": 3,
+        "top-fingerprints": [["SELECT ?;", 4]],
+        "rows-fetched": 0,
+        "rows-affected": 0,
+        "databases": databases,
+    }
+    # The phases are broken down by database alias as the whole test
+    phases = expected_results["phases"]
+    for phase in ("setup", "teardown"):
+        phases[phase] = dict(
+            phases[phase], databases=dict.fromkeys(databases, phases[phase])
+        )
+    assert strip_timings(json.load(results_path)) == {
+        "test_file": {
+            "test_multidb[full]": expected_results,
+            "test_multidb[count]": expected_results,
+        }
+    }
+
+
+@pytest.mark.parametrize("capture_mode", ("full", "count"))
+def test_query_timings_are_recorded(testdir, capture_mode):
+    """Ensure the total, max and percentiles of the query durations are reported."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file="""
+        import time
+
+        import pytest
+
+        @pytest.mark.count_queries
+        def test_slow_query():
+            from django.db import connection
+
+            connection.ensure_connection()
+            connection.connection.create_function("sleep", 1, time.sleep)
+            with connection.cursor() as cursor:
+                for _ in range(19):
+                    cursor.execute("SELECT 1;")
+                cursor.execute("SELECT sleep(0.05);")
+    """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-capture",
+        capture_mode,
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    results = json.load(results_path)["test_file"]["test_slow_query"]
+    assert results["query-count"] == 20
+    assert results["db-time"] >= 50
+    assert results["db-time-max"] >= 50
+    assert results["db-time-p50"] < 50
+    assert results["db-time-p95"] < 50
+
+
+def test_similar_queries_detect_n_plus_one_pattern(testdir):
+    """Ensure queries only differing by their parameters are reported as similar
+    even though they are not duplicates."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+
+        @pytest.mark.count_queries
+        def test_n_plus_one():
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                for book_id in range(10):
+                    cursor.execute("SELECT %s WHERE 1 IN (%s, %s);", [book_id, 1, 2])
+        """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    assert strip_timings(json.load(results_path)) == {
+        "test_file": {
+            "test_n_plus_one": {
+                "query-count": 10,
+                "data-query-count": 10,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases(
+                    {
+                        "query-count": 10,
+                        "data-query-count": 10,
+                        "similar": 9,
+                        "top-fingerprints": [["SELECT ? WHERE ? IN (...);", 10]],
+                        "statements": {"SELECT": 10},
+                        "rows-fetched": 0,
+                        "rows-affected": 0,
+                    }
+                ),
+                "statements": {"SELECT": 10},
+                "similar": 9,
+                "top-fingerprints": [["SELECT ? WHERE ? IN (...);", 10]],
+                "rows-fetched": 0,
+                "rows-affected": 0,
+            }
+        }
+    }
+
+
+CALL_SITES_TEST_QUERY = """
+    import pytest
+
+    def run_queries(count):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            for _ in range(count):
+                cursor.execute("SELECT 1;")
+
+    @pytest.mark.count_queries%s
+    def test_call_sites():
+        run_queries(6)
+        run_queries(2)
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 2;")
+"""
+
+
+@pytest.mark.parametrize(
+    "marker_args, cli_args, expected_call_sites",
+    (
+        ("", [], None),
+        (
+            "",
+            ["--django-queries-call-sites"],
+            [["test_file.py:8", 8], ["test_file.py:16", 1]],
+        ),
+        (
+            "(call_sites=True, call_sites_sample_rate=3)",
+            [],
+            [["test_file.py:8", 2], ["test_file.py:16", 1]],
+        ),
+        (
+            "",
+            ["--django-queries-call-sites", "--django-queries-call-sites-depth", "1"],
+            [["<unknown>", 9]],
+        ),
+    ),
+)
+def test_call_sites_are_recorded(testdir, marker_args, cli_args, expected_call_sites):
+    """Ensure the source lines executing the queries are recorded when enabled."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(test_file=CALL_SITES_TEST_QUERY % marker_args)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path, *cli_args
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    results = json.load(results_path)["test_file"]["test_call_sites"]
+    assert results.get("call-sites") == expected_call_sites
+
+
+BUDGET_TEST_QUERY = """
+    import pytest
+
+    @pytest.mark.count_queries%s
+    def test_budget():
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            for _ in range(3):
+                cursor.execute("SELECT 1;")
+"""
+
+
+@pytest.mark.parametrize(
+    "marker_args, ini, expected_errors",
+    (
+        ("", "", []),
+        ("(max_queries=3, max_duplicates=2, max_db_time_ms=10000)", "", []),
+        (
+            "(max_queries=2)",
+            "",
+            ["  - 3 queries were executed, the budget is 2 (max_queries)"],
+        ),
+        (
+            "(max_duplicates=0)",
+            "",
+            [
+                "  - 2 duplicated queries were executed, the budget is 0 (max_duplicates)"
+            ],
+        ),
+        (
+            "",
+            "django_queries_max_queries = 1\ndjango_queries_max_duplicates = 1",
+            [
+                "  - 3 queries were executed, the budget is 1 (max_queries)",
+                "  - 2 duplicated queries were executed, the budget is 1 "
+                "(max_duplicates)",
+            ],
+        ),
+        ("(max_queries=None)", "django_queries_max_queries = 1", []),
+        (
+            "",
+            "django_queries_max_queries = 10\n"
+            "django_queries_module_budgets =\n"
+            "    other_*: max_queries=0\n"
+            "    test_*: max_queries=2",
+            ["  - 3 queries were executed, the budget is 2 (max_queries)"],
+        ),
+        (
+            "(max_queries=5)",
+            "django_queries_module_budgets = test_file: max_queries=2",
+            [],
+        ),
+    ),
+)
+def test_query_budgets(testdir, marker_args, ini, expected_errors):
+    """Ensure tests exceeding their query budgets are failing."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makeini("[pytest]\n" + ini)
+    testdir.makepyfile(test_file=BUDGET_TEST_QUERY % marker_args)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+
+    if not expected_errors:
+        results.assert_outcomes(1, 0, 0)
+    else:
+        results.assert_outcomes(0, 0, 1)
+        results.stdout.fnmatch_lines(
+            [
+                "*Query budget exceeded:",
+                *expected_errors,
+                "Repeated queries:",
+                "       3  SELECT ?;",
+            ]
+        )
+
+    # The results are still exported
+    assert json.load(results_path)["test_file"]["test_budget"]["query-count"] == 3
+
+
+@pytest.mark.parametrize("phase", ("call", "all"))
+def test_query_budgets_do_not_compute_the_results(testdir, phase):
+    """Ensure the budgets of the passing tests are checked without computing
+    the whole results, which are only computed once for the report."""
+    testdir.makeconftest(
+        """
+        from pytest_django_queries.capture import QueryCapture
+
+        get_results = QueryCapture.get_results
+        calls = []
+
+        def counted_get_results(self):
+            calls.append(self)
+            return get_results(self)
+
+        QueryCapture.get_results = counted_get_results
+
+        def pytest_sessionfinish(session):
+            assert len(calls) == 1, calls
+        """
+    )
+    testdir.makepyfile(test_file=BUDGET_TEST_QUERY % "(max_queries=3)")
+    results = testdir.runpytest(*DEFAULT_PYTEST_FLAGS, "--django-queries-phase", phase)
+    results.assert_outcomes(1, 0, 0)
+    assert results.ret == 0
+
+
+def test_transaction_control_statements_are_not_duplicates(testdir):
+    """Ensure the transaction control statements of multiple atomic blocks are
+    neither duplicated nor similar queries, nor exceed the duplicate budget."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+
+        @pytest.mark.count_queries(max_duplicates=0)
+        def test_atomic():
+            from django.db import connection, transaction
+
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE TABLE IF NOT EXISTS a (id INTEGER)")
+            for value in range(3):
+                with transaction.atomic():
+                    # Nested blocks use savepoints
+                    with transaction.atomic():
+                        with connection.cursor() as cursor:
+                            cursor.execute("INSERT INTO a VALUES (%s)", [value])
+        """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    results = json.load(results_path)["test_file"]["test_atomic"]
+    assert results["data-query-count"] == 4
+    assert results["transaction-count"] >= 6
+    assert results["duplicates"] == 0
+    assert results["similar"] == 2
+    assert results["top-fingerprints"] == [["INSERT INTO a VALUES (...)", 3]]
+
+
+def test_transaction_control_statements_are_counted_separately(testdir):
+    """Ensure the savepoints of nested atomic blocks are not counted
+    as data queries, neither in the report nor against the budgets."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+
+        @pytest.mark.count_queries(max_queries=2)
+        def test_atomic():
+            from django.db import connection, transaction
+
+            with transaction.atomic():
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1;")
+                        cursor.execute("SELECT 2;")
+        """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    test_results = json.load(results_path)["test_file"]["test_atomic"]
+    assert test_results["data-query-count"] == 2
+    assert test_results["transaction-count"] >= 2
+    assert test_results["query-count"] == 2 + test_results["transaction-count"]
+
+
+PHASES_TEST_QUERY = """
+    import pytest
+    from django.db import connection
+
+    def run_queries(count):
+        with connection.cursor() as cursor:
+            for index in range(count):
+                cursor.execute("SELECT %%d;" %% index)
+
+    @pytest.fixture
+    def data():
+        run_queries(2)
+        yield
+        run_queries(3)
+
+    @pytest.mark.count_queries%s
+    def test_phases(data):
+        run_queries(1)
+"""
+
+
+@pytest.mark.parametrize(
+    "marker_args, cli_args, passed",
+    (
+        ("", [], True),
+        ("(max_queries=1)", [], True),
+        ("(max_queries=1)", ["--django-queries-phase", "all"], False),
+    ),
+)
+def test_queries_are_counted_per_phase(testdir, marker_args, cli_args, passed):
+    """Ensure the queries of the fixtures are counted separately from the ones
+    of the test body, the budgets only applying to the body by default."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(test_file=PHASES_TEST_QUERY % marker_args)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path, *cli_args
+    )
+    results.assert_outcomes(int(passed), 0, int(not passed))
+
+    test_results = strip_timings(json.load(results_path))["test_file"]["test_phases"]
+    assert test_results["query-count"] == 6
+    assert {
+        phase: phase_results["query-count"]
+        for phase, phase_results in test_results["phases"].items()
+    } == {"setup": 2, "call": 1, "teardown": 3}
+
+
+@pytest.mark.parametrize("capture_mode", ("full", "count"))
+def test_named_sections_are_counted_separately(testdir, capture_mode):
+    """Ensure the queries of the named sections of a test are reported
+    under the test, the sections entered multiple times being added up."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+        from django.db import connection
+
+        def run_queries(count):
+            with connection.cursor() as cursor:
+                for _ in range(count):
+                    cursor.execute("SELECT 1;")
+
+        @pytest.mark.count_queries(capture=%r)
+        def test_sections(count_queries):
+            run_queries(1)
+            with count_queries.section("load"):
+                run_queries(2)
+                with count_queries.section("render"):
+                    run_queries(3)
+            with count_queries.section("render"):
+                run_queries(1)
+
+            with pytest.raises(ValueError):
+                with count_queries.section(""):
+                    pass
+        """
+        % capture_mode
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    test_results = strip_timings(json.load(results_path))["test_file"]["test_sections"]
+    assert test_results["query-count"] == 7
+    assert test_results["sections"] == {
+        "load": {
+            "query-count": 5,
+            "data-query-count": 5,
+            "transaction-count": 0,
+            "duplicates": 5,
+            "similar": 4,
+            "top-fingerprints": [["SELECT ?;", 5]],
+        },
+        "render": {
+            "query-count": 4,
+            "data-query-count": 4,
+            "transaction-count": 0,
+            "duplicates": 4,
+            "similar": 3,
+            "top-fingerprints": [["SELECT ?;", 4]],
+        },
+    }
+
+
+def test_queries_are_broken_down_by_request(testdir, monkeypatch):
+    """Ensure the queries of the requests made using the test client are
+    reported by method and URL name."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        requests_settings="""
+        DATABASES = {
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+        }
+        INSTALLED_APPS = ["django.contrib.contenttypes"]
+        SECRET_KEY = "secret"
+        ROOT_URLCONF = "test_file"
+        ALLOWED_HOSTS = ["testserver"]
+        TEMPLATES = [{"BACKEND": "django.template.backends.django.DjangoTemplates"}]
+    """
+    )
+    testdir.makepyfile(
+        test_file="""
+        import django
+        import pytest
+        from django.db import connection
+        from django.http import HttpResponse
+        from django.test import Client
+        from django.urls import path
+
+        def run_queries(count):
+            with connection.cursor() as cursor:
+                for index in range(count):
+                    cursor.execute("SELECT %d;" % index)
+
+        def book_list(request):
+            run_queries(3)
+            return HttpResponse()
+
+        def book_detail(request, pk):
+            run_queries(pk)
+            return HttpResponse()
+
+        urlpatterns = [
+            path("books/", book_list, name="book-list"),
+            path("books/<int:pk>/", book_detail, name="book-detail"),
+        ]
+
+        @pytest.mark.count_queries
+        def test_requests():
+            # Rendering the 404 page requires the apps to be loaded
+            django.setup()
+            client = Client()
+            client.get("/books/")
+            client.get("/books/1/")
+            client.get("/books/2/")
+            client.post("/books/")
+            client.get("/missing/")
+            run_queries(1)
+        """
+    )
+    monkeypatch.setenv("DJANGO_SETTINGS_MODULE", "requests_settings")
+    monkeypatch.setenv("PYTHONPATH", str(testdir.tmpdir), prepend=os.pathsep)
+    results = testdir.runpytest_subprocess(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    test_results = strip_timings(json.load(results_path))["test_file"]["test_requests"]
+    assert test_results["query-count"] == 10
+    assert {
+        endpoint: (
+            data["request-count"],
+            data["query-count"],
+            data["request-query-count-max"],
+        )
+        for endpoint, data in test_results["requests"].items()
+    } == {
+        "GET book-detail": (2, 3, 2),
+        "GET book-list": (1, 3, 3),
+        "POST book-list": (1, 3, 3),
+        "GET /missing/": (1, 0, 0),
+    }
+
+
+RESOURCES_TEST_QUERY = """
+    import pytest
+
+    @pytest.mark.count_queries
+    def test_default():
+        pass
+
+    @pytest.mark.count_queries(resources=True)
+    def test_marker():
+        data = bytearray(1024 * 1024)
+"""
+
+
+@pytest.mark.parametrize(
+    "args, expected_tests",
+    (
+        ([], ["test_marker"]),
+        (["--django-queries-resources"], ["test_default", "test_marker"]),
+    ),
+)
+def test_resources_are_measured_when_enabled(testdir, args, expected_tests):
+    """Ensure the wall time, CPU time and memory peak are only measured
+    when enabled, for the whole test and for each phase."""
+    results_path = testdir.tmpdir.join("results.json")
+    script = testdir.makepyfile(test_file=RESOURCES_TEST_QUERY)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path, *args, script
+    )
+    results.assert_outcomes(2, 0, 0)
+
+    resource_keys = {"wall-time", "cpu-time", "memory-peak"}
+    test_results = json.load(results_path)["test_file"]
+    assert (
+        sorted(
+            test_name
+            for test_name, test_data in test_results.items()
+            if resource_keys <= set(test_data)
+        )
+        == expected_tests
+    )
+    for test_name in expected_tests:
+        phases = test_results[test_name]["phases"]
+        assert all(resource_keys <= set(phase) for phase in phases.values())
+    assert test_results["test_marker"]["phases"]["call"]["memory-peak"] >= 1024
+
+
+def test_model_instances_are_counted_by_model(testdir, monkeypatch):
+    """Ensure the model instances created by a test are counted by model
+    when enabled, even without running any query."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        models_settings="""
+        DATABASES = {
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+        }
+        INSTALLED_APPS = ["django.contrib.auth", "django.contrib.contenttypes"]
+        SECRET_KEY = "secret"
+    """
+    )
+    testdir.makepyfile(
+        test_file="""
+        import django
+        import pytest
+
+        django.setup()
+
+        from django.contrib.auth.models import Group
+        from django.contrib.contenttypes.models import ContentType
+
+        @pytest.mark.count_queries(models=True)
+        def test_models():
+            for index in range(3):
+                ContentType(app_label="library", model="book%d" % index)
+            Group(name="readers")
+
+        @pytest.mark.count_queries
+        def test_disabled():
+            Group(name="readers")
+        """
+    )
+    monkeypatch.setenv("DJANGO_SETTINGS_MODULE", "models_settings")
+    monkeypatch.setenv("PYTHONPATH", str(testdir.tmpdir), prepend=os.pathsep)
+    results = testdir.runpytest_subprocess(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(2, 0, 0)
+
+    test_results = json.load(results_path)["test_file"]
+    assert test_results["test_models"]["model-instances"] == 4
+    assert test_results["test_models"]["top-models"] == [
+        ["contenttypes.ContentType", 3],
+        ["auth.Group", 1],
+    ]
+    assert test_results["test_models"]["phases"]["call"]["model-instances"] == 4
+    assert "model-instances" not in test_results["test_disabled"]
+
+
+CACHE_TEST_QUERY = """
+    import pytest
+    from django.core.cache import cache
+
+    @pytest.fixture
+    def warm_cache():
+        cache.set("book:1", "Dune")
+
+    @pytest.mark.count_queries
+    def test_get_per_item(warm_cache):
+        for index in range(3):
+            cache.get("book:%d" % (index % 2))
+
+    def test_not_marked():
+        cache.get("book:1")
+"""
+
+
+def test_cache_operations_are_counted_when_enabled(testdir):
+    """Ensure the operations on the cache backends are counted per test
+    and per phase when enabled."""
+    results_path = testdir.tmpdir.join("results.json")
+    script = testdir.makepyfile(test_file=CACHE_TEST_QUERY)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-cache",
+        script,
+    )
+    results.assert_outcomes(2, 0, 0)
+
+    test_results = json.load(results_path)["test_file"]
+    assert list(test_results) == ["test_get_per_item"]
+    test_data = test_results["test_get_per_item"]
+    assert {key: test_data[key] for key in test_data if "cache" in key} == {
+        "cache-calls": 4,
+        "cache-hits": 1,
+        "cache-misses": 2,
+        "cache-repeated-keys": 1,
+        "cache-operations": {"get": 3, "set": 1},
+        "top-cache-keys": [["book:0", 2]],
+    }
+    assert test_data["phases"]["setup"]["cache-operations"] == {"set": 1}
+    assert test_data["phases"]["call"]["cache-operations"] == {"get": 3}
+
+
+FIXTURES_TEST_QUERY = """
+    import pytest
+    from django.db import connection
+
+    def run_queries(count):
+        with connection.cursor() as cursor:
+            for _ in range(count):
+                cursor.execute("SELECT 1;")
+
+    @pytest.fixture(scope="session")
+    def session_data():
+        run_queries(3)
+
+    @pytest.fixture(scope="module")
+    def module_data(session_data):
+        run_queries(2)
+        yield
+        run_queries(1)
+
+    @pytest.fixture
+    def function_data(module_data):
+        run_queries(1)
+
+    @pytest.fixture
+    def unused_db():
+        pass
+
+    @pytest.mark.count_queries
+    def test_foo(function_data, unused_db):
+        run_queries(1)
+
+    def test_bar(function_data):
+        pass
+"""
+
+
+def test_queries_of_fixtures_are_counted_by_name_and_scope(testdir):
+    """Ensure the queries of the setup and teardown of the fixtures of every
+    scope are reported into the fixtures module, when enabled."""
+    results_path = testdir.tmpdir.join("results.json")
+    script = testdir.makepyfile(test_file=FIXTURES_TEST_QUERY)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-fixtures",
+        script,
+    )
+    results.assert_outcomes(2, 0, 0)
+
+    test_results = json.load(results_path)
+    # The modules are written sorted
+    assert list(test_results) == [FIXTURES_MODULE_NAME, "test_file"]
+    assert test_results["test_file"]["test_foo"]["query-count"] == 2
+    assert {
+        name: (
+            data["scope"],
+            data["setup-count"],
+            data["phases"]["setup"]["query-count"],
+            data["phases"]["teardown"]["query-count"],
+            data["query-count"],
+        )
+        for name, data in test_results[FIXTURES_MODULE_NAME].items()
+    } == {
+        "session_data[session]": ("session", 1, 3, 0, 3),
+        "module_data[module]": ("module", 1, 2, 1, 3),
+        "function_data[function]": ("function", 2, 2, 0, 2),
+    }
+
+
+def test_queries_of_fixtures_are_not_counted_by_default(testdir):
+    results_path = testdir.tmpdir.join("results.json")
+    script = testdir.makepyfile(test_file=FIXTURES_TEST_QUERY)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path, script
+    )
+    results.assert_outcomes(2, 0, 0)
+    assert list(json.load(results_path)) == ["test_file"]
+
+
+def test_invalid_query_budget_configuration(testdir):
+    testdir.makeini("[pytest]\ndjango_queries_max_queries = many")
+    results = testdir.runpytest(*DEFAULT_PYTEST_FLAGS)
+    assert results.ret == pytest.ExitCode.USAGE_ERROR
+    results.stderr.fnmatch_lines(
+        ["*Invalid value for the query budget max_queries: 'many'"]
+    )
+
+
+BASELINE_TEST_QUERY = """
+    import pytest
+
+    @pytest.mark.parametrize("count", [2, 10])
+    @pytest.mark.count_queries
+    def test_queries(count):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            for _ in range(count):
+                cursor.execute("SELECT 1;")
+"""
+
+
+@pytest.mark.parametrize(
+    "tolerance_args, expected_regressions",
+    (
+        (
+            [],
+            [
+                "test_file::test_queries[10]: 8 -> 10 queries (+2, +25.0%)",
+                "test_file::test_queries[2]: 1 -> 2 queries (+1, +100.0%)",
+            ],
+        ),
+        (
+            ["--django-queries-tolerance", "1"],
+            ["test_file::test_queries[10]: 8 -> 10 queries (+2, +25.0%)"],
+        ),
+        (
+            ["--django-queries-tolerance-percent", "50"],
+            ["test_file::test_queries[2]: 1 -> 2 queries (+1, +100.0%)"],
+        ),
+        (
+            [
+                "--django-queries-tolerance",
+                "1",
+                "--django-queries-tolerance-percent",
+                "50",
+            ],
+            [],
+        ),
+    ),
+)
+def test_baseline_regressions_fail_the_session(
+    testdir, tolerance_args, expected_regressions
+):
+    """Ensure the session fails if a test regressed beyond the tolerances
+    compared to the baseline."""
+    results_path = testdir.tmpdir.join("results.json")
+    baseline_path = testdir.tmpdir.join("baseline.json")
+    baseline_path.write(
+        json.dumps(
+            {
+                "test_file": {
+                    "test_queries[2]": {"query-count": 1},
+                    "test_queries[10]": {"query-count": 8},
+                }
+            }
+        )
+    )
+    testdir.makepyfile(test_file=BASELINE_TEST_QUERY)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-baseline",
+        baseline_path,
+        *tolerance_args,
+    )
+    results.assert_outcomes(2, 0, 0)
+
+    if expected_regressions:
+        assert results.ret == pytest.ExitCode.TESTS_FAILED
+        results.stdout.fnmatch_lines(
+            [
+                # Starts on its own line, after the progress of the tests
+                "=* %d test(s) regressed compared to the baseline %s =*"
+                % (len(expected_regressions), baseline_path),
+                *expected_regressions,
+            ]
+        )
+    else:
+        assert results.ret == pytest.ExitCode.OK
+        assert "regressed" not in results.stdout.str()
+
+
+def test_baseline_is_ratcheted_down(testdir):
+    """Ensure updating the baseline only stores the improvements and new tests."""
+    results_path = testdir.tmpdir.join("results.json")
+    baseline_path = testdir.tmpdir.join("baseline.json")
+    baseline_path.write(
+        json.dumps(
+            {
+                "test_file": {
+                    "test_queries[2]": {"query-count": 1},
+                    "test_queries[10]": {"query-count": 20},
+                },
+                "test_removed": {"test_foo": {"query-count": 3}},
+            }
+        )
+    )
+    testdir.makepyfile(test_file=BASELINE_TEST_QUERY)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-baseline",
+        baseline_path,
+        "--django-queries-update-baseline",
+    )
+    results.assert_outcomes(2, 0, 0)
+
+    # The regression is still reported
+    assert results.ret == pytest.ExitCode.TESTS_FAILED
+
+    baseline = json.load(baseline_path)
+    assert baseline["test_file"]["test_queries[2]"] == {"query-count": 1}
+    assert baseline["test_file"]["test_queries[10]"]["query-count"] == 10
+    assert baseline["test_removed"] == {"test_foo": {"query-count": 3}}
+
+
+def test_baseline_is_created_when_updating(testdir):
+    results_path = testdir.tmpdir.join("results.json")
+    baseline_path = testdir.tmpdir.join("baseline.json")
+    testdir.makepyfile(test_file=BASELINE_TEST_QUERY)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-baseline",
+        baseline_path,
+        "--django-queries-update-baseline",
+    )
+    results.assert_outcomes(2, 0, 0)
+    assert results.ret == pytest.ExitCode.OK
+    assert json.load(baseline_path) == json.load(results_path)
+
+
+def test_missing_baseline_is_an_error(testdir):
+    baseline_path = testdir.tmpdir.join("baseline.json")
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-queries-baseline", baseline_path
+    )
+    assert results.ret == pytest.ExitCode.USAGE_ERROR
+    results.stderr.fnmatch_lines(
+        ["*The baseline file does not exist: %s" % baseline_path]
+    )
+
+
+def test_updating_the_baseline_requires_a_baseline(testdir):
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-queries-update-baseline"
+    )
+    assert results.ret == pytest.ExitCode.USAGE_ERROR
+    results.stderr.fnmatch_lines(
+        ["*--django-queries-update-baseline requires --django-queries-baseline"]
+    )
+
+
+def test_results_are_appended_to_the_store(testdir):
+    from pytest_django_queries.store import ResultStore
+
+    store_path = testdir.tmpdir.join("store.sqlite3")
+    testdir.makepyfile(test_file=BASELINE_TEST_QUERY)
+    for label in ("v1", "v2", "v3"):
+        results = testdir.runpytest(
+            *DEFAULT_PYTEST_FLAGS,
+            "--django-queries-store",
+            store_path,
+            "--django-queries-run-label",
+            label,
+            "--django-queries-store-keep",
+            "2",
+        )
+        results.assert_outcomes(2, 0, 0)
+
+    with ResultStore(str(store_path)) as store:
+        assert [run["label"] for run in store.get_runs()] == ["v3", "v2"]
+        results = store.get_results(store.resolve_run("v2"))
+    assert {
+        test_name: test_data["query-count"]
+        for test_name, test_data in results["test_file"].items()
+    } == {"test_queries[2]": 2, "test_queries[10]": 10}
+
+
+def test_invalid_store_is_an_error(testdir):
+    store_path = testdir.tmpdir.join("store.sqlite3")
+    store_path.write("not a database")
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-queries-store", store_path
+    )
+    assert results.ret == pytest.ExitCode.USAGE_ERROR
+    results.stderr.fnmatch_lines(["*Invalid result store %s*" % store_path])
+
+
+def test_merge_results_of_partial_runs(testdir):
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.tmpdir.join("results.json").write(
+        json.dumps(
+            {
+                "test_file": {
+                    "test_foo": {"query-count": 10},
+                    "test_bar": {"query-count": 10},
+                    "test_removed": {"query-count": 10},
+                },
+                "test_other": {"test_foo": {"query-count": 10}},
+            }
+        )
+    )
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+
+        @pytest.mark.count_queries
+        def test_foo():
+            from django.db import connection
+
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+
+        @pytest.mark.count_queries
+        def test_bar():
+            pass
+        """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-merge",
+        "-k",
+        "test_foo",
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    report = json.load(results_path)
+    assert report["test_file"]["test_foo"]["query-count"] == 1
+    assert report["test_file"]["test_bar"] == {"query-count": 10}
+    assert "test_removed" not in report["test_file"]
+    assert report["test_other"] == {"test_foo": {"query-count": 10}}
+
+
+def test_merge_results_from_xdist_workers(testdir):
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.tmpdir.join("results.json").write(
+        json.dumps(
+            {
+                "test_module": {
+                    "test_foo[0]": {"query-count": 10},
+                    "test_foo[1]": {"query-count": 10},
+                    "test_removed": {"query-count": 10},
+                }
+            }
+        )
+    )
+    script = testdir.makepyfile(
+        test_module="""
+        import pytest
+
+        @pytest.mark.parametrize("foo", range(4))
+        @pytest.mark.count_queries
+        def test_foo(foo):
+            pass
+        """
+    )
+    shutil.copytree(os.path.dirname(__file__), os.path.join(str(testdir) + "/tests"))
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-merge",
+        "-n",
+        "2",
+        "-k",
+        "not foo[0]",
+        script,
+    )
+    results.assert_outcomes(3, 0, 0)
+
+    report = json.load(results_path)
+    assert sorted(report["test_module"]) == [
+        "test_foo[0]",
+        "test_foo[1]",
+        "test_foo[2]",
+        "test_foo[3]",
+    ]
+    assert report["test_module"]["test_foo[0]"] == {"query-count": 10}
+    assert report["test_module"]["test_foo[1]"]["query-count"] == 0
+
+
+def test_merge_invalid_results_file_is_an_error(testdir):
+    results_path = testdir.tmpdir.join("results.json")
+    results_path.write("[]")
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-merge",
+    )
+    assert results.ret == pytest.ExitCode.USAGE_ERROR
+    results.stderr.fnmatch_lines(["*The report %s is not a dictionary" % results_path])
+
+
+UNSTABLE_TEST_QUERY = """
+    import itertools
+
+    import pytest
+
+    counter = itertools.count()
+
+    @pytest.mark.count_queries(repeat=4)
+    def test_unstable():
+        from django.db import connection
+
+        # The first run executes an additional query
+        with connection.cursor() as cursor:
+            if next(counter) == 0:
+                cursor.execute("SELECT 1;")
+            cursor.execute("SELECT 2;")
+
+    @pytest.mark.count_queries
+    def test_stable(count_queries):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+        assert len(count_queries) == 1
+"""
+
+
+@pytest.mark.parametrize("capture_mode", ("full", "count"))
+def test_repeat_detects_unstable_query_counts(testdir, capture_mode):
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(test_file=UNSTABLE_TEST_QUERY)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS,
+        "--django-db-bench",
+        results_path,
+        "--django-queries-repeat",
+        "3",
+        "--django-queries-capture",
+        capture_mode,
+    )
+    results.assert_outcomes(2, 0, 0)
+
+    expected_results = {
+        "test_file": {
+            "test_unstable": {
+                "query-count": 1,
+                "data-query-count": 1,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases(
+                    {
+                        "query-count": 1,
+                        "data-query-count": 1,
+                        "query-count-min": 1,
+                        "query-count-max": 2,
+                        "query-count-mode": 1,
+                        "unstable": True,
+                        "statements": {"SELECT": 1},
+                        "rows-fetched": 0,
+                        "rows-affected": 0,
+                    }
+                ),
+                "statements": {"SELECT": 1},
+                "similar": 0,
+                "query-count-min": 1,
+                "query-count-max": 2,
+                "query-count-mode": 1,
+                "unstable": True,
+                "rows-fetched": 0,
+                "rows-affected": 0,
+            },
+            "test_stable": {
+                "query-count": 1,
+                "data-query-count": 1,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases(
+                    {
+                        "query-count": 1,
+                        "data-query-count": 1,
+                        "query-count-min": 1,
+                        "query-count-max": 1,
+                        "query-count-mode": 1,
+                        "unstable": False,
+                        "statements": {"SELECT": 1},
+                        "rows-fetched": 0,
+                        "rows-affected": 0,
+                    }
+                ),
+                "statements": {"SELECT": 1},
+                "similar": 0,
+                "query-count-min": 1,
+                "query-count-max": 1,
+                "query-count-mode": 1,
+                "unstable": False,
+                "rows-fetched": 0,
+                "rows-affected": 0,
+            },
+        }
+    }
+    if capture_mode == "count":
+        # The rows are only counted in the full mode
+        for test_results in expected_results["test_file"].values():
+            strip_rows(test_results)
+    assert strip_timings(json.load(results_path)) == expected_results
+
+
+def test_repeat_passes_the_test_arguments(testdir):
+    """Ensure the repeated tests get their fixtures and parameters, and that
+    the tests that are not repeated are called by the other implementations
+    of the call hook."""
+    testdir.makeconftest(
+        """
+        import pytest
+
+        called = []
+
+        @pytest.fixture
+        def value():
+            return 1
+
+        def pytest_pyfunc_call(pyfuncitem):
+            called.append(pyfuncitem.name)
+
+        def pytest_sessionfinish(session):
+            assert called == ["test_not_repeated"], called
+        """
+    )
+    testdir.makepyfile(
+        test_file="""
+        from unittest import mock
+
+        import pytest
+        from django.test import override_settings
+
+        class TestRepeat:
+            @pytest.mark.count_queries(repeat=2)
+            @pytest.mark.parametrize("param", (2,))
+            def test_repeated(self, value, param):
+                assert (value, param) == (1, 2)
+
+        @pytest.mark.count_queries(repeat=2, cold_cache=True)
+        @override_settings(DEBUG=False)
+        @mock.patch("os.getcwd")
+        def test_repeated_decorated(getcwd, value):
+            assert isinstance(getcwd, mock.Mock)
+            assert value == 1
+
+        @pytest.mark.count_queries
+        def test_not_repeated(value):
+            assert value == 1
+        """
+    )
+    results = testdir.runpytest(*DEFAULT_PYTEST_FLAGS)
+    results.assert_outcomes(3, 0, 0)
+    assert results.ret == 0
+
+
+def test_repeat_keeps_the_queries_of_the_fixtures(testdir):
+    """Ensure only the queries of the previous passes are forgotten, the totals
+    of the repeated tests remaining the ones of the tests that are not."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+        from django.db import connection
+
+        def run_queries(count):
+            with connection.cursor() as cursor:
+                for _ in range(count):
+                    cursor.execute("SELECT 1;")
+
+        @pytest.fixture
+        def setup_queries(count_queries):
+            with count_queries.section("setup"):
+                run_queries(2)
+
+        @pytest.mark.count_queries
+        def test_not_repeated(setup_queries):
+            run_queries(1)
+
+        @pytest.mark.count_queries(repeat=2)
+        def test_repeated(setup_queries):
+            run_queries(1)
+
+        @pytest.mark.count_queries(cold_cache=True)
+        def test_cold_cache(setup_queries):
+            run_queries(1)
+        """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(3, 0, 0)
+
+    results = json.load(results_path)["test_file"]
+    expected_count = results["test_not_repeated"]["query-count"]
+    assert expected_count == 3
+    for name in ("test_repeated", "test_cold_cache"):
+        test_results = results[name]
+        assert test_results["query-count"] == expected_count, name
+        assert test_results["sections"]["setup"]["query-count"] == 2, name
+        phases = test_results["phases"]
+        assert phases["setup"]["query-count"] == 2, name
+        assert phases["call"]["query-count"] == 1, name
+        assert sum(phase["query-count"] for phase in phases.values()) == 3, name
+
+
+def test_invalid_repeat_count(testdir):
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+
+        @pytest.mark.count_queries(repeat=0)
+        def test_foo():
+            pass
+        """
+    )
+    results = testdir.runpytest(*DEFAULT_PYTEST_FLAGS)
+    results.assert_outcomes(0, 0, 1)
+    results.stdout.fnmatch_lines(["*Invalid repeat count: 0, expected at least 1"])
+
+
+COLD_CACHE_TEST_QUERY = """
+    import pytest
+    from django.core.cache import cache
+
+    def get_value():
+        from django.db import connection
+
+        value = cache.get("value")
+        if value is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+                value = cursor.fetchone()[0]
+            cache.set("value", value)
+        return value
+
+    def test_warm_up_cache():
+        assert get_value() == 1
+
+    @pytest.mark.count_queries(cold_cache=True)
+    def test_cached_value():
+        assert get_value() == 1
+"""
+
+
+def test_cold_and_warm_cache_query_counts(testdir):
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(test_file=COLD_CACHE_TEST_QUERY)
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(2, 0, 0)
+
+    assert strip_timings(json.load(results_path)) == {
+        "test_file": {
+            "test_cached_value": {
+                "query-count": 0,
+                "data-query-count": 0,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases(
+                    {
+                        "query-count-cold": 1,
+                        "query-count-warm": 0,
+                        "rows-fetched": 0,
+                        "rows-affected": 0,
+                    }
+                ),
+                "similar": 0,
+                "query-count-cold": 1,
+                "query-count-warm": 0,
+                "rows-fetched": 0,
+                "rows-affected": 0,
+            }
+        }
+    }
+
+
+def test_warm_cache_query_count_excludes_the_fixtures(testdir):
+    """Ensure the warm count is taken from the test body as the cold count,
+    without the queries of the teardown of the fixtures."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file=COLD_CACHE_TEST_QUERY
+        + """
+    @pytest.fixture
+    def teardown_queries():
+        yield
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            for _ in range(3):
+                cursor.execute("SELECT 2;")
+
+    @pytest.mark.count_queries(cold_cache=True)
+    def test_cached_value_with_teardown(teardown_queries):
+        assert get_value() == 1
+    """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(3, 0, 0)
+
+    results = json.load(results_path)["test_file"]["test_cached_value_with_teardown"]
+    assert results["data-query-count"] == 3
+    assert results["query-count-cold"] == 1
+    assert results["query-count-warm"] == 0
+    assert results["phases"]["call"]["query-count-warm"] == 0
+
+
+def test_explain_select_queries(testdir):
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+        from django.db import connection
+
+        @pytest.fixture
+        def book_table():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "CREATE TABLE IF NOT EXISTS book (id INTEGER PRIMARY KEY, title TEXT)"
+                )
+
+        @pytest.mark.count_queries(explain=True)
+        def test_explain(book_table):
+            with connection.cursor() as cursor:
+                for book_id in range(3):
+                    cursor.execute("SELECT * FROM book WHERE id = %s", [book_id])
+                cursor.execute("SELECT * FROM book WHERE title = %s ORDER BY title", ["a"])
+                cursor.execute("SELECT * FROM book ORDER BY title")
+                cursor.execute("INSERT INTO book (title) VALUES (%s)", ["a"])
+        """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    results = json.load(results_path)["test_file"]["test_explain"]
+    # The EXPLAIN queries are not counted
+    assert results["query-count"] == 7
+    assert results["explain"] == {
+        "SELECT * FROM book ORDER BY title": {
+            "plan": ["SCAN book", "USE TEMP B-TREE FOR ORDER BY"],
+            "flags": ["scan", "temp-b-tree"],
+        },
+        "SELECT * FROM book WHERE id = ?": {
+            "plan": ["SEARCH book USING INTEGER PRIMARY KEY (rowid=?)"],
+            "flags": [],
+        },
+        "SELECT * FROM book WHERE title = ? ORDER BY title": {
+            "plan": ["SCAN book"],
+            "flags": ["scan"],
+        },
+    }
+
+
+def test_rows_fetched_and_affected(testdir):
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+        from django.db import connection
+
+        @pytest.mark.count_queries
+        def test_rows():
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE TABLE IF NOT EXISTS r (id INTEGER)")
+                cursor.executemany(
+                    "INSERT INTO r VALUES (%s)", [(i,) for i in range(5)]
+                )
+                cursor.execute("UPDATE r SET id = id + 1 WHERE id < 2")
+
+                cursor.execute("SELECT id FROM r")
+                assert len(cursor.fetchall()) == 5
+                cursor.execute("SELECT id FROM r WHERE id = 3")
+                assert cursor.fetchone() is not None
+                assert cursor.fetchone() is None
+                cursor.execute("SELECT id FROM r")
+                assert len(list(cursor)) == 5
+                cursor.execute("SELECT id FROM r")
+                assert len(cursor.fetchmany(2)) == 2
+        """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    results = json.load(results_path)["test_file"]["test_rows"]
+    assert results["rows-fetched"] == 13
+    assert results["rows-affected"] == 7
+    assert results["worst-query"] == [["INSERT INTO r VALUES (...)", 5]]
+
+
+def test_rows_returned_by_data_modification_queries(testdir):
+    """Ensure the rows returned by 'INSERT ... RETURNING' are counted as
+    affected, SQLite only counting them once fetched."""
+    results_path = testdir.tmpdir.join("results.json")
+    testdir.makepyfile(
+        test_file="""
+        import pytest
+        from django.db import connection
+
+        @pytest.mark.count_queries
+        def test_rows():
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE TABLE IF NOT EXISTS r (id INTEGER)")
+                cursor.execute("INSERT INTO r VALUES (1), (2), (3) RETURNING id")
+                assert len(cursor.fetchall()) == 3
+        """
+    )
+    results = testdir.runpytest(
+        *DEFAULT_PYTEST_FLAGS, "--django-db-bench", results_path
+    )
+    results.assert_outcomes(1, 0, 0)
+
+    results = json.load(results_path)["test_file"]["test_rows"]
+    assert results["rows-fetched"] == 3
+    assert results["rows-affected"] == 3
+
+
+def test_rows_are_only_counted_while_capturing(testdir):
+    """Ensure the database cursors are restored once the capture exits,
+    and are left untouched by the counting-only mode."""
+    testdir.makepyfile(
+        test_file="""
+        from django.db import connection
+
+        from pytest_django_queries.capture import QueryCapture
+        from pytest_django_queries.rows import RowCountingCursor
+
+        def test_rows():
+            with connection.cursor() as cursor:
+                with QueryCapture([connection]) as capture:
+                    cursor.execute("SELECT 1")
+                    assert isinstance(cursor.cursor, RowCountingCursor)
+                    assert cursor.fetchone() == (1,)
+                assert not isinstance(cursor.cursor, RowCountingCursor)
+                cursor.execute("SELECT 1")
+                assert cursor.fetchone() == (1,)
+            assert capture.get_results()["rows-fetched"] == 1
+
+            with QueryCapture([connection], mode="count") as capture:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                    assert not isinstance(cursor.cursor, RowCountingCursor)
+            assert "rows-fetched" not in capture.get_results()
+        """
+    )
+    results = testdir.runpytest(*DEFAULT_PYTEST_FLAGS)
+    results.assert_outcomes(1, 0, 0)
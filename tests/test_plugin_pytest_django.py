@@ -4,7 +4,7 @@ import json
 
 import pytest
 
-from tests.conftest import DEFAULT_PYTEST_FLAGS
+from tests.conftest import DEFAULT_PYTEST_FLAGS, call_phases, strip_timings
 
 
 @pytest.mark.parametrize(
@@ -70,6 +70,27 @@ def test_detect_pytest_django(
 
     # Ensure the results file was created
     assert results_path.exists()
-    assert json.loads(results_path.read_bytes()) == {
-        "test_file": {"test_count_db_query_number": {"query-count": 2, "duplicates": 0}}
+    assert strip_timings(json.loads(results_path.read_bytes())) == {
+        "test_file": {
+            "test_count_db_query_number": {
+                "query-count": 2,
+                "data-query-count": 2,
+                "transaction-count": 0,
+                "duplicates": 0,
+                "phases": call_phases(
+                    {
+                        "query-count": 2,
+                        "data-query-count": 2,
+                        "statements": {"SELECT": 2},
+                        "rows-fetched": 1,
+                        "rows-affected": 0,
+                    }
+                ),
+                "statements": {"SELECT": 2},
+                "similar": 0,
+                "rows-fetched": 1,
+                "rows-affected": 0,
+                "worst-query": [["SELECT ?;", 1]],
+            }
+        }
     }
@@ -0,0 +1,23 @@
+import tracemalloc
+
+from pytest_django_queries.resources import ResourceMeter
+
+
+def test_meter_measures_the_memory_peak_between_snapshots():
+    was_tracing = tracemalloc.is_tracing()
+    with ResourceMeter() as meter:
+        data = bytearray(1024 * 1024)
+        del data
+        start = meter.snapshot()
+        data = bytearray(10 * 1024)
+        del data
+        end = meter.snapshot()
+
+    assert tracemalloc.is_tracing() is was_tracing
+    results = meter.get_results()
+    assert set(results) == {"wall-time", "cpu-time", "memory-peak"}
+    assert results["wall-time"] >= 0
+    assert results["cpu-time"] >= 0
+    # The peak of the whole measure is the highest of the intermediate peaks
+    assert results["memory-peak"] >= 1024
+    assert 10 <= meter.get_results(start, end)["memory-peak"] < 1024
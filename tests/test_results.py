@@ -0,0 +1,124 @@
+import io
+import json
+
+import pytest
+
+from pytest_django_queries.results import (
+    FIXTURES_MODULE_NAME,
+    ReportError,
+    ResultAccumulator,
+    iter_report_modules,
+    merge_report,
+    merge_results,
+    read_spilled_results,
+)
+
+
+def test_accumulator_keeps_results_in_memory():
+    accumulator = ResultAccumulator()
+    accumulator.add("test_a", "test_foo", {"query-count": 1})
+    accumulator.add("test_a", "test_foo", {"query-count": 2})
+    accumulator.merge({"test_a": {"test_bar": {"query-count": 3}}})
+    assert accumulator.results == {
+        "test_a": {"test_foo": {"query-count": 2}, "test_bar": {"query-count": 3}}
+    }
+
+
+def test_accumulator_spills_results_in_batches(tmpdir):
+    spill_path = str(tmpdir.join("gw0"))
+    accumulator = ResultAccumulator(spill_path=spill_path, batch_size=2)
+
+    accumulator.add("test_a", "test_foo[\t]", {"query-count": 1})
+    assert not tmpdir.join("gw0").check()
+
+    accumulator.add("test_a", "test_bar", {"query-count": 2})
+    assert len(tmpdir.join("gw0").readlines()) == 2
+
+    accumulator.add("test_b", "test_foo", {"query-count": 3})
+    accumulator.flush()
+    assert accumulator.results == {}
+    assert read_spilled_results(str(tmpdir)) == {
+        "test_a": {"test_foo[\t]": {"query-count": 1}, "test_bar": {"query-count": 2}},
+        "test_b": {"test_foo": {"query-count": 3}},
+    }
+
+
+def test_merge_report_prunes_tests_that_no_longer_exist():
+    report = {
+        "test_a": {"test_foo": {"query-count": 1}, "test_removed": {"query-count": 2}},
+        "test_b": {"test_bar": {"query-count": 3}},
+        "test_c": {"test_removed": {"query-count": 4}},
+    }
+    test_results = {"test_a": {"test_foo": {"query-count": 5}}}
+    collected_tests = {"test_a": {"test_foo", "test_new"}, "test_c": set()}
+    assert merge_report(report, test_results, collected_tests) == {
+        "test_a": {"test_foo": {"query-count": 5}},
+        "test_b": {"test_bar": {"query-count": 3}},
+    }
+
+
+def test_fixture_results_are_summed_between_processes():
+    test_results = {}
+    fixture_results = {
+        "query-count": 2,
+        "db-time": 0.5,
+        "db-time-max": 0.3,
+        "scope": "session",
+        "phases": {"setup": {"query-count": 2}},
+    }
+    merge_results(
+        test_results, {FIXTURES_MODULE_NAME: {"db[session]": fixture_results}}
+    )
+    merge_results(
+        test_results,
+        {
+            FIXTURES_MODULE_NAME: {
+                "db[session]": dict(fixture_results, **{"db-time-max": 0.1})
+            },
+            "test_a": {"test_foo": {"query-count": 1}},
+        },
+    )
+    assert test_results == {
+        FIXTURES_MODULE_NAME: {
+            "db[session]": {
+                "query-count": 4,
+                "db-time": 1.0,
+                "db-time-max": 0.3,
+                "scope": "session",
+                "phases": {"setup": {"query-count": 4}},
+            }
+        },
+        "test_a": {"test_foo": {"query-count": 1}},
+    }
+
+    # The fixtures of a previous report are replaced instead of being summed
+    report = {FIXTURES_MODULE_NAME: {"old[function]": {"query-count": 1}}}
+    assert merge_report(report, test_results, {}) == test_results
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, 4096))
+def test_report_modules_are_read_incrementally(chunk_size):
+    report = {
+        "test_b": {"test_foo": {"query-count": 1, "top-fingerprints": [["é", 2]]}},
+        "test_a": {"test_%d" % index: {"query-count": index} for index in range(50)},
+        "test_empty": {},
+    }
+    fp = io.StringIO(json.dumps(report, indent=2))
+    assert list(iter_report_modules(fp, chunk_size=chunk_size)) == list(report.items())
+    assert list(iter_report_modules(io.StringIO(" {} "))) == []
+
+
+@pytest.mark.parametrize(
+    "content, error",
+    (
+        ("", "not valid json"),
+        ("[]", "not a dictionary"),
+        ('{"test_a": {}', "not valid json"),
+        ('{"test_a": {},}', "not valid json"),
+        ('{"test_a": {}} {}', "not valid json"),
+        ('{"test_a" {}}', "not valid json"),
+    ),
+)
+def test_invalid_report_cannot_be_read_incrementally(content, error):
+    with pytest.raises(ReportError, match=error):
+        list(iter_report_modules(io.StringIO(content), chunk_size=2))
@@ -0,0 +1,113 @@
+import pytest
+
+from pytest_django_queries import sql
+
+
+@pytest.mark.parametrize(
+    "input_, output",
+    [
+        (
+            'SELECT "id" FROM "book" WHERE "id" = %s',
+            'SELECT "id" FROM "book" WHERE "id" = ?',
+        ),
+        (
+            'SELECT "id" FROM "book" WHERE "id" = 12',
+            'SELECT "id" FROM "book" WHERE "id" = ?',
+        ),
+        ("SELECT 1.5, 'it''s', col_1 FROM t2", "SELECT ?, ?, col_1 FROM t2"),
+        (
+            "SELECT * FROM book WHERE id IN (%s, %s, %s)",
+            "SELECT * FROM book WHERE id IN (...)",
+        ),
+        (
+            "SELECT * FROM book WHERE id IN (1,2)",
+            "SELECT * FROM book WHERE id IN (...)",
+        ),
+        ("INSERT INTO t VALUES (%s, %s), (%s, %s)", "INSERT INTO t VALUES (...)"),
+        (
+            "SELECT %(name)s, $1, :key, id::text FROM t",
+            "SELECT ?, ?, ?, id::text FROM t",
+        ),
+        ("SELECT  a\n  FROM   t ", "SELECT a FROM t"),
+        ('SAVEPOINT "s1_x1"', 'SAVEPOINT "s1_x1"'),
+    ],
+)
+def test_fingerprint_sql(input_, output):
+    assert sql.fingerprint_sql(input_) == output
+
+
+def test_fingerprint_sql_is_identical_for_n_plus_one_queries():
+    fingerprints = {
+        sql.fingerprint_sql("SELECT * FROM book WHERE author_id = %d" % author_id)
+        for author_id in range(10)
+    }
+    assert fingerprints == {"SELECT * FROM book WHERE author_id = ?"}
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("BEGIN", True),
+        ('SAVEPOINT "s1_x1"', True),
+        ('RELEASE SAVEPOINT "s1_x1"', True),
+        ('ROLLBACK TO SAVEPOINT "s1_x1"', True),
+        ("start transaction", True),
+        ("COMMIT", True),
+        ("SELECT 1", False),
+        ("INSERT INTO t VALUES (1)", False),
+        ("SELECT beginning FROM t", False),
+        ("BEGINNING", False),
+    ],
+)
+def test_is_transaction_control(query, expected):
+    assert sql.is_transaction_control(query) is expected
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        (
+            'SELECT "a"."id" FROM "a" INNER JOIN "b" ON ("a"."b_id" = "b"."id")',
+            ("SELECT", ("a", "b")),
+        ),
+        ("INSERT INTO `t` VALUES (...)", ("INSERT", ("t",))),
+        ('UPDATE "t" SET "x" = ?', ("UPDATE", ("t",))),
+        (
+            'DELETE FROM "public"."t" WHERE "id" IN (SELECT "id" FROM "u")',
+            ("DELETE", ("public.t", "u")),
+        ),
+        ("WITH x AS (SELECT * FROM t) SELECT * FROM x", ("SELECT", ("t",))),
+        ("SELECT ?", ("SELECT", ())),
+        ("CREATE TABLE t (id INTEGER)", ("OTHER", ())),
+        (
+            'SELECT EXTRACT(MONTH FROM "a"."created") FROM "a"',
+            ("SELECT", ("a",)),
+        ),
+        (
+            'SELECT TRIM(BOTH ? FROM "a"."name"), SUBSTRING("a"."name" FROM ? FOR ?) '
+            'FROM "a"',
+            ("SELECT", ("a",)),
+        ),
+        (
+            'SELECT * FROM "a" WHERE "a"."x" IS NOT DISTINCT FROM "a"."y" '
+            'AND "a"."z" IS DISTINCT FROM ?',
+            ("SELECT", ("a",)),
+        ),
+        (
+            'SELECT * FROM "a" WHERE EXISTS(SELECT ? FROM "b" '
+            'WHERE EXTRACT(YEAR FROM "b"."created") = ?)',
+            ("SELECT", ("a", "b")),
+        ),
+        (
+            'SELECT * FROM (SELECT COALESCE("x", ?) FROM "a") "sub"',
+            ("SELECT", ("a",)),
+        ),
+        (
+            'INSERT INTO "a" ("id") VALUES (?) ON CONFLICT("id") DO UPDATE SET "id" = ?',
+            ("INSERT", ("a",)),
+        ),
+        ('SELECT * FROM "a" FOR UPDATE NOWAIT', ("SELECT", ("a",))),
+    ],
+)
+def test_classify_statement(query, expected):
+    assert sql.classify_statement(query) == expected
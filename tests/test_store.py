@@ -0,0 +1,58 @@
+import pytest
+
+from pytest_django_queries.store import ResultStore, StoreError
+
+
+@pytest.fixture
+def store(tmpdir):
+    with ResultStore(str(tmpdir.join("store.sqlite3"))) as store:
+        yield store
+
+
+def test_add_and_get_runs(store):
+    first = store.add_run(
+        {"module": {"test_foo": {"query-count": 1}}},
+        label="v1",
+        git_sha="abc",
+        git_branch="main",
+    )
+    second = store.add_run({"module": {"test_foo": {"query-count": 2}}})
+
+    assert store.get_results(first) == {"module": {"test_foo": {"query-count": 1}}}
+    assert store.get_results(second) == {"module": {"test_foo": {"query-count": 2}}}
+    assert [
+        (run["id"], run["label"], run["git_sha"], run["git_branch"], run["tests"])
+        for run in store.get_runs()
+    ] == [(second, None, None, None, 1), (first, "v1", "abc", "main", 1)]
+
+
+def test_resolve_run(store):
+    first = store.add_run({}, label="v1")
+    second = store.add_run({}, label="v1")
+    third = store.add_run({})
+
+    assert store.resolve_run(str(first)) == first
+    assert store.resolve_run("v1") == second
+    assert store.resolve_run("latest") == third
+    assert store.resolve_run("latest~2") == first
+
+    for reference in ("4", "v2", "latest~3", "latest~a"):
+        with pytest.raises(StoreError):
+            store.resolve_run(reference)
+
+
+def test_prune_keeps_latest_runs(store):
+    for count in range(5):
+        store.add_run({"module": {"test_foo": {"query-count": count}}})
+
+    assert store.prune(2) == 3
+    assert [run["id"] for run in store.get_runs()] == [5, 4]
+    (remaining,) = store.db.execute("SELECT COUNT(*) FROM results").fetchone()
+    assert remaining == 2
+
+
+def test_invalid_store_file(tmpdir):
+    path = tmpdir.join("store.sqlite3")
+    path.write("not a database")
+    with pytest.raises(StoreError):
+        ResultStore(str(path))
@@ -0,0 +1,17 @@
+import pytest
+
+from pytest_django_queries import utils
+
+
+@pytest.mark.parametrize(
+    "values, percent, expected",
+    [
+        ([], 50, 0),
+        ([3], 95, 3),
+        ([1, 2, 3, 4], 50, 2),
+        (list(range(1, 21)), 95, 19),
+        (list(range(1, 21)), 100, 20),
+    ],
+)
+def test_percentile(values, percent, expected):
+    assert utils.percentile(values, percent) == expected